@@ -4,7 +4,7 @@
 // available at http://aws.amazon.com/agreement or other written agreement between
 // Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
 
-import { useState, useRef, useEffect, ReactNode } from "react";
+import { useState, useRef, useEffect, useMemo, ReactNode } from "react";
 import {
   Box,
   Button,
@@ -36,6 +36,7 @@ function ListMessages() {
   const forwardEmailModalRef = useRef<ModalOpenState>(null);
   const [selectedItems, setSelectedItems] = useState<readonly Email[]>([]);
   const messages = useGetMessages();
+  const loadedMessages = useMemo(() => messages.data?.pages.flatMap(page => page.items) ?? [], [messages.data]);
   const message = useGetMessage(selectedItems[0]?.CaseID);
   const EmptyMessagePane =
     <Box variant="div" padding={{horizontal: 'xl', vertical: 'xxxl'}}>
@@ -117,7 +118,7 @@ function ListMessages() {
   }
 
   const { items, actions, filteredItemsCount, /* collectionProps, */ /* filterProps,*/ propertyFilterProps/* , paginationProps */ } = useCollection(
-    messages.data ?? [],
+    loadedMessages,
     {
       filtering: {
         empty:
@@ -204,7 +205,7 @@ function ListMessages() {
         ?
           <Header
             variant="h1"
-            counter={`(${messages.data?.length ?? 0})`}
+            counter={`(${loadedMessages.length}${messages.hasNextPage ? "+" : ""})`}
             actions={
               <SpaceBetween direction="horizontal" size="xs">
                 <Box>
@@ -259,7 +260,7 @@ function ListMessages() {
         selectedItems={selectedItems}
         selectionType="single"
         stickyHeader
-        totalItemsCount={messages.data?.length ?? 0}
+        totalItemsCount={loadedMessages.length}
         trackBy={"CaseID"}
         variant="full-page"
         visibleSections={[
@@ -270,7 +271,7 @@ function ListMessages() {
         }}
 
         filter={
-          ((messages.data && messages.data?.length > 0) && !(messages.isLoading || messages.isRefetching)) &&
+          (loadedMessages.length > 0 && !(messages.isLoading || messages.isRefetching)) &&
           <PropertyFilter
             {...propertyFilterProps}
             filteringPlaceholder="Find messages"
@@ -283,6 +284,12 @@ function ListMessages() {
           />
         }
       />
+      {
+        messages.hasNextPage &&
+        <Box textAlign="center" padding={{vertical: 'l'}}>
+          <Button loading={messages.isFetchingNextPage} onClick={() => messages.fetchNextPage()}>Load more messages</Button>
+        </Box>
+      }
     </>
   )
 }
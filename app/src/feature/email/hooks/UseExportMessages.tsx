@@ -5,22 +5,52 @@ type ExportMessageData = {
   case_id: string[];
 }
 
-const exportMessage = async(messageData: ExportMessageData): Promise<any> => {
-  const { data } = await axios.post(`/messages/export`, messageData, {
-    headers: {
-      "Accept": "text/csv"
+type ExportJob = {
+  job_id: string;
+  status: "Pending" | "Running" | "Completed" | "Failed";
+  url?: string;
+  error?: string;
+}
+
+const EXPORT_POLL_INTERVAL_MS = 2000;
+// The API fails jobs that run longer than the export function can, polling stops a little later in any case
+const EXPORT_TIMEOUT_MS = 20 * 60 * 1000;
+// Polling stops after this many failed status requests in a row
+const EXPORT_MAX_POLL_ERRORS = 3;
+
+const exportMessage = async(messageData: ExportMessageData): Promise<ExportJob> => {
+  const { data: job } = await axios.post<ExportJob>(`/messages/export`, messageData);
+  const deadline = Date.now() + EXPORT_TIMEOUT_MS;
+  let status = job;
+  let pollErrors = 0;
+  while (status.status === "Pending" || status.status === "Running") {
+    if (Date.now() >= deadline) {
+      throw new Error("Export did not finish in time");
     }
-  });
-  return data;
+    await new Promise((resolve) => setTimeout(resolve, EXPORT_POLL_INTERVAL_MS));
+    try {
+      const { data } = await axios.get<ExportJob>(`/messages/export/${job.job_id}`);
+      status = data;
+      pollErrors = 0;
+    } catch (error) {
+      pollErrors += 1;
+      if (pollErrors >= EXPORT_MAX_POLL_ERRORS) {
+        throw error;
+      }
+    }
+  }
+  if (status.status === "Failed") {
+    throw new Error(status.error ?? "Export failed");
+  }
+  return status;
 }
 
 export const useExportMessage = () => {
-  return useMutation<any, Error, ExportMessageData>({
+  return useMutation<ExportJob, Error, ExportMessageData>({
     mutationFn: exportMessage,
-    onSuccess: async (messages) => {
-      const downloadUrl = window.URL.createObjectURL(new Blob([atob(messages.body)]));
+    onSuccess: async (job) => {
       const link = document.createElement('a');
-      link.href = downloadUrl;
+      link.href = job.url!;
       link.setAttribute('download', 'exported_messages.csv');
       document.body.appendChild(link);
       link.click();
@@ -30,4 +60,4 @@ export const useExportMessage = () => {
       console.error("Error exporting messages:", error);
     }
   });
-};
\ No newline at end of file
+};
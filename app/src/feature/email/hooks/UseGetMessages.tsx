@@ -1,16 +1,27 @@
 import axios from "axios";
-import { useQuery } from "@tanstack/react-query";
+import { InfiniteData, useInfiniteQuery } from "@tanstack/react-query";
 import { Email } from "../../../foundation/email/types";
 
-const getMessages = async(): Promise<Email[]> => {
-  const response = await axios.get(`/messages`, {withCredentials: false});
+type MessagesPage = {
+  items: Email[];
+  next_token: string | null;
+}
+
+const getMessages = async(nextToken?: string): Promise<MessagesPage> => {
+  const response = await axios.get<MessagesPage>(`/messages`, {
+    withCredentials: false,
+    params: nextToken ? { next_token: nextToken } : undefined,
+  });
   return response.data;
 }
 
+// Messages are listed one page at a time, newest first, the next page is requested with the token of the last one
 export const useGetMessages = () => {
-  return useQuery<Email[], Error>({
+  return useInfiniteQuery<MessagesPage, Error, InfiniteData<MessagesPage>, string[], string | undefined>({
     queryKey: ['Messages'],
-    queryFn: () => getMessages(),
+    queryFn: ({ pageParam }) => getMessages(pageParam),
+    initialPageParam: undefined,
+    getNextPageParam: (lastPage) => lastPage.next_token ?? undefined,
     retry: false,
   });
-};
\ No newline at end of file
+};
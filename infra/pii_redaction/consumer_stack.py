@@ -9,6 +9,10 @@ from aws_cdk import (
     aws_ec2 as ec2,
     aws_sns as sns,
     aws_sns_subscriptions as sns_subscriptions,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_events as events,
+    aws_events_targets as events_targets,
     aws_ecr as ecr,
     aws_kms as kms,
     aws_logs as logs,
@@ -43,6 +47,11 @@ class ConsumerStack(Stack):
         raw_bucket_name = Fn.import_value("RawBucket")
         redacted_bucket_name = Fn.import_value("RedactedBucket")
         inventory_table_name = Fn.import_value("EmailInventoryTableName")
+        inventory_status_shards = Fn.import_value("EmailInventoryStatusShards")
+        redaction_cache_table_name = Fn.import_value("RedactionCacheTableName")
+        redaction_cache_key_secret_arn = Fn.import_value("RedactionCacheKeySecretArn")
+        ingestion_table_name = Fn.import_value("IngestionTableName")
+        attachment_jobs_table_name = Fn.import_value("AttachmentJobsTableName")
         lambda_role_arn = Fn.import_value("LambdaRole")
         ses_role_arn = Fn.import_value("SESRole")
         security_group_id = Fn.import_value("SecurityGroupID")
@@ -299,6 +308,31 @@ class ConsumerStack(Stack):
             code=lambda_.Code.from_asset(os.path.join(os.path.dirname(__file__), 'lambda/attachmentProcessing/lambda-layer/layer_content.zip')),
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_12]
         )
+        # Create a Lambda layer with the modules shared by the email and attachment processing lambdas (lazy clients, stage metrics)
+        layer_shared = lambda_.LayerVersion(
+            self,
+            "piiRedactionSharedLambdaLayer",
+            code=lambda_.Code.from_asset(os.path.join(os.path.dirname(__file__), 'lambda/shared')),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12]
+        )
+
+        # Queue buffering the raw bucket notifications so the email processing Lambda receives them in batches
+        raw_email_dlq = sqs.Queue(
+            self,
+            "piiRedactionRawEmailDLQ",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14)
+        )
+        raw_email_queue = sqs.Queue(
+            self,
+            "piiRedactionRawEmailQueue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            # AWS recommends a visibility timeout of six times the function timeout for SQS event sources
+            visibility_timeout=Duration.seconds(6 * 900),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=raw_email_dlq)
+        )
 
         # Create a email processing Lambda function
         emailProcessing_Lambda = lambda_.Function(
@@ -313,11 +347,15 @@ class ConsumerStack(Stack):
             #vpc_subnets=ec2.SubnetSelection(subnets=supported_subnet_ids),
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
             security_groups=[security_group],
-            layers=[layer_email_processing],
+            layers=[layer_email_processing, layer_shared],
             environment={
                 "RAW_BUCKET_NAME": raw_bucket_name,
                 "REDACTED_BUCKET_NAME": redacted_bucket_name,
                 "INVENTORY_TABLE_NAME": inventory_table_name,
+                "REDACTION_CACHE_TABLE_NAME": redaction_cache_table_name,
+                "REDACTION_CACHE_KEY_SECRET_ARN": redaction_cache_key_secret_arn,
+                "INGESTION_TABLE_NAME": ingestion_table_name,
+                "STATUS_SHARDS": inventory_status_shards,
                 # "SECRET_NAME": secret_name,
                 "SUCCESS_TOPIC_ARN": success_topic.topic_arn,
                 "FAILURE_TOPIC_ARN": failure_topic.topic_arn,
@@ -331,7 +369,30 @@ class ConsumerStack(Stack):
             log_group=logs.LogGroup(self, 'piiRedactionemailProcessingLambdaLogGroup'
                     #,log_group_name=stackPrefix(resource_prefix, "piiRedactionemailProcessingLambdaLogGroup")
             ),
+            # Published versions are restored from a snapshot taken after initialization instead of cold starting
+            snap_start=lambda_.SnapStartConf.ON_PUBLISHED_VERSIONS,
         )
+        # SnapStart only applies to published versions, the event sources invoke the latest version through an alias
+        emailProcessing_alias = lambda_.Alias(
+            self,
+            "piiRedactionemailProcessingLambdaAlias",
+            alias_name="live",
+            version=emailProcessing_Lambda.current_version
+        )
+        # Environment shared by the attachment processing and BDA completion Lambda functions
+        attachment_environment = {
+            "REDACTED_BUCKET_NAME": redacted_bucket_name,
+            "INVENTORY_TABLE_NAME": inventory_table_name,
+            "FAILURE_TOPIC_ARN": failure_topic.topic_arn,
+            "CRM_TOPIC_ARN": crm_topic.topic_arn,
+            "HOME": "/tmp",
+            "PROJECT_NAME": cfn_bda.project_name,
+            "PROJECT_ARN": cfn_bda.attr_project_arn,
+            "ATTACHMENT_JOBS_TABLE_NAME": attachment_jobs_table_name,
+            "RETENTION": str(retention),
+            "GUARDRAIL_ID": cfn_guardrail.attr_guardrail_id,
+            "GUARDRAIL_VERSION": cfn_guardrail_version.attr_version
+        }
         # Create a attachment processing Lambda function
         attachmentProcessing_Lambda = lambda_.Function(
             self, 
@@ -343,34 +404,104 @@ class ConsumerStack(Stack):
             vpc=vpc,
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
             security_groups=[security_group],
-            layers=[layer_attachment_processing],
-            environment={
-               "REDACTED_BUCKET_NAME": redacted_bucket_name,
-               "INVENTORY_TABLE_NAME": inventory_table_name,
-               "FAILURE_TOPIC_ARN": failure_topic.topic_arn,
-               "CRM_TOPIC_ARN": crm_topic.topic_arn,
-               "HOME": "/tmp",
-               "PROJECT_NAME": cfn_bda.project_name,
-               "GUARDRAIL_ID": cfn_guardrail.attr_guardrail_id,
-               "GUARDRAIL_VERSION": cfn_guardrail_version.attr_version
-            },
+            layers=[layer_attachment_processing, layer_shared],
+            environment=attachment_environment,
             role=lambda_role,
             timeout=Duration.seconds(900),
             log_group=logs.LogGroup(self, 'piiRedactionAttachmentProcessingLambdaLogGroup'
             ),
+            snap_start=lambda_.SnapStartConf.ON_PUBLISHED_VERSIONS,
+        )
+        attachmentProcessing_alias = lambda_.Alias(
+            self,
+            "piiRedactionAttachmentProcessingLambdaAlias",
+            alias_name="live",
+            version=attachmentProcessing_Lambda.current_version
         )
         #subscribe to success to sns topic
-        success_topic.add_subscription(sns_subscriptions.LambdaSubscription(attachmentProcessing_Lambda))
+        success_topic.add_subscription(sns_subscriptions.LambdaSubscription(attachmentProcessing_alias))
+        # Create a Lambda function resuming attachment redaction when a BDA job completes, the attachment Lambda only submits the jobs
+        bdaCompletion_Lambda = lambda_.Function(
+            self, 
+            "piiRedactionBdaCompletionLambda",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler="attachmentProcessing.bda_completion_handler",
+            code=lambda_.Code.from_asset("./pii_redaction/lambda/attachmentProcessing"),
+            memory_size=4096,
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+            security_groups=[security_group],
+            layers=[layer_attachment_processing, layer_shared],
+            environment=attachment_environment,
+            role=lambda_role,
+            timeout=Duration.seconds(900),
+            log_group=logs.LogGroup(self, 'piiRedactionBdaCompletionLambdaLogGroup'
+            ),
+            snap_start=lambda_.SnapStartConf.ON_PUBLISHED_VERSIONS,
+        )
+        bdaCompletion_alias = lambda_.Alias(
+            self,
+            "piiRedactionBdaCompletionLambdaAlias",
+            alias_name="live",
+            version=bdaCompletion_Lambda.current_version
+        )
+        # BDA publishes the completion of jobs submitted with EventBridge notifications enabled to the default event bus
+        events.Rule(
+            self,
+            "piiRedactionBdaCompletionRule",
+            event_pattern=events.EventPattern(
+                source=["aws.bedrock"],
+                detail_type=[
+                    "Bedrock Data Automation Job Succeeded",
+                    "Bedrock Data Automation Job Failed With Client Error",
+                    "Bedrock Data Automation Job Failed With Service Error"
+                ]
+            ),
+            targets=[events_targets.LambdaFunction(bdaCompletion_alias, retry_attempts=8)]
+        )
+        # Create a Lambda function resuming the cases left pending when the completion of a BDA job was not handled
+        bdaSweeper_Lambda = lambda_.Function(
+            self, 
+            "piiRedactionBdaSweeperLambda",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler="attachmentProcessing.sweep_handler",
+            code=lambda_.Code.from_asset("./pii_redaction/lambda/attachmentProcessing"),
+            memory_size=4096,
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+            security_groups=[security_group],
+            layers=[layer_attachment_processing, layer_shared],
+            environment=attachment_environment,
+            role=lambda_role,
+            timeout=Duration.seconds(900),
+            log_group=logs.LogGroup(self, 'piiRedactionBdaSweeperLambdaLogGroup'
+            ),
+        )
+        events.Rule(
+            self,
+            "piiRedactionBdaSweeperRule",
+            schedule=events.Schedule.rate(Duration.minutes(30)),
+            targets=[events_targets.LambdaFunction(bdaSweeper_Lambda)]
+        )
         #Get the S3 bucket resource
         raw_bucket = s3.Bucket.from_bucket_name(self, "RawBucket", raw_bucket_name)
         # Grant the necessary permissions for S3 to invoke your Lambda function
         raw_bucket.grant_read(emailProcessing_Lambda)
-        # Add S3 Event Source to trigger the Lambda function on PUT events
+        # Add S3 Event Source to queue PUT events, the Lambda function consumes the queue in batches
         raw_bucket.add_event_notification(
             s3.EventType.OBJECT_CREATED_PUT, 
-            s3n.LambdaDestination(emailProcessing_Lambda),
+            s3n.SqsDestination(raw_email_queue),
             s3.NotificationKeyFilter(prefix="domain_emails/")
         )
+        # Only the failed messages of a batch are returned to the queue
+        emailProcessing_alias.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                raw_email_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True
+            )
+        )
         if domain != "":
             # Create SES Rule Set and Rule for Incoming Emails
             rule_set = ses.CfnReceiptRuleSet(self, "RuleSet", rule_set_name=stackPrefix(resource_prefix, "rule-set"))
@@ -1,28 +1,39 @@
 import time
 import os
-import boto3
 import json
-import fitz  # PyMuPDF for PDF processing
 from botocore.exceptions import ClientError
 from datetime import datetime, date
-from PIL import Image, ImageDraw
-import pytz
 from urllib.parse import urlparse
+from stage_metrics import StageMetrics
+from lazy_init import Lazy, client, resource, warm_up, register_before_snapshot
+from bda_project import ProjectArnResolver
+from bda_jobs import BdaJobStore, job_id_from_arn, CASE_PREFIX, REDACTED, FAILED
+from bda_poller import poll_jobs, RUNNING_STATUSES
+from pii_assessment import assess_texts
+from phrase_matcher import PhraseMatcher
+from pdf_pages import can_fork, find_word_rects, page_word_rects
+from attachment_io import downloaded, open_pdf, open_image, save_pdf, source_size, upload
 
 
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
-dynamodb = boto3.resource('dynamodb')
-ses = boto3.client('ses')
+# AWS clients are created on first use, PyMuPDF and PIL are imported by the code paths redacting PDFs and images
+s3 = client('s3')
+sns = client('sns')
+dynamodb = resource('dynamodb')
+ses = client('ses')
 
-bda = boto3.client('bedrock-data-automation')
-bda_client = boto3.client('bedrock-data-automation-runtime')
-bedrock_runtime = boto3.client('bedrock-runtime')
+bda = client('bedrock-data-automation')
+bda_client = client('bedrock-data-automation-runtime')
+bedrock_runtime = client('bedrock-runtime')
 redacted_bucket = os.environ['REDACTED_BUCKET_NAME']
 table_name = os.environ['INVENTORY_TABLE_NAME']
 project_name = os.environ['PROJECT_NAME']
-table = dynamodb.Table(table_name)
-eastern_tz = pytz.timezone('US/Eastern')
+table = Lazy(lambda: dynamodb.Table(table_name))
+# Per stage latency metrics, emitted as CloudWatch Embedded Metric Format records
+stage_metrics = StageMetrics(os.environ.get('METRICS_NAMESPACE', 'PiiRedaction'), 'AttachmentProcessing')
+# Manifest statuses of the attachments that are not redacted. An attachment of an unsupported format
+# stops the processing of the case, the attachments listed after it are skipped
+UNSUPPORTED = 'Unsupported'
+SKIPPED = 'Skipped'
 
 
 
@@ -31,17 +42,65 @@ SNS_FAILURE_TOPIC_ARN = os.environ['FAILURE_TOPIC_ARN']
 CRM_TOPIC_ARN = os.environ['CRM_TOPIC_ARN']
 guardrail_id = os.environ['GUARDRAIL_ID']
 guardrail_version = os.environ['GUARDRAIL_VERSION']
-projects = bda.list_data_automation_projects()
-project_arn = ""
-for project in projects['projects']:
-    if project['projectName'].lower() == project_name.lower():
-        project_arn = project['projectArn']
-        break
+# Element texts are packed into Guardrail requests of at most this many characters, assessed concurrently
+guardrail_request_chars = int(os.environ.get('GUARDRAIL_REQUEST_CHARS', '20000'))
+guardrail_max_workers = int(os.environ.get('GUARDRAIL_MAX_WORKERS', '4'))
+# The project ARN comes from the deployment configuration, the lookup by project name is only a fallback
+project_resolver = ProjectArnResolver(
+    bda,
+    project_name,
+    configured_arn=os.environ.get('PROJECT_ARN', ''),
+    ttl_seconds=int(os.environ.get('PROJECT_ARN_TTL_SECONDS', '3600'))
+)
+# BDA jobs are tracked with their case context until the completion handler redacted their attachment
+job_store = BdaJobStore(
+    Lazy(lambda: dynamodb.Table(os.environ['ATTACHMENT_JOBS_TABLE_NAME'])),
+    ttl_seconds=int(os.environ.get('RETENTION', '30')) * 24 * 60 * 60,
+    # A claim is only taken over once the invocation holding it has timed out
+    claim_timeout=int(os.environ.get('BDA_CLAIM_TIMEOUT', '900'))
+)
+# With 'poll' the attachment Lambda waits for the BDA jobs of a case itself and redacts each attachment as soon as its job finished,
+# with 'events' it returns after submitting them and the completion handler resumes on the EventBridge events
+bda_completion_mode = os.environ.get('BDA_COMPLETION_MODE', 'events')
+bda_poll_initial_delay = float(os.environ.get('BDA_POLL_INITIAL_DELAY', '2'))
+bda_poll_max_delay = float(os.environ.get('BDA_POLL_MAX_DELAY', '30'))
+bda_redaction_workers = int(os.environ.get('BDA_REDACTION_WORKERS', '4'))
+# A completion event may arrive before the submitting invocation stored its job, events of unknown jobs are retried for this many seconds
+bda_unknown_job_grace = int(os.environ.get('BDA_UNKNOWN_JOB_GRACE_SECONDS', '900'))
+# The sweeper re-checks jobs still pending this many seconds after their submission
+bda_sweep_after = int(os.environ.get('BDA_SWEEP_AFTER_SECONDS', '3600'))
+# With 'bda' PDFs are redacted from the word bounding boxes of the BDA output, with 'pymupdf' the words are re-extracted from every page
+pdf_redaction_geometry = os.environ.get('PDF_REDACTION_GEOMETRY', 'bda')
+# Re-extracting the words of PDFs with at least this many pages is split across processes, one per vCPU by default.
+# The processes are forked, so this only happens when no other thread runs, not in the redaction workers of the poll mode
+pdf_parallel_min_pages = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', '32'))
+pdf_redaction_workers = int(os.environ.get('PDF_REDACTION_WORKERS', str(os.cpu_count() or 1)))
+# Attachments are redacted in memory, those larger than this many bytes are spilled to temp files
+attachment_spill_bytes = int(os.environ.get('ATTACHMENT_SPILL_BYTES', str(256 * 1024 * 1024)))
+
+
+def eastern_tz():
+    """
+    Returns the US/Eastern timezone, pytz is only imported once a timestamp is needed.
+    """
+    import pytz
+    return pytz.timezone('US/Eastern')
+
+@register_before_snapshot
+def before_snapshot():
+    """
+    SnapStart hook run once before the snapshot is taken: creates the AWS clients, resolves the BDA project
+    and imports PyMuPDF and PIL, so environments restored from the snapshot start with them ready.
+    """
+    warm_up(s3, sns, dynamodb, bda, bda_client, bedrock_runtime, table)
+    project_resolver.resolve()
+    import fitz
+    from PIL import Image, ImageDraw
 
 
 def update_dynamodb(case_id,attachment_status):
     try:
-        current_timestamp = datetime.now(eastern_tz).isoformat()
+        current_timestamp = datetime.now(eastern_tz()).isoformat()
         # Update the item in the DynamoDB table
         response = table.update_item(
             Key={'CaseID': int(case_id)},
@@ -57,11 +116,41 @@ def update_dynamodb(case_id,attachment_status):
     except ClientError as e:
         print(f"Error updating DynamoDB table for case_id {case_id}: {e.response['Error']['Message']}")
         raise
-def extract_pii_entities_from_pdf(bucket_name, input_pdf_key, profile_arn):
+
+def record_attachment(case_id, file_name, redaction_status, output_key=None, size=None):
+    """
+    Updates the entry of an attachment in the manifest of the inventory item, listed there by the email processing Lambda,
+    so the portal finds the redacted attachments without listing the bucket.
+    """
+    updates = ["Attachments.#name.RedactionStatus = :status"]
+    names = {'#name': file_name}
+    values = {':status': redaction_status}
+    if output_key is not None:
+        updates.append("Attachments.#name.#key = :key")
+        names['#key'] = 'Key'
+        values[':key'] = output_key
+    if size is not None:
+        updates.append("Attachments.#name.#size = :size")
+        names['#size'] = 'Size'
+        values[':size'] = size
+    try:
+        table.update_item(
+            Key={'CaseID': int(case_id)},
+            UpdateExpression="SET " + ", ".join(updates),
+            ConditionExpression="attribute_exists(Attachments.#name)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except ClientError as e:
+        # Cases ingested before attachment manifests were recorded have no entry to update
+        print(f"Error recording attachment {file_name} for case_id {case_id}: {e.response['Error']['Message']}")
+
+def submit_bda_job(bucket_name, input_key, profile_arn):
     """
-    Extract PII from a PDF and return it back
+    Submits the BDA job extracting the text of an attachment and returns its invocation ARN.
+    BDA publishes the completion of the job to EventBridge, the Lambda does not wait for it.
     """
-    s3_path = f"s3://{bucket_name}/{input_pdf_key}"
+    s3_path = f"s3://{bucket_name}/{input_key}"
     s3_output_path = f"s3://{redacted_bucket}/working_dir"
     response = bda_client.invoke_data_automation_async(
                 inputConfiguration={"s3Uri": s3_path},
@@ -69,182 +158,188 @@ def extract_pii_entities_from_pdf(bucket_name, input_pdf_key, profile_arn):
                     "s3Uri": s3_output_path
                 },
                 dataAutomationConfiguration={
-                    "dataAutomationProjectArn": project_arn,
+                    "dataAutomationProjectArn": project_resolver.resolve(),
                     "stage": "LIVE",
                 },
-                dataAutomationProfileArn= profile_arn
-            )
-    invocation_arn=response['invocationArn']
-    while True:
-        response = bda_client.get_data_automation_status(invocationArn=invocation_arn)
-        if response['status'] == 'Success':
-            job_id = invocation_arn.split("/")[-1]
-            output_s3_uri = s3_output_path
-            parsed_uri = urlparse(output_s3_uri)
-            bucket = parsed_uri.netloc
-            prefix = parsed_uri.path.lstrip("/").rstrip("/") + "/" + job_id
-
-            #This does not support multi document
-            prefix = os.path.join(
-                        prefix, "0", "standard_output", "0", "result.json"
-            )
-            invocation_output = json.loads(
-                                s3.get_object(Bucket=bucket, Key=prefix)["Body"]
-                                .read()
-                                .decode("utf-8")
-                            )
-            break
-        time.sleep(30)
-    pii_entities = []
-    for element in invocation_output['elements']:
-        for location in element['locations']:
-            content = [
-                    {
-                        "text": {
-                        "text": element['representation']['text']
-                         }
-                    }   
-                ]
-            response = bedrock_runtime.apply_guardrail(
-                            guardrailIdentifier=guardrail_id,
-                            guardrailVersion=guardrail_version,
-                            source='OUTPUT',
-                            content=content
-                        )
-        for assessment in response['assessments']:
-            if 'sensitiveInformationPolicy' in assessment:
-                for pii_entity in assessment['sensitiveInformationPolicy']['piiEntities']:
-                    pii_entities.append({'text': pii_entity['match'], 'type' : pii_entity['type']})
-    return pii_entities
-
-def extract_pii_entities_from_images(bucket_name, input_image_key, profile_arn):
-    """
-    Extract bounding box of PII text from a JPEG or PNG and return it back
-    """
-    s3_path = f"s3://{bucket_name}/{input_image_key}"
-    s3_output_path = f"s3://{redacted_bucket}/working_dir"
-    response = bda_client.invoke_data_automation_async(
-                inputConfiguration={"s3Uri": s3_path},
-                outputConfiguration={
-                    "s3Uri": s3_output_path
-                },
-                dataAutomationConfiguration={
-                    "dataAutomationProjectArn": project_arn,
-                    "stage": "LIVE",
+                notificationConfiguration={
+                    "eventBridgeConfiguration": {"eventBridgeEnabled": True}
                 },
                 dataAutomationProfileArn= profile_arn
             )
-    invocation_arn=response['invocationArn']
-    while True:
-        response = bda_client.get_data_automation_status(invocationArn=invocation_arn)
-        if response['status'] == 'Success':
-            job_id = invocation_arn.split("/")[-1]
-            output_s3_uri = s3_output_path
-            parsed_uri = urlparse(output_s3_uri)
-            bucket = parsed_uri.netloc
-            prefix = parsed_uri.path.lstrip("/").rstrip("/") + "/" + job_id
-
-            #This does not support multi document
-            prefix = os.path.join(
-                        prefix, "0", "standard_output", "0", "result.json"
+    return response['invocationArn']
+
+def read_bda_output(invocation_arn):
+    """
+    Reads the standard output of a finished BDA job
+    """
+    job_id = job_id_from_arn(invocation_arn)
+    output_s3_uri = f"s3://{redacted_bucket}/working_dir"
+    parsed_uri = urlparse(output_s3_uri)
+    bucket = parsed_uri.netloc
+    prefix = parsed_uri.path.lstrip("/").rstrip("/") + "/" + job_id
+
+    #This does not support multi document
+    prefix = os.path.join(
+                prefix, "0", "standard_output", "0", "result.json"
+    )
+    return json.loads(
+                s3.get_object(Bucket=bucket, Key=prefix)["Body"]
+                .read()
+                .decode("utf-8")
             )
-            invocation_output = json.loads(
-                                s3.get_object(Bucket=bucket, Key=prefix)["Body"]
-                                .read()
-                                .decode("utf-8")
-                            )
-            break
-        time.sleep(30)
-    pii_entities = []
+
+def apply_guardrail(content):
+    return bedrock_runtime.apply_guardrail(
+                guardrailIdentifier=guardrail_id,
+                guardrailVersion=guardrail_version,
+                source='OUTPUT',
+                content=content
+            )
+
+def detect_element_entities(invocation_output):
+    """
+    Returns the PII entities of every BDA element, in the order of the elements.
+    Element texts are assessed once each, whatever their number of locations, in batched multi-block Guardrail requests.
+    """
+    texts = [element['representation']['text'] for element in invocation_output['elements']]
+    entities, input_chars, output_chars = assess_texts(apply_guardrail, texts, guardrail_request_chars, guardrail_max_workers)
+    stage_metrics.count(GuardrailInputChars=input_chars, GuardrailOutputChars=output_chars)
+    return entities
+
+def document_entities(invocation_output):
+    """
+    Returns the distinct PII entities found in the elements of a BDA output.
+    """
+    entities = {}
+    for element_entities in detect_element_entities(invocation_output):
+        for entity in element_entities:
+            entities.setdefault((entity['text'], entity['type']), entity)
+    return list(entities.values())
+
+def extract_pii_entities_from_pdf(invocation_output):
+    """
+    Extract PII from the BDA output of a PDF and return it back
+    """
+    return document_entities(invocation_output)
+
+def extract_pii_entities_from_images(invocation_output):
+    """
+    Extract bounding box of PII text from the BDA output of a JPEG or PNG and return it back
+    """
+    return word_bounding_boxes(invocation_output, document_entities(invocation_output))
+
+def word_bounding_boxes(invocation_output, pii_entities):
+    """
+    Returns the BDA bounding boxes of the words forming the PII entities, relative to the size of their page.
+    """
     bounding_boxes = []
-    for element in invocation_output['elements']:
-        for location in element['locations']:
-            content = [
-                    {
-                        "text": {
-                        "text": element['representation']['text']
-                         }
-                    }   
-                ]
-            response = bedrock_runtime.apply_guardrail(
-                            guardrailIdentifier=guardrail_id,
-                            guardrailVersion=guardrail_version,
-                            source='OUTPUT',
-                            content=content
-                        )
-        for assessment in response['assessments']:
-            if 'sensitiveInformationPolicy' in assessment:
-                for pii_entity in assessment['sensitiveInformationPolicy']['piiEntities']:
-                    pii_entities.append({'text': pii_entity['match'], 'type' : pii_entity['type']})
-    for word in invocation_output['text_words']:
-        for entity in pii_entities:
-            split_entity = entity['text'].split()
-            if word['text'] in split_entity:
-                for location in word['locations']:
-                    bounding_boxes.append({'text': word['text'],'page_index': location['page_index'],'left': location['bounding_box']['left'], 'top': location['bounding_box']['top'], 'width': location['bounding_box']['width'], 'height': location['bounding_box']['height']})
+    # Only the words forming a whole entity, in sequence, are redacted
+    matcher = PhraseMatcher(entity['text'] for entity in pii_entities)
+    words = invocation_output['text_words']
+    for index in matcher.matched_indices([word['text'] for word in words]):
+        word = words[index]
+        for location in word['locations']:
+            bounding_boxes.append({'text': word['text'],'page_index': location['page_index'],'left': location['bounding_box']['left'], 'top': location['bounding_box']['top'], 'width': location['bounding_box']['width'], 'height': location['bounding_box']['height']})
     return bounding_boxes
 
-def redact_pdf(bucket_name, redacted_bucket, input_pdf_key, output_pdf_key, pii_entities):
-    """
-    Redact PII in a PDF stored in S3 and save the redacted version back to S3.
-    """
-    # Download the PDF from S3
-    local_file_name = input_pdf_key.split('/')[-1]
-    local_input_pdf = f'/tmp/{local_file_name}'
-    s3.download_file(bucket_name, input_pdf_key, local_input_pdf)
-    # Open the PDF using PyMuPDF (fitz)
-    pdf_document = fitz.open(local_input_pdf)
-    # Loop through each page and redact PII
-    for page_num in range(int(pdf_document.page_count)):
-        page = pdf_document[page_num]
-        page_text = page.get_text("text")
-        # Redact PII by adding black boxes over the sensitive words
-        for word in page.get_text("words"):
-            word_text = word[4]
-            word_bbox=fitz.Rect(word[:4])
-            for entity in pii_entities: # Check if word is PII
-                split_entity = entity['text'].split()
-                if word_text in split_entity:
-                    expanded_bbox = fitz.Rect(word_bbox.x0, word_bbox.y0, word_bbox.x1, word_bbox.y1)
-                    page.draw_rect(expanded_bbox,fill=(0,0,0))
-    # Save the redacted PDF
-    local_output_pdf = f'/tmp/output_{local_file_name}'
-    pdf_document.save(local_output_pdf)
-    pdf_document.close()
-    # Upload the redacted PDF back to S3
-    s3.upload_file(local_output_pdf, redacted_bucket, output_pdf_key)
+def redact_pdf(bucket_name, redacted_bucket, input_pdf_key, output_pdf_key, pii_entities, bounding_boxes=None):
+    """
+    Redact PII in a PDF stored in S3, save the redacted version back to S3 and return its size in bytes.
+    With bounding_boxes, the BDA word boxes are redacted and only the pages having one are touched,
+    otherwise the words of every page are extracted again and matched against pii_entities.
+    """
+    # Read the PDF from S3 and open it using PyMuPDF (fitz)
+    with downloaded(s3, bucket_name, input_pdf_key, attachment_spill_bytes) as source:
+        pdf_document = open_pdf(source)
+        if bounding_boxes is not None:
+            redact_pdf_boxes(pdf_document, bounding_boxes)
+        else:
+            redact_pdf_words(pdf_document, pii_entities, source)
+        # Upload the redacted PDF back to S3
+        size = upload(s3, lambda target: save_pdf(pdf_document, target), redacted_bucket, output_pdf_key, source_size(source), attachment_spill_bytes)
+        pdf_document.close()
+    return size
 
-def redact_image(bucket_name, redacted_bucket, input_image_key, output_image_key, bounding_boxes, response):
+def redact_pdf_words(pdf_document, pii_entities, source):
+    """
+    Redacts the words of every page forming a PII entity, as extracted by PyMuPDF.
+    Large documents are searched by several processes, each opening its own copy of the PDF from source.
     """
-    Redact PII in a JPEG/JPG/PNG image stored in S3 and save the redacted version back to S3.
-    """
-    # Download the image from S3
-    local_file_name = input_image_key.split('/')[-1]
-    local_input_image = f'/tmp/{local_file_name}'
-    s3.download_file(bucket_name, input_image_key, local_input_image)
-    # Open the image using PIL
-    image = Image.open(local_input_image)
-    draw = ImageDraw.Draw(image)
-    width, height = image.size
-    # Redact PII by drawing black boxes over the sensitive words
+    import fitz
+    phrases = [entity['text'] for entity in pii_entities]
+    matcher = PhraseMatcher(phrases)
+    if not matcher:
+        return
+    page_count = pdf_document.page_count
+    if pdf_redaction_workers > 1 and page_count >= pdf_parallel_min_pages and can_fork():
+        page_rects = find_word_rects(source, phrases, page_count, pdf_redaction_workers)
+    else:
+        page_rects = page_word_rects(pdf_document, matcher, 0, page_count)
+    # Redact PII by adding black boxes over the words forming a whole entity
+    for page_num, rects in enumerate(page_rects):
+        if rects:
+            page = pdf_document[page_num]
+            for rect in rects:
+                page.draw_rect(fitz.Rect(rect),fill=(0,0,0))
+
+def redact_pdf_boxes(pdf_document, bounding_boxes):
+    """
+    Redacts BDA word boxes, given relative to the page as displayed, on the pages they belong to.
+    """
+    import fitz
+    pages = {}
     for data in bounding_boxes:
-        left = int(data['left'] * width) - 5
-        top = int(data['top'] * height) - 10
-        right = int((data['left'] + data['width']) * width) + 5
-        bottom = int((data['top'] + data['height']) * height) + 10
-        draw.rectangle([left, top , right , bottom ], fill="black")
-    # Save the redacted image
-    local_output_image = f'/tmp/output_{local_file_name}'
-    image.save(local_output_image)
-    # Upload the redacted image back to S3
-    s3.upload_file(local_output_image, redacted_bucket, output_image_key)
+        pages.setdefault(data['page_index'], []).append(data)
+    for page_index, boxes in sorted(pages.items()):
+        if page_index >= pdf_document.page_count:
+            print(f"Skipping bounding boxes of page {page_index}, the PDF has {pdf_document.page_count} pages")
+            continue
+        page = pdf_document[page_index]
+        # page.rect is the displayed page, drawing happens in the unrotated page space
+        width, height = page.rect.width, page.rect.height
+        for data in boxes:
+            rect = fitz.Rect(
+                data['left'] * width,
+                data['top'] * height,
+                (data['left'] + data['width']) * width,
+                (data['top'] + data['height']) * height
+            )
+            page.draw_rect(rect * page.derotation_matrix,fill=(0,0,0))
+
+def redact_image(bucket_name, redacted_bucket, input_image_key, output_image_key, bounding_boxes, response):
+    """
+    Redact PII in a JPEG/JPG/PNG image stored in S3, save the redacted version back to S3 and return its size in bytes.
+    """
+    # Read the image from S3 and open it using PIL
+    from PIL import ImageDraw
+    with downloaded(s3, bucket_name, input_image_key, attachment_spill_bytes) as source:
+        image = open_image(source)
+        image_format = image.format
+        draw = ImageDraw.Draw(image)
+        width, height = image.size
+        # Redact PII by drawing black boxes over the sensitive words
+        for data in bounding_boxes:
+            left = int(data['left'] * width) - 5
+            top = int(data['top'] * height) - 10
+            right = int((data['left'] + data['width']) * width) + 5
+            bottom = int((data['top'] + data['height']) * height) + 10
+            draw.rectangle([left, top , right , bottom ], fill="black")
+        # Upload the redacted image back to S3, in the format it was read in
+        size = upload(s3, lambda buffer: image.save(buffer, format=image_format), redacted_bucket, output_image_key, source_size(source), attachment_spill_bytes)
+        image.close()
+    return size
 
 def process_success_message(message,profile_arn):
+    """
+    Submits the BDA jobs of every attachment of the case up front and records them in the job table.
+    Returns the invocation ARNs of the jobs submitted, the case is finalized once all of them completed.
+    """
     try:
         case_id = message.get('case_id')
         bucket_name = message.get('bucket_name')
         base_path = message.get('base_path')
         attachments_path = base_path + '/attachments'
+        submitted = []
 
         response = s3.list_objects_v2(Bucket=bucket_name, Prefix=attachments_path)
         if 'Contents' in response:
@@ -263,34 +358,152 @@ def process_success_message(message,profile_arn):
             
                 existing_files.append(file_name_no_extension)
             #continue processing if no duplicate file names found
-            for obj in response['Contents']:
+            for index, obj in enumerate(response['Contents']):
                 attachment_key = obj['Key']
                 file_name = attachment_key.split('/')[-1]
                 date = attachment_key.split('/')[1]
                 file_type = file_name.split('.')[-1].lower()
                 file_name_no_extension = ".".join(file_name.split('.')[:-1])
                 print(f"Processing {file_name}")
-                if file_type == 'pdf':
-                    # Handle PDF
-                    pii_entities = extract_pii_entities_from_pdf(bucket_name, attachment_key, profile_arn)
-                    output_pdf_key = f"redacted/{date}/{case_id}/attachments/{file_name}"
-                    redact_pdf(bucket_name, redacted_bucket, attachment_key, output_pdf_key, pii_entities)
-
-                elif file_type in ['jpg', 'jpeg', 'png']:
-                    # Handle image formats directly
-                    bounding_boxes = extract_pii_entities_from_images(bucket_name, attachment_key, profile_arn)
-                    output_image_key = f"redacted/{date}/{case_id}/attachments/{file_name}"
-                    redact_image(bucket_name, redacted_bucket, attachment_key, output_image_key, bounding_boxes, response)
+                if file_type in ['pdf', 'jpg', 'jpeg', 'png']:
+                    stage_metrics.start(f"BDA submission: {file_name}")
+                    invocation_arn = submit_bda_job(bucket_name, attachment_key, profile_arn)
+                    job_store.save_job(
+                        invocation_arn,
+                        case_id,
+                        BucketName=bucket_name,
+                        AttachmentKey=attachment_key,
+                        OutputKey=f"redacted/{date}/{case_id}/attachments/{file_name}",
+                        FileType=file_type,
+                        Size=obj['Size']
+                    )
+                    submitted.append(invocation_arn)
+                    print(f"Submitted BDA job {invocation_arn} for {file_name}")
                 else:
                     # unsupported format
-                    return {
-                        'statusCode': 500,
-                        'body': f'Error processing attachment for case {case_id}. Unsupported format'
-                    }
+                    print(f'Error processing attachment for case {case_id}. Unsupported format')
+                    # The manifest entries are settled, so the portal does not list them as pending
+                    record_attachment(case_id, file_name, UNSUPPORTED)
+                    for skipped in response['Contents'][index + 1:]:
+                        record_attachment(case_id, skipped['Key'].split('/')[-1], SKIPPED)
+                    break
+        if submitted:
+            job_store.add_pending(case_id, len(submitted))
+        return submitted
 
     except Exception as e:
         print(f"Error processing success notification: {str(e)}")
         raise
+
+def redact_attachment(job):
+    """
+    Redacts an attachment from the output of its finished BDA job and returns the size of the redacted attachment.
+    """
+    file_name = job['AttachmentKey'].split('/')[-1]
+    stage_metrics.start(f"BDA output: {file_name}")
+    invocation_output = read_bda_output(job['InvocationArn'])
+    stage_metrics.start(f"Guardrail assessment: {file_name}")
+    if job['FileType'] == 'pdf':
+        # Handle PDF
+        pii_entities = extract_pii_entities_from_pdf(invocation_output)
+        bounding_boxes = None
+        if pdf_redaction_geometry == 'bda' and 'text_words' in invocation_output:
+            bounding_boxes = word_bounding_boxes(invocation_output, pii_entities)
+        stage_metrics.start(f"Redaction: {file_name}")
+        stage_metrics.count(Bytes=int(job['Size']))
+        return redact_pdf(job['BucketName'], redacted_bucket, job['AttachmentKey'], job['OutputKey'], pii_entities, bounding_boxes)
+    else:
+        # Handle image formats directly
+        bounding_boxes = extract_pii_entities_from_images(invocation_output)
+        stage_metrics.start(f"Redaction: {file_name}")
+        stage_metrics.count(Bytes=int(job['Size']))
+        return redact_image(job['BucketName'], redacted_bucket, job['AttachmentKey'], job['OutputKey'], bounding_boxes, None)
+
+def finalize_case(case_id, failed_jobs):
+    """
+    Updates the attachment status of a case once all its attachments are done and notifies the CRM topic, or the failure topic when an attachment failed.
+    """
+    stage_metrics.start("Notification: update DynamoDB and notify CRM topic")
+    if failed_jobs:
+        update_dynamodb(case_id,'Failed')
+        error_message = f"Failed redacting attachments for case id: {case_id}. Check for details in dynamodb table for this case id"
+        publish_failure_notification(case_id,error_message)
+        return
+    update_dynamodb(case_id,'Processed')
+    response = table.get_item(Key={'CaseID': int(case_id)})
+    item = response.get('Item')
+    processed_file_path = item.get('ProcessedFilePath')
+    push_message = "Email is ready for CRM processing"
+    publish_success_notification(case_id, redacted_bucket, processed_file_path, push_message, CRM_TOPIC_ARN)
+
+def finalize_case_if_done(case_id):
+    """
+    Finalizes the case when none of its jobs is pending anymore, only one invocation finalizes a case.
+    """
+    failed_jobs = job_store.finalize(case_id)
+    if failed_jobs is not None:
+        finalize_case(case_id, failed_jobs)
+
+def event_age(event):
+    """
+    Returns the seconds since an EventBridge event was published, events without a time are taken as old.
+    """
+    if 'time' not in event:
+        return float('inf')
+    published = datetime.fromisoformat(event['time'].replace('Z', '+00:00'))
+    return (datetime.now(published.tzinfo) - published).total_seconds()
+
+def handle_bda_completion(event, status=None):
+    """
+    Resumes the redaction of the attachment whose BDA job completed.
+    Returns False when the job is still running or another invocation is redacting its attachment, so the completion is retried.
+    status is the final status of the job when the caller already knows it.
+    """
+    detail = event.get('detail', event)
+    job_id = detail['job_id']
+    job = job_store.get_job(job_id)
+    if job is None:
+        if event_age(event) < bda_unknown_job_grace:
+            print(f"BDA job {job_id} is not stored yet")
+            return False
+        # BDA jobs not submitted by this pipeline publish to the same event bus
+        print(f"Ignoring completion of unknown BDA job {job_id}")
+        return True
+    if job['JobStatus'] in (REDACTED, FAILED):
+        print(f"BDA job {job_id} was already handled with status {job['JobStatus']}")
+        # A previous delivery may have stopped before finalizing the case
+        finalize_case_if_done(job['CaseID'])
+        return True
+    response = {'status': status} if status else bda_client.get_data_automation_status(invocationArn=job['InvocationArn'])
+    if response['status'] in RUNNING_STATUSES:
+        return False
+    # In poll mode the EventBridge event of a job may arrive while the poller redacts its attachment, only the claimant redacts it
+    if not job_store.claim_job(job_id):
+        print(f"BDA job {job_id} is being redacted by another invocation")
+        return False
+    case_id = job['CaseID']
+    stage_metrics.begin(case_id)
+    failed = response['status'] != 'Success'
+    if failed:
+        print(f"BDA job {job_id} for case {case_id} ended with status {response['status']}: {response.get('errorMessage', '')}")
+    else:
+        try:
+            size = redact_attachment(job)
+        except Exception as e:
+            print(f"Error redacting {job['AttachmentKey']} for case {case_id}: {str(e)}")
+            failed = True
+    # The manifest is updated before the job counts as done, so it is complete once the case is finalized
+    file_name = job['AttachmentKey'].split('/')[-1]
+    if failed:
+        record_attachment(case_id, file_name, FAILED)
+    else:
+        record_attachment(case_id, file_name, REDACTED, job['OutputKey'], size)
+    if not job_store.complete_job(job_id, case_id, FAILED if failed else REDACTED):
+        print(f"BDA job {job_id} was already handled")
+    finalize_case_if_done(case_id)
+    stage_metrics.end(failed=failed)
+    return True
+
 def publish_success_notification(case_id, bucket_name, base_path, push_message, topic_arn):
     """
     Publish a success message to an SNS topic after email body and attachments are saved.
@@ -339,29 +552,42 @@ def lambda_handler(event, context):
     region = context.invoked_function_arn.split(":")[3]
     account_id = str(context.invoked_function_arn.split(":")[4])
     profile_arn = "arn:aws:bedrock:" + region + ":" + account_id + ":data-automation-profile/us.data-automation-v1"
+    # Fail fast before any attachment is downloaded when the BDA project cannot be resolved
+    try:
+        project_arn = project_resolver.resolve()
+    except ClientError as e:
+        print(f"Error looking up BDA project {project_name}: {e.response['Error']['Message']}")
+        project_arn = ""
+    if project_arn == "":
+        stage_metrics.emit_metric('BdaProjectMissing')
+        return {
+                'statusCode': 500,
+                'body': f'Error processing SNS notification. Cannot find project arn for project {project_name}'
+                }
     for record in event['Records']:
         message = {}
         sns_message = record['Sns']['Message']
         message = json.loads(sns_message)
         case_id = message.get('case_id')
-        if project_arn == "":
-            return {
-                    'statusCode': 500,
-                    'body': f'Error processing SNS notification for case {case_id}. Cannot find project arn for project {project_name}'
-                    }
+        stage_metrics.begin(case_id)
         try:
-            process_success_message(message,profile_arn)
-            update_dynamodb(case_id,'Processed')
-            response = table.get_item(Key={'CaseID': int(case_id)})
-            item = response.get('Item')
-            processed_file_path = item.get('ProcessedFilePath')
-            push_message = "Email is ready for CRM processing"
-            publish_success_notification(case_id, redacted_bucket, processed_file_path, push_message, CRM_TOPIC_ARN)
+            submitted = process_success_message(message,profile_arn)
+            # The completion handler finalizes the case once the BDA jobs finished, unless they all finished already
+            if not submitted:
+                finalize_case(case_id, 0)
+            elif bda_completion_mode == 'poll':
+                wait_for_bda_jobs(submitted, context)
+            else:
+                finalize_case_if_done(case_id)
+            stage_metrics.end()
         except Exception as e:
-            update_dynamodb(case_id,'Failed')
-            error_message = f"Failed redacting attachments for case id: {case_id}. Check for details in dynamodb table for this case id"
-            publish_failure_notification(case_id,error_message)
+            stage_metrics.end(failed=True)
             print(f"Error in processing SNS event: {str(e)}")
+            # The case may already be finalized from the completion events of its jobs, only the first terminal status is recorded
+            if job_store.fail_case(case_id):
+                update_dynamodb(case_id,'Failed')
+                error_message = f"Failed redacting attachments for case id: {case_id}. Check for details in dynamodb table for this case id"
+                publish_failure_notification(case_id,error_message)
             return {
                 'statusCode': 500,
                 'body': f'Error processing SNS notification for case {case_id}'
@@ -369,4 +595,64 @@ def lambda_handler(event, context):
     return {
             'statusCode': 200,
             'body': 'Success SNS notification processed successfully'
-        }
\ No newline at end of file
+        }
+
+def wait_for_bda_jobs(invocation_arns, context):
+    """
+    Polls the BDA jobs of a case until they finished or the Lambda is about to time out, redacting each attachment as soon as its job finished.
+    Jobs still running when polling stops are completed from their EventBridge events.
+    """
+    stage_metrics.start("BDA wait: all attachments")
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 60
+    poll_jobs(
+        lambda invocation_arn: bda_client.get_data_automation_status(invocationArn=invocation_arn)['status'],
+        invocation_arns,
+        lambda invocation_arn, status: handle_bda_completion({'detail': {'job_id': job_id_from_arn(invocation_arn)}}, status),
+        initial_delay=bda_poll_initial_delay,
+        max_delay=bda_poll_max_delay,
+        deadline=deadline,
+        max_workers=bda_redaction_workers
+    )
+
+def bda_completion_handler(event, context):
+    """
+    Handles the BDA job completion events published to EventBridge.
+    SQS batches carrying the same events are accepted too, so a queue can stand in for EventBridge, e.g. when testing locally.
+    """
+    if 'Records' in event:
+        batch_item_failures = []
+        for record in event['Records']:
+            try:
+                if not handle_bda_completion(json.loads(record['body'])):
+                    batch_item_failures.append({'itemIdentifier': record['messageId']})
+            except Exception as e:
+                print(f"Error handling BDA completion message {record.get('messageId')}: {str(e)}")
+                batch_item_failures.append({'itemIdentifier': record['messageId']})
+        return {'batchItemFailures': batch_item_failures}
+    if not handle_bda_completion(event):
+        # Raising makes Lambda retry the asynchronous invocation later
+        raise RuntimeError(f"BDA job {event['detail']['job_id']} is still running or being redacted")
+    return {
+            'statusCode': 200,
+            'body': 'BDA completion event processed successfully'
+        }
+
+def sweep_handler(event, context):
+    """
+    Runs on a schedule and resumes the cases left pending, e.g. when all deliveries of a completion event failed
+    or the invocation redacting an attachment timed out. Jobs are re-checked against BDA and cases whose jobs all completed are finalized.
+    """
+    resumed = 0
+    for item in job_store.stuck_items(int(time.time()) - bda_sweep_after):
+        try:
+            if item['JobID'].startswith(CASE_PREFIX):
+                finalize_case_if_done(item['JobID'][len(CASE_PREFIX):])
+            elif handle_bda_completion({'detail': {'job_id': item['JobID']}}):
+                resumed += 1
+        except Exception as e:
+            print(f"Error sweeping {item['JobID']}: {str(e)}")
+    print(f"Resumed {resumed} pending BDA jobs")
+    return {
+            'statusCode': 200,
+            'body': f'Resumed {resumed} pending BDA jobs'
+        }
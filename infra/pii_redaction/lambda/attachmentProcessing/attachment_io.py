@@ -0,0 +1,90 @@
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Chunks in which objects larger than the spill threshold are copied to their temp file
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+@contextmanager
+def downloaded(s3, bucket_name, key, spill_bytes):
+    """
+    Yields the content of an S3 object as bytes, read straight into memory.
+    Objects larger than spill_bytes are streamed to a private temp file instead, whose path is yielded and which is removed afterwards,
+    so attachments never share a file name in /tmp and nothing is left behind on a warm container.
+    """
+    response = s3.get_object(Bucket=bucket_name, Key=key)
+    body = response['Body']
+    if response['ContentLength'] <= spill_bytes:
+        yield body.read()
+        return
+    spill = tempfile.NamedTemporaryFile(suffix=os.path.splitext(key)[1], delete=False)
+    try:
+        with spill:
+            for chunk in body.iter_chunks(CHUNK_BYTES):
+                spill.write(chunk)
+        yield spill.name
+    finally:
+        os.remove(spill.name)
+
+
+def source_size(source):
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def open_pdf(source):
+    """
+    Opens a PDF from the bytes or the temp file yielded by downloaded(), MuPDF maps a file rather than reading it whole.
+    """
+    import fitz
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+
+def open_image(source):
+    from PIL import Image
+    return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def save_pdf(pdf_document, target):
+    """
+    Saves a PDF to a file path, or into a file object. Document.save() on a file object goes through a Python call per chunk written
+    and is about ten times slower than on a path, so the PDF is saved to a private temp file first and copied into the file object.
+    """
+    if isinstance(target, str):
+        pdf_document.save(target)
+        return
+    spill = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    spill.close()
+    try:
+        pdf_document.save(spill.name)
+        with open(spill.name, 'rb') as saved:
+            shutil.copyfileobj(saved, target, CHUNK_BYTES)
+    finally:
+        os.remove(spill.name)
+
+
+def upload(s3, save, bucket_name, key, size, spill_bytes):
+    """
+    Uploads the attachment written by save(target) to S3 and returns its size in bytes. The target is an in-memory buffer,
+    or the path of a private temp file when size is larger than spill_bytes.
+    """
+    if size <= spill_bytes:
+        buffer = io.BytesIO()
+        save(buffer)
+        uploaded = buffer.tell()
+        buffer.seek(0)
+        s3.upload_fileobj(buffer, bucket_name, key)
+        return uploaded
+    # The file is closed before saving, PyMuPDF replaces the file at the path it writes to
+    spill = tempfile.NamedTemporaryFile(suffix=os.path.splitext(key)[1], delete=False)
+    spill.close()
+    try:
+        save(spill.name)
+        s3.upload_file(spill.name, bucket_name, key)
+        return os.path.getsize(spill.name)
+    finally:
+        os.remove(spill.name)
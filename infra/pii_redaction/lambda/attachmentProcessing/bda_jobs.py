@@ -0,0 +1,174 @@
+import time
+
+from botocore.exceptions import ClientError
+
+# Statuses of a BDA job recorded in the job table
+SUBMITTED = 'Submitted'
+IN_PROGRESS = 'InProgress'
+REDACTED = 'Redacted'
+FAILED = 'Failed'
+# Prefix of the item counting the jobs of a case that are still running
+CASE_PREFIX = 'CASE#'
+
+
+def job_id_from_arn(invocation_arn):
+    return invocation_arn.split("/")[-1]
+
+
+class BdaJobStore:
+    """
+    Persists the BDA jobs submitted for attachments together with their case context, so the completion handler can
+    resume redaction when BDA reports the job finished.
+    Each case has a counter item of pending jobs, the case is finalized exactly once when the count reaches zero.
+    """
+
+    def __init__(self, table, ttl_seconds=None, claim_timeout=900):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.claim_timeout = claim_timeout
+
+    def _expiration(self, item):
+        if self.ttl_seconds:
+            item['ExpirationTime'] = int(time.time()) + self.ttl_seconds
+        return item
+
+    def save_job(self, invocation_arn, case_id, **context):
+        self.table.put_item(Item=self._expiration({
+            'JobID': job_id_from_arn(invocation_arn),
+            'InvocationArn': invocation_arn,
+            'CaseID': str(case_id),
+            'JobStatus': SUBMITTED,
+            'SubmittedAt': int(time.time()),
+            **context
+        }))
+
+    def add_pending(self, case_id, count):
+        """
+        Adds submitted jobs to the pending count of a case. Completions may arrive before this update,
+        the count only reaches zero once every submitted job completed.
+        """
+        self.table.update_item(
+            Key={'JobID': f'{CASE_PREFIX}{case_id}'},
+            UpdateExpression="ADD PendingJobs :count, FailedJobs :none",
+            ExpressionAttributeValues={':count': count, ':none': 0}
+        )
+
+    def get_job(self, job_id):
+        response = self.table.get_item(Key={'JobID': job_id}, ConsistentRead=True)
+        return response.get('Item')
+
+    def claim_job(self, job_id):
+        """
+        Claims a submitted job for redaction, so only one of the poller and the completion handler redacts its attachment.
+        A claim older than claim_timeout seconds is taken over, the invocation holding it has timed out.
+        Returns False when another invocation holds the claim or the job was already completed.
+        """
+        now = int(time.time())
+        try:
+            self.table.update_item(
+                Key={'JobID': job_id},
+                UpdateExpression="SET JobStatus = :in_progress, ClaimedAt = :now",
+                ConditionExpression="JobStatus = :submitted OR (JobStatus = :in_progress AND ClaimedAt < :stale)",
+                ExpressionAttributeValues={
+                    ':in_progress': IN_PROGRESS,
+                    ':submitted': SUBMITTED,
+                    ':now': now,
+                    ':stale': now - self.claim_timeout
+                }
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def complete_job(self, job_id, case_id, status):
+        """
+        Moves a claimed job to its final status and counts it as done for its case in one transaction.
+        Returns False when the job was already completed, so a completion event delivered twice is only counted once.
+        """
+        try:
+            self.table.meta.client.transact_write_items(TransactItems=[
+                {
+                    'Update': {
+                        'TableName': self.table.name,
+                        'Key': {'JobID': job_id},
+                        'UpdateExpression': "SET JobStatus = :status",
+                        'ConditionExpression': "JobStatus = :in_progress",
+                        'ExpressionAttributeValues': {':status': status, ':in_progress': IN_PROGRESS}
+                    }
+                },
+                {
+                    'Update': {
+                        'TableName': self.table.name,
+                        'Key': {'JobID': f'{CASE_PREFIX}{case_id}'},
+                        'UpdateExpression': "ADD PendingJobs :done, FailedJobs :failed",
+                        'ExpressionAttributeValues': {':done': -1, ':failed': 1 if status == FAILED else 0}
+                    }
+                }
+            ])
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                return False
+            raise
+
+    def finalize(self, case_id):
+        """
+        Marks a case whose jobs all completed as finalized. Returns the number of failed jobs,
+        or None when jobs are still pending or the case was already finalized by another invocation.
+        """
+        try:
+            response = self.table.update_item(
+                Key={'JobID': f'{CASE_PREFIX}{case_id}'},
+                UpdateExpression="SET Finalized = :finalized",
+                ConditionExpression="PendingJobs = :none AND attribute_not_exists(Finalized)",
+                ExpressionAttributeValues={':finalized': True, ':none': 0},
+                ReturnValues="ALL_NEW"
+            )
+            return int(response['Attributes'].get('FailedJobs', 0))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+
+    def fail_case(self, case_id):
+        """
+        Finalizes a case as failed while jobs may still be pending, e.g. when its invocation failed while waiting for them.
+        Returns False when the case was already finalized, the completion of its remaining jobs does not finalize it again.
+        """
+        try:
+            self.table.update_item(
+                Key={'JobID': f'{CASE_PREFIX}{case_id}'},
+                UpdateExpression="SET Finalized = :finalized ADD FailedJobs :failed",
+                ConditionExpression="attribute_not_exists(Finalized)",
+                ExpressionAttributeValues={':finalized': True, ':failed': 1}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def stuck_items(self, submitted_before):
+        """
+        Scans for the jobs submitted before submitted_before (epoch seconds) that are not completed yet,
+        and the cases whose jobs all completed without the case being finalized.
+        """
+        kwargs = {
+            'FilterExpression': "(JobStatus IN (:submitted, :in_progress) AND (attribute_not_exists(SubmittedAt) OR SubmittedAt < :before))"
+                                " OR (begins_with(JobID, :case_prefix) AND PendingJobs = :none AND attribute_not_exists(Finalized))",
+            'ExpressionAttributeValues': {
+                ':submitted': SUBMITTED,
+                ':in_progress': IN_PROGRESS,
+                ':before': submitted_before,
+                ':case_prefix': CASE_PREFIX,
+                ':none': 0
+            }
+        }
+        while True:
+            response = self.table.scan(**kwargs)
+            yield from response['Items']
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,45 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Statuses of a BDA invocation that is not finished yet
+RUNNING_STATUSES = ['Created', 'InProgress']
+
+
+def poll_jobs(get_status, invocation_arns, on_complete, initial_delay=2, max_delay=30, backoff=1.5, deadline=None, max_workers=4):
+    """
+    Waits for many BDA invocations in a single loop instead of one blocking loop per invocation.
+    Every invocation has its own polling delay, starting at initial_delay and growing by backoff up to max_delay while it is still running,
+    with jitter so the polls of jobs submitted together spread out. The loop sleeps until the next invocation is due.
+    on_complete(invocation_arn, status) runs on a thread pool as soon as an invocation finished, so the work on finished jobs
+    overlaps with waiting for the others.
+    Returns a dict of invocation ARN -> final status, invocations still running at the deadline (a time.monotonic() value) are left out.
+    """
+    now = time.monotonic()
+    schedule = {arn: [now + random.uniform(0, initial_delay), initial_delay] for arn in invocation_arns}
+    statuses = {}
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while schedule:
+            arn = min(schedule, key=lambda key: schedule[key][0])
+            due, delay = schedule[arn]
+            if deadline is not None and due >= deadline:
+                print(f"Stopped polling {len(schedule)} BDA jobs still running at the deadline")
+                break
+            time.sleep(max(0, due - time.monotonic()))
+            try:
+                status = get_status(arn)
+            except Exception as e:
+                # A failed status request is retried like a running job, jobs still unknown at the deadline are left to their completion events
+                print(f"Error polling BDA job {arn}: {str(e)}")
+                status = None
+            if status is None or status in RUNNING_STATUSES:
+                delay = min(max_delay, delay * backoff)
+                schedule[arn] = [time.monotonic() + random.uniform(delay / 2, delay), delay]
+                continue
+            del schedule[arn]
+            statuses[arn] = status
+            futures.append(executor.submit(on_complete, arn, status))
+    for future in futures:
+        future.result()
+    return statuses
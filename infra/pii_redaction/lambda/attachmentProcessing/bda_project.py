@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class ProjectArnResolver:
+    """
+    Resolves the ARN of the BDA project used for attachment extraction.
+    The ARN set in the deployment configuration is used as is. Without it the project is looked up by name through every page
+    of list_data_automation_projects, and a found ARN is cached for ttl_seconds so warm invocations skip the lookup.
+    """
+
+    def __init__(self, bda, project_name, configured_arn='', ttl_seconds=3600):
+        self.bda = bda
+        self.project_name = project_name
+        self.configured_arn = configured_arn
+        self.ttl_seconds = ttl_seconds
+        self.cached_arn = ''
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def resolve(self):
+        """
+        Returns the project ARN, or "" when no project with the configured name exists.
+        """
+        if self.configured_arn:
+            return self.configured_arn
+        with self.lock:
+            if self.cached_arn and time.monotonic() < self.expires_at:
+                return self.cached_arn
+            arn = self.lookup()
+            if arn:
+                self.cached_arn = arn
+                self.expires_at = time.monotonic() + self.ttl_seconds
+            return arn
+
+    def lookup(self):
+        request = {}
+        while True:
+            response = self.bda.list_data_automation_projects(**request)
+            for project in response.get('projects', []):
+                if project['projectName'].lower() == self.project_name.lower():
+                    return project['projectArn']
+            if not response.get('nextToken'):
+                return ''
+            request = {'nextToken': response['nextToken']}
+
+    def invalidate(self):
+        with self.lock:
+            self.cached_arn = ''
+            self.expires_at = 0
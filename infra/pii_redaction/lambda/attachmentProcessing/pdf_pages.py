@@ -0,0 +1,88 @@
+import multiprocessing
+import threading
+
+from attachment_io import open_pdf
+from phrase_matcher import PhraseMatcher
+
+
+def split_pages(page_count, parts):
+    """
+    Splits the pages of a document into at most parts contiguous (start, stop) ranges of nearly equal size.
+    """
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for part in range(parts):
+        stop = start + size + (1 if part < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def page_word_rects(pdf_document, matcher, start, stop):
+    """
+    Returns, for each page from start to stop, the rectangles of the words forming a whole PII entity.
+    """
+    rects = []
+    for page_num in range(start, stop):
+        words = pdf_document[page_num].get_text("words")
+        rects.append([tuple(words[index][:4]) for index in matcher.matched_indices([word[4] for word in words])])
+    return rects
+
+
+def can_fork():
+    """
+    Forking is only safe while the process runs a single thread, a lock held by another thread at the time of the fork,
+    e.g. by botocore or the logging module in the poll mode redaction workers, is never released in the child.
+    """
+    return threading.active_count() == 1
+
+
+def _find_in_range(source, phrases, start, stop, connection):
+    try:
+        pdf_document = open_pdf(source)
+        connection.send((True, page_word_rects(pdf_document, PhraseMatcher(phrases), start, stop)))
+    except Exception as e:
+        connection.send((False, repr(e)))
+    finally:
+        connection.close()
+
+
+def find_word_rects(source, phrases, page_count, workers):
+    """
+    Finds the rectangles to redact on every page of a PDF with one process per range of pages.
+    Each process opens the document from source, the PDF bytes shared read-only with the parent when the process is forked
+    or the temp file they were spilled to, and sends back the rectangles of its pages only,
+    so the redaction is drawn on the original document and nothing else of it is copied back.
+    Lambda has no /dev/shm, so plain processes and pipes are used instead of multiprocessing.Pool.
+    Only call it when can_fork() is true, the caller searches the pages itself otherwise.
+    Returns the list of rectangles of each page, in page order.
+    """
+    if not can_fork():
+        raise RuntimeError("PDF pages can only be searched by forked processes from a single threaded process")
+    context = multiprocessing.get_context('fork')
+    phrases = list(phrases)
+    jobs = []
+    for start, stop in split_pages(page_count, workers):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_find_in_range, args=(source, phrases, start, stop, sender))
+        process.start()
+        sender.close()
+        jobs.append((process, receiver))
+    rects = []
+    errors = []
+    for process, receiver in jobs:
+        # Results are received before joining, a worker blocked on a full pipe would never exit
+        try:
+            succeeded, result = receiver.recv()
+        except EOFError:
+            succeeded, result = False, 'worker exited without a result'
+        process.join()
+        if succeeded:
+            rects.extend(result)
+        else:
+            errors.append(result)
+    if errors:
+        raise RuntimeError(f"PDF redaction workers failed: {'; '.join(errors)}")
+    return rects
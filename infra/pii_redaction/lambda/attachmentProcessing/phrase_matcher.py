@@ -0,0 +1,80 @@
+import re
+from collections import deque
+
+# Punctuation around a word is not part of the token, e.g. "Kucsma," or "(555)" match "Kucsma" and "555"
+EDGE_PUNCTUATION = re.compile(r'^[^\w@+#]+|[^\w@+#]+$')
+
+
+def normalize_token(token):
+    return EDGE_PUNCTUATION.sub('', token).casefold()
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over the token sequences of PII entities.
+    A stream of words is scanned once, every contiguous run of words spelling an entity is found whatever the number of entities,
+    so a word is only redacted where the whole entity appears and not wherever one of its tokens does.
+    """
+
+    def __init__(self, phrases):
+        self.transitions = [{}]
+        self.lengths = [()]
+        self.fail = [0]
+        for phrase in phrases:
+            tokens = [token for token in (normalize_token(part) for part in phrase.split()) if token]
+            if tokens:
+                self._add(tokens)
+        self._link()
+
+    def _add(self, tokens):
+        node = 0
+        for token in tokens:
+            if token not in self.transitions[node]:
+                self.transitions.append({})
+                self.lengths.append(())
+                self.fail.append(0)
+                self.transitions[node][token] = len(self.transitions) - 1
+            node = self.transitions[node][token]
+        if len(tokens) not in self.lengths[node]:
+            self.lengths[node] += (len(tokens),)
+
+    def _link(self):
+        # Breadth first, so the failure node of every node is linked before the node itself
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.transitions[node].items():
+                fallback = self.fail[node]
+                while fallback and token not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(token, 0)
+                # A node also ends every entity ending at its failure node
+                self.lengths[child] += tuple(length for length in self.lengths[self.fail[child]] if length not in self.lengths[child])
+                queue.append(child)
+
+    def __bool__(self):
+        return bool(self.transitions[0])
+
+    def find(self, words):
+        """
+        Returns the (start, end) index ranges of the words matching an entity, in the order their last word appears.
+        """
+        spans = []
+        node = 0
+        for index, word in enumerate(words):
+            token = normalize_token(word)
+            while node and token not in self.transitions[node]:
+                node = self.fail[node]
+            node = self.transitions[node].get(token, 0)
+            for length in self.lengths[node]:
+                spans.append((index - length + 1, index + 1))
+        return spans
+
+    def matched_indices(self, words):
+        """
+        Returns the sorted indices of the words that are part of an entity.
+        """
+        indices = set()
+        for start, end in self.find(words):
+            indices.update(range(start, end))
+        return sorted(indices)
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def pack_texts(texts, max_chars):
+    """
+    Groups texts into consecutive batches of at most max_chars characters each, a longer text gets a batch of its own.
+    """
+    batches = []
+    size = 0
+    for text in texts:
+        if not batches or size + len(text) > max_chars:
+            batches.append([])
+            size = 0
+        batches[-1].append(text)
+        size += len(text)
+    return batches
+
+
+def pii_entities_of(response):
+    """
+    Returns the PII entities detected by a Guardrail response as {'text', 'type'} dicts.
+    """
+    entities = []
+    for assessment in response.get('assessments', []):
+        if 'sensitiveInformationPolicy' in assessment:
+            for pii_entity in assessment['sensitiveInformationPolicy']['piiEntities']:
+                entities.append({'text': pii_entity['match'], 'type': pii_entity['type']})
+    return entities
+
+
+def assess_texts(apply_guardrail, texts, max_chars=20000, max_workers=4):
+    """
+    Detects the PII entities of many texts with as few Guardrail requests as the size limit allows.
+    Each distinct text is sent once, as its own content block, and the batches are assessed concurrently.
+    apply_guardrail(content) sends one request and returns its response.
+    Returns the list of entities found in each text, in the order of texts, and the number of characters sent and returned.
+    """
+    distinct = list(dict.fromkeys(text for text in texts if text.strip()))
+    batches = pack_texts(distinct, max_chars)
+
+    def assess(batch):
+        response = apply_guardrail([{"text": {"text": text}} for text in batch])
+        found = {text: [] for text in batch}
+        for entity in pii_entities_of(response):
+            owners = [text for text in batch if entity['text'] in text]
+            if not owners:
+                # The match cannot be located, it is kept for every text of the batch rather than missed
+                owners = batch
+            for text in owners:
+                if entity not in found[text]:
+                    found[text].append(entity)
+        output_chars = sum(len(output.get('text', '')) for output in response.get('outputs', []))
+        return found, output_chars
+
+    entities = {}
+    output_chars = 0
+    if len(batches) == 1:
+        results = [assess(batches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, max(len(batches), 1))) as executor:
+            results = list(executor.map(assess, batches))
+    for found, chars in results:
+        entities.update(found)
+        output_chars += chars
+    input_chars = sum(len(text) for text in distinct)
+    return [entities.get(text, []) for text in texts], input_chars, output_chars
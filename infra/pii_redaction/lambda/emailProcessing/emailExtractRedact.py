@@ -1,26 +1,30 @@
-import boto3
 import os
-import pytz
 from email import policy
-from email.parser import BytesParser
+from email.parser import BytesParser, BytesFeedParser
+from email.message import Message
 from datetime import datetime, date
 import json
-import random
+import threading
+from urllib.parse import unquote_plus
 from botocore.exceptions import ClientError
-from bs4 import BeautifulSoup
+from redaction_cache import RedactionCache
+from html_redaction import HtmlDocument, align_redacted_text
+from text_chunks import split_into_chunks, with_overlap, merge_spans, apply_spans_to_text
+from concurrent.futures import ThreadPoolExecutor
+from s3_upload import iter_part_content, upload_stream, upload_objects
+from stage_metrics import StageMetrics
+from idempotency import IngestionLedger, ingestion_key, COMPLETED, CASE_ALLOCATED, REDACTED
+from lazy_init import Lazy, client, resource, warm_up, register_before_snapshot, register_after_restore
 
 import time
 import re
 
-# Initialize AWS clients
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
-dynamodb = boto3.resource('dynamodb')
-secrets_manager = boto3.client('secretsmanager')
-bedrock_runtime = boto3.client('bedrock-runtime')
-my_session = boto3.session.Session()
-my_region = my_session.region_name
-eastern_tz = pytz.timezone('US/Eastern')
+# Initialize AWS clients, they are created on first use so the import stays cheap
+s3 = client('s3')
+sns = client('sns')
+dynamodb = resource('dynamodb')
+secrets_manager = client('secretsmanager')
+bedrock_runtime = client('bedrock-runtime')
 # Get values from environment variables
 processed_bucket = os.environ['REDACTED_BUCKET_NAME']
 table_name = os.environ['INVENTORY_TABLE_NAME']
@@ -32,44 +36,110 @@ retention = int(os.environ['RETENTION'])
 guardrail_id = os.environ['GUARDRAIL_ID']
 guardrail_version = os.environ['GUARDRAIL_VERSION']
 # DynamoDB table name
-table = dynamodb.Table(table_name)
+table = Lazy(lambda: dynamodb.Table(table_name))
 #set ttl for dynamodb records based on retention period mentioned in context file
 ttl_value = int(time.time()) + (int(retention) * 24 * 60 * 60)
+# Case IDs are leased in blocks from an atomic counter item of the inventory table, so they are unique without a lookup
+CASE_ID_COUNTER_KEY = 0
+# Case IDs generated randomly before the counter existed are all below this value
+CASE_ID_START = 1000000
+case_id_block_size = int(os.environ.get('CASE_ID_BLOCK_SIZE', '10'))
+case_id_lease = {'next': 1, 'last': 0}
+case_id_lock = threading.Lock()
+# Cache of redacted paragraphs so that repeated disclaimers, signatures and templates skip the Guardrail call,
+# shared through the table only when the secret keying its hashes is configured
+redaction_cache_table_name = os.environ.get('REDACTION_CACHE_TABLE_NAME', '')
+redaction_cache_key_secret_arn = os.environ.get('REDACTION_CACHE_KEY_SECRET_ARN', '')
+redaction_cache_shared = bool(redaction_cache_table_name and redaction_cache_key_secret_arn)
+redaction_cache = RedactionCache(
+    guardrail_id,
+    guardrail_version,
+    table=Lazy(lambda: dynamodb.Table(redaction_cache_table_name)) if redaction_cache_shared else None,
+    hash_key=(lambda: secrets_manager.get_secret_value(SecretId=redaction_cache_key_secret_arn)['SecretString'].encode('utf-8')) if redaction_cache_shared else None,
+    max_entries=int(os.environ.get('REDACTION_CACHE_MAX_ENTRIES', '2048')),
+    ttl_seconds=int(retention) * 24 * 60 * 60
+)
+# Guardrail requests are limited to this many characters, larger bodies are split into overlapping chunks redacted concurrently
+guardrail_chunk_chars = int(os.environ.get('GUARDRAIL_CHUNK_CHARS', '20000'))
+guardrail_chunk_overlap = int(os.environ.get('GUARDRAIL_CHUNK_OVERLAP', '200'))
+guardrail_max_workers = int(os.environ.get('GUARDRAIL_MAX_WORKERS', '4'))
+# Size of the chunks read from the raw email stream and of the parts of attachment multipart uploads
+stream_chunk_size = int(os.environ.get('STREAM_CHUNK_SIZE', str(1024 * 1024)))
+multipart_part_size = int(os.environ.get('MULTIPART_PART_SIZE', str(8 * 1024 * 1024)))
+# Number of objects uploaded concurrently by save_to_s3 and of parts uploaded concurrently per multipart upload
+upload_max_workers = int(os.environ.get('UPLOAD_MAX_WORKERS', '8'))
+multipart_max_workers = int(os.environ.get('MULTIPART_MAX_WORKERS', '4'))
+# Number of emails of a batch processed concurrently
+email_max_workers = int(os.environ.get('EMAIL_MAX_WORKERS', '4'))
+# The inventory item keeps this many characters of the redacted body, the portal lists messages from it without reading S3
+body_preview_chars = int(os.environ.get('BODY_PREVIEW_CHARS', '100'))
+# Number of shards of each status in the EmailIndexStatusTime index, the portal reads the same setting to query all of them
+status_shards = int(os.environ.get('STATUS_SHARDS', '8'))
+# Ledger of ingested raw emails keyed by bucket, key and ETag, so redelivered S3 events do not create a second case
+ingestion_table_name = os.environ.get('INGESTION_TABLE_NAME', '')
+ingestion_ledger = IngestionLedger(
+    Lazy(lambda: dynamodb.Table(ingestion_table_name)),
+    lease_seconds=int(os.environ.get('INGESTION_LEASE_SECONDS', '960')),
+    ttl_seconds=int(retention) * 24 * 60 * 60
+) if ingestion_table_name else None
+# Per stage latency metrics, emitted as CloudWatch Embedded Metric Format records
+stage_metrics = StageMetrics(os.environ.get('METRICS_NAMESPACE', 'PiiRedaction'), 'EmailProcessing')
+# Paragraphs are separated by blank lines, the separators are kept so the text can be joined back unchanged
+paragraph_separator = re.compile(r'(\n\s*\n)')
 
 
+def eastern_tz():
+    """
+    Returns the US/Eastern timezone, pytz is only imported once a timestamp is needed.
+    """
+    import pytz
+    return pytz.timezone('US/Eastern')
+
+@register_before_snapshot
+def before_snapshot():
+    """
+    SnapStart hook run once before the snapshot is taken: creates the AWS clients and loads the html parser,
+    so environments restored from the snapshot start with them ready.
+    """
+    warm_up(s3, sns, dynamodb, bedrock_runtime, table)
+    HtmlDocument('<p></p>')
+
+@register_after_restore
+def after_restore():
+    """
+    SnapStart hook run in every environment restored from the snapshot. State captured in the snapshot is shared by all
+    restored environments, so each one leases its own block of case IDs and computes its own expiration time.
+    """
+    global ttl_value
+    ttl_value = int(time.time()) + (int(retention) * 24 * 60 * 60)
+    with case_id_lock:
+        case_id_lease['next'] = 1
+        case_id_lease['last'] = 0
+
 def extract_text_from_html(html_content):
     """
     Extracts and returns clean text content from HTML.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    return soup.get_text(separator=' ')
-def replace_text_in_html(original_html, redacted_text):
+    return HtmlDocument(html_content).text
 
+def replace_text_in_html(original_html, redacted_text):
     """
     Replaces the original text content in the HTML with the redacted text while keeping the HTML structure intact.
     """
-    soup = BeautifulSoup(original_html, 'html.parser')
-    # Split redacted text by sentences or blocks to match with HTML tags
-    redacted_chunks = redacted_text.split()
-    # Iterate over text nodes in the HTML and replace them with the redacted text
-    for element in soup.find_all(text=True):
-        text_content = element.string.strip()
-        if text_content:
-            # Replace the text node with the redacted chunk
-            element.replace_with(' '.join(redacted_chunks[:len(text_content.split())]))
-            # Remove the processed chunk from the redacted_chunks list
-            redacted_chunks = redacted_chunks[len(text_content.split()):]
-    return str(soup)
+    return HtmlDocument(original_html).apply_redacted_text(redacted_text)
 
     
-def redact_pii(text_content, html_content, content_type):
-    output_text=""
+def apply_guardrail_blocks(texts):
+    """
+    Sends each text as its own content block in a single Guardrail request and returns the redacted texts in the same order.
+    """
     content = [
         {
             "text": {
-                "text": text_content
+                "text": text
             }
         }
+        for text in texts
     ]
     response = bedrock_runtime.apply_guardrail(
                     guardrailIdentifier=guardrail_id,
@@ -77,8 +147,138 @@ def redact_pii(text_content, html_content, content_type):
                     source='OUTPUT',  # or 'INPUT' depending on your use case
                     content=content
                 )
-    for output in response['outputs']:
-        output_text += output['text']
+    # Counted per request sent, so every path to the Guardrail, chunked or not, is measured
+    stage_metrics.count(GuardrailInputChars=sum(len(text) for text in texts))
+    if response.get('action') != 'GUARDRAIL_INTERVENED':
+        # No PII found, the guardrail does not echo the text back in this case
+        redacted_texts = list(texts)
+    elif len(response['outputs']) == len(texts):
+        redacted_texts = [output['text'] for output in response['outputs']]
+    elif len(texts) == 1:
+        redacted_texts = [''.join(output['text'] for output in response['outputs'])]
+    else:
+        # Outputs cannot be matched to their blocks, fall back to one request per block
+        print(f"Guardrail returned {len(response['outputs'])} outputs for {len(texts)} blocks, redacting blocks separately")
+        return [apply_guardrail_blocks([text])[0] for text in texts]
+    stage_metrics.count(GuardrailOutputChars=sum(len(text) for text in redacted_texts))
+    return redacted_texts
+
+def pack_requests(texts):
+    """
+    Groups texts into consecutive requests of at most guardrail_chunk_chars characters each.
+    """
+    requests = []
+    size = 0
+    for text in texts:
+        if not requests or size + len(text) > guardrail_chunk_chars:
+            requests.append([])
+            size = 0
+        requests[-1].append(text)
+        size += len(text)
+    return requests
+
+def apply_guardrail_requests(texts):
+    """
+    Redacts texts packed into as few Guardrail requests as the size limit allows, running the requests on a bounded thread pool.
+    Results are returned in the order of the texts.
+    """
+    requests = pack_requests(texts)
+    if len(requests) == 1:
+        redacted_texts = apply_guardrail_blocks(requests[0])
+    else:
+        with ThreadPoolExecutor(max_workers=min(guardrail_max_workers, len(requests))) as executor:
+            results = list(executor.map(stage_metrics.propagate(apply_guardrail_blocks), requests))
+        redacted_texts = [redacted for result in results for redacted in result]
+    return redacted_texts
+
+def redact_blocks(texts):
+    """
+    Redacts text blocks of any size.
+    Blocks larger than a Guardrail request are split at paragraph or sentence boundaries into chunks widened by a small overlap,
+    so entities crossing a boundary are still detected. Only the spans starting inside a chunk's own range are kept
+    and spans repeated in the overlap are merged, so nothing is masked twice.
+    """
+    if sum(len(text) for text in texts) <= guardrail_chunk_chars:
+        return apply_guardrail_blocks(texts)
+    core_chars = max(guardrail_chunk_chars - 2 * guardrail_chunk_overlap, guardrail_chunk_chars // 2)
+    pieces = []
+    for index, text in enumerate(texts):
+        for start, end in split_into_chunks(text, core_chars):
+            context_start, context_end = with_overlap(text, start, end, guardrail_chunk_overlap)
+            pieces.append((index, start, end, context_start, context_end))
+    redacted_pieces = apply_guardrail_requests([texts[index][cs:ce] for index, _, _, cs, ce in pieces])
+
+    spans = {index: [] for index in range(len(texts))}
+    unaligned = set()
+    for (index, start, end, context_start, context_end), redacted in zip(pieces, redacted_pieces):
+        piece_spans = align_redacted_text(texts[index][context_start:context_end], redacted)
+        if piece_spans is None:
+            unaligned.add(index)
+            continue
+        for span_start, span_end, replacement in piece_spans:
+            if start <= span_start + context_start < end:
+                spans[index].append((span_start + context_start, span_end + context_start, replacement))
+
+    redacted_texts = [apply_spans_to_text(text, merge_spans(spans[index])) for index, text in enumerate(texts)]
+    if unaligned:
+        # Without alignment the overlap cannot be cut out, redact those blocks again in chunks without overlap
+        print(f"Chunked guardrail output could not be aligned for {len(unaligned)} blocks, redacting them without overlap")
+        for index in sorted(unaligned):
+            chunks = [texts[index][start:end] for start, end in split_into_chunks(texts[index], guardrail_chunk_chars)]
+            redacted_texts[index] = ''.join(apply_guardrail_requests(chunks))
+    return redacted_texts
+
+def redact_pii_fields(fields):
+    """
+    Redacts several text fields (subject, plain body, ...) with a single Guardrail request.
+    Paragraphs already present in the redaction cache are reused, the remaining paragraphs of each field are sent as one text block
+    and the outputs are mapped back to the field names.
+    """
+    field_parts = {name: paragraph_separator.split(text) for name, text in fields.items() if text}
+    paragraphs = list(dict.fromkeys(
+        part for parts in field_parts.values() for part in parts[::2] if part.strip()
+    ))
+    cached = redaction_cache.get_many(paragraphs)
+
+    # Contiguous runs of uncached paragraphs are packed into one block each, keeping their separators
+    runs = []
+    for name, parts in field_parts.items():
+        run_start = None
+        for i in range(0, len(parts), 2):
+            if parts[i] in cached or not parts[i].strip():
+                if run_start is not None:
+                    runs.append((name, run_start, i - 2))
+                    run_start = None
+                parts[i] = cached.get(parts[i], parts[i])
+            elif run_start is None:
+                run_start = i
+        if run_start is not None:
+            runs.append((name, run_start, len(parts) - 1))
+
+    if runs:
+        blocks = [''.join(field_parts[name][first:last + 1]) for name, first, last in runs]
+        redacted_blocks = redact_blocks(blocks)
+        new_entries = {}
+        for (name, first, last), redacted_block in zip(runs, redacted_blocks):
+            parts = field_parts[name]
+            redacted_parts = paragraph_separator.split(redacted_block)
+            if len(redacted_parts) == last - first + 1:
+                for i in range(first, last + 1, 2):
+                    new_entries[parts[i]] = redacted_parts[i - first]
+                parts[first:last + 1] = redacted_parts
+            else:
+                # A masked entity swallowed a paragraph break, keep the block as a whole and leave it out of the cache
+                parts[first:last + 1] = [redacted_block] + [''] * (last - first)
+        redaction_cache.put_many(new_entries)
+    stage_metrics.emit_metrics(redaction_cache.take_counts())
+
+    redacted_fields = dict(fields)
+    for name, parts in field_parts.items():
+        redacted_fields[name] = ''.join(parts)
+    return redacted_fields
+
+def redact_pii(text_content, html_content, content_type):
+    output_text = redact_pii_fields({'text': text_content})['text']
     if content_type == 'html':
         redacted_html = replace_text_in_html(html_content, output_text)
         return redacted_html
@@ -86,6 +286,19 @@ def redact_pii(text_content, html_content, content_type):
         return output_text
     
 
+def body_preview(text):
+    """
+    Returns the preview of a redacted body stored as EmailBody on the inventory item.
+    """
+    return text[:body_preview_chars] + '...' if len(text) > body_preview_chars else text
+
+def status_shard(body_status, case_id):
+    """
+    Returns the StatusShard of an inventory item, the partition of the EmailIndexStatusTime index it is listed in.
+    The shard is derived from the case ID so every update of a case keeps it in the same shard.
+    """
+    return f"{body_status}#{int(case_id) % status_shards}"
+
 def insert_dynamodb(case_id,object_key,bucket_name,email_receive_time):
     item = {
             'CaseID': int(case_id),
@@ -98,6 +311,7 @@ def insert_dynamodb(case_id,object_key,bucket_name,email_receive_time):
             'ProcessedBucketName': 'NA',
             "ProcessedFilePath": 'NA',
             'BodyStatus': 'Open',
+            'StatusShard': status_shard('Open', case_id),
             'FolderID': 'general_inbox',
             'EmailReceiveTime': email_receive_time,
             'BodyProcessedTime': email_receive_time,
@@ -106,31 +320,58 @@ def insert_dynamodb(case_id,object_key,bucket_name,email_receive_time):
             'ExpirationTime': ttl_value
             }
     try:
-        table.put_item(Item=item)
+        # The condition guards against overwriting an existing case, it never costs an extra round trip
+        table.put_item(Item=item, ConditionExpression='attribute_not_exists(CaseID)')
         print(f"Item added to DynamoDB table: {item}")
     except ClientError as e:
         print(f"Error adding item to DynamoDB table: {e.response['Error']['Message']}")
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise
         
-def update_dynamodb(case_id, email_subject, email_body, from_email, dominant_language, processed_bucket, processed_file_key, base_path, attachment_status, body_status, bucket_name):
+def attachment_manifest(attachments, base_path):
+    """
+    Returns the manifest of the attachments of a case stored on its inventory item: for each file name, the key its redacted copy
+    is saved at, its size, content type and redaction status, which the attachment processing Lambda updates once redacted.
+    """
+    # The attachment processing Lambda saves each attachment under the date and case of its raw copy
+    redacted_path = 'redacted/' + base_path.split('/', 1)[1]
+    return {
+        f"{attachment['filename']}": {
+            'Key': f"{redacted_path}/attachments/{attachment['filename']}",
+            'Size': attachment.get('size', 0),
+            'ContentType': attachment['content_type'],
+            'RedactionStatus': 'Pending'
+        }
+        for attachment in attachments
+    }
+
+def update_dynamodb(case_id, email_subject, email_body, from_email, dominant_language, processed_bucket, processed_file_key, base_path, attachment_status, body_status, bucket_name, attachments=None):
     try:
-        current_timestamp = datetime.now(eastern_tz).isoformat()
+        current_timestamp = datetime.now(eastern_tz()).isoformat()
+        update_expression = "SET RawFilePath=:base_path, RawBucketName=:bucket_name,EmailSubject=:subject, EmailBody=:body,FromAddress=:from_email,DominantLanguage=:dominant_language,ProcessedBucketName=:processed_bucket, ProcessedFilePath=:processed_key, BodyStatus=:body_status, StatusShard=:status_shard, BodyProcessedTime=:current_timestamp, AttachmentStatus=:attachment_status"
+        values = {
+            ':base_path': base_path,
+            ':bucket_name': bucket_name,
+            ':subject': email_subject,
+            ':body': email_body,
+            ':from_email': from_email,
+            ':dominant_language': dominant_language,
+            ':processed_bucket': processed_bucket,
+            ':processed_key': processed_file_key,
+            ':body_status': body_status,
+            ':status_shard': status_shard(body_status, case_id),
+            ':current_timestamp': current_timestamp,
+            ':attachment_status': attachment_status
+        }
+        # The attachment manifest is only written once the email is processed
+        if attachments is not None:
+            update_expression += ", Attachments=:attachments"
+            values[':attachments'] = attachments
         # Update the item in the DynamoDB table
         response = table.update_item(
             Key={'CaseID': int(case_id)},
-            UpdateExpression="SET RawFilePath=:base_path, RawBucketName=:bucket_name,EmailSubject=:subject, EmailBody=:body,FromAddress=:from_email,DominantLanguage=:dominant_language,ProcessedBucketName=:processed_bucket, ProcessedFilePath=:processed_key, BodyStatus=:body_status, BodyProcessedTime=:current_timestamp, AttachmentStatus=:attachment_status",
-            ExpressionAttributeValues={
-                ':base_path': base_path,
-                ':bucket_name': bucket_name,
-                ':subject': email_subject,
-                ':body': email_body,
-                ':from_email': from_email,
-                ':dominant_language': dominant_language,
-                ':processed_bucket': processed_bucket,
-                ':processed_key': processed_file_key,
-                ':body_status': body_status,
-                ':current_timestamp': current_timestamp,
-                ':attachment_status': attachment_status
-            },
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=values,
             ReturnValues="UPDATED_NEW"
         )
 
@@ -139,34 +380,45 @@ def update_dynamodb(case_id, email_subject, email_body, from_email, dominant_lan
         print(f"Error updating DynamoDB table for case_id {case_id}: {e.response['Error']['Message']}")
         raise
         
+def lease_case_id_block(block_size):
+    """
+    Atomically reserves the next block_size counter values and returns the first and last of them.
+    """
+    response = table.update_item(
+        Key={'CaseID': CASE_ID_COUNTER_KEY},
+        UpdateExpression="ADD NextCaseID :block_size",
+        ExpressionAttributeValues={':block_size': block_size},
+        ReturnValues="UPDATED_NEW"
+    )
+    last = int(response['Attributes']['NextCaseID'])
+    return last - block_size + 1, last
+
 def generate_case_id():
-    # Generate a unique 6-digit case ID
-    case_id=0
-    case_id_exists = True
-    while case_id_exists:
-        case_id = ''.join(random.choices('0123456789', k=6))
-        print("case id is:", case_id)
-        # Check if the case ID already exists in the DynamoDB table
-        try:
-            response = table.get_item(Key={'CaseID': case_id})
-            item = response.get('Item')
-            if not item:
-                # Case ID is unique, break out of the loop
-                case_id_exists = False
-        except ClientError as e:
-            print(f"Error checking for existing case ID: {e.response['Error']['Message']}")
-            case_id_exists = False
-    return case_id
+    """
+    Returns the next case ID from the block leased by this Lambda container, leasing a new block when it is used up.
+    Blocks never overlap, so case IDs are unique across containers by construction.
+    """
+    with case_id_lock:
+        if case_id_lease['next'] > case_id_lease['last']:
+            case_id_lease['next'], case_id_lease['last'] = lease_case_id_block(case_id_block_size)
+        case_id = CASE_ID_START + case_id_lease['next']
+        case_id_lease['next'] += 1
+    print("case id is:", case_id)
+    return str(case_id)
 
 
 def extract_email_from_s3(bucket_name, object_key, case_id):
     """
-    Extract the raw email from S3.
+    Extract the raw email from S3 and parse it while it is streamed, so the raw bytes are never held in memory as a whole.
+    Returns the parsed email message.
     """
     try:
         response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        email_content = response['Body'].read()
-        return email_content
+        parser = BytesFeedParser(policy=policy.default)
+        for chunk in response['Body'].iter_chunks(chunk_size=stream_chunk_size):
+            parser.feed(chunk)
+            stage_metrics.count(Bytes=len(chunk))
+        return parser.close()
     except Exception as e:
         error_message = f"Failed to extract email from S3 for case_id {case_id}: {str(e)}"
         publish_failure_notification(case_id, 'extract_email_from_s3', error_message)
@@ -175,9 +427,14 @@ def extract_email_from_s3(bucket_name, object_key, case_id):
 def parse_email(email_content, case_id):
     """
     Parse the email content to extract the body (plain text and HTML) and attachments.
+    email_content is either the raw email bytes or an already parsed message.
+    Attachments reference their MIME part and are only decoded when they are uploaded.
     """
     try:
-        msg = BytesParser(policy=policy.default).parsebytes(email_content)
+        if isinstance(email_content, Message):
+            msg = email_content
+        else:
+            msg = BytesParser(policy=policy.default).parsebytes(email_content)
        
         # Extract subject
         email_subject = msg.get('Subject', '')
@@ -196,7 +453,7 @@ def parse_email(email_content, case_id):
                         # This is a text attachment, not the body
                         attachments.append({
                             'filename': part.get_filename(),
-                            'content': part.get_payload(decode=True),
+                            'part': part,
                             'content_type': part.get_content_type()
                             })
                     else:
@@ -207,7 +464,7 @@ def parse_email(email_content, case_id):
                         # This is a html attachment, not the body
                         attachments.append({
                             'filename': part.get_filename(),
-                            'content': part.get_payload(decode=True),
+                            'part': part,
                             'content_type': part.get_content_type()
                         })
                     else:
@@ -216,7 +473,7 @@ def parse_email(email_content, case_id):
                     # This is a non-text attachment
                     attachments.append({
                         'filename': part.get_filename(),
-                        'content': part.get_payload(decode=True),
+                        'part': part,
                         'content_type': part.get_content_type()
                     })
         else:
@@ -230,37 +487,54 @@ def parse_email(email_content, case_id):
         publish_failure_notification(case_id, 'parse_email', error_message)
         raise
 
+def put_body(bucket_name, key, body, content_type=None):
+    """
+    Writes an email body to S3 and returns its size in bytes.
+    """
+    body = body.encode('utf-8')
+    if content_type:
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body, ContentType=content_type)
+    else:
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body)
+    return len(body)
+
+def upload_attachment(bucket_name, key, attachment):
+    """
+    Decodes an attachment chunk by chunk straight into its S3 upload and returns its size in bytes.
+    """
+    size = upload_stream(s3, bucket_name, key, iter_part_content(attachment['part']), attachment['content_type'], multipart_part_size, multipart_max_workers)
+    attachment['size'] = size
+    # Release the encoded payload, the attachment is only read back from S3 from now on
+    attachment['part'].set_payload('')
+    return size
+
 def save_to_s3(bucket_name, case_id, email_body_plain, email_body_html, attachments, file_type='raw'):
     """
     Save email body (plain text and HTML) and attachments to S3 under the folder structure 'raw_email/today_date/case_id'.
     """
-    today_date = datetime.now(eastern_tz).strftime('%Y-%m-%d')
+    today_date = datetime.now(eastern_tz()).strftime('%Y-%m-%d')
     if file_type == 'raw':
         base_path = f'raw_email/{today_date}/{case_id}'
     else:
         base_path = f'redacted/{today_date}/{case_id}'
+    uploads = []
+    # Save plain text email body
+    if email_body_plain:
+        body_plain_key = f'{base_path}/body/email_body.txt'
+        uploads.append((body_plain_key, lambda: put_body(bucket_name, body_plain_key, email_body_plain)))
+    # Save HTML email body
+    if email_body_html:
+        body_html_key = f'{base_path}/body/email_body.html'
+        uploads.append((body_html_key, lambda: put_body(bucket_name, body_html_key, email_body_html, 'text/html')))
+    # Save attachments
+    if file_type == 'raw':
+        for attachment in attachments:
+            attachment_key = f'{base_path}/attachments/{attachment["filename"]}'
+            uploads.append((attachment_key, lambda key=attachment_key, attachment=attachment: upload_attachment(bucket_name, key, attachment)))
     try:
-        # Save plain text email body
-        if email_body_plain:
-            body_plain_key = f'{base_path}/body/email_body.txt'
-            s3.put_object(Bucket=bucket_name, Key=body_plain_key, Body=email_body_plain)
-            print(f'Plain text email body saved to: {body_plain_key}')
-        # Save HTML email body
-        if email_body_html:
-            body_html_key = f'{base_path}/body/email_body.html'
-            s3.put_object(Bucket=bucket_name, Key=body_html_key, Body=email_body_html, ContentType='text/html')
-            print(f'HTML email body saved to: {body_html_key}')
-        # Save attachments
-        if file_type == 'raw':
-            for attachment in attachments:
-                attachment_key = f'{base_path}/attachments/{attachment["filename"]}'
-                s3.put_object(
-                    Bucket=bucket_name,
-                    Key=attachment_key,
-                    Body=attachment['content'],
-                    ContentType=attachment['content_type']
-                )
-                print(f'Attachment saved to: {attachment_key}')
+        for key, size, seconds in upload_objects(uploads, upload_max_workers):
+            print(f'Saved {key} ({size} bytes) in {seconds:.3f}s')
+            stage_metrics.count(Bytes=size)
     except Exception as e:
         error_message = f"Failed to save data to S3 for case_id {case_id}: {str(e)}"
         publish_failure_notification(case_id, 'save_to_s3', error_message)
@@ -312,67 +586,130 @@ def publish_failure_notification(case_id, step, error_message):
         print(f"Failed to send failure notification for case_id {case_id}: {str(e)} in topic {SNS_FAILURE_TOPIC_ARN}")
         raise
 
-def lambda_handler(event, context):
-    # Inputs from the event
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    object_key = event['Records'][0]['s3']['object']['key']
-    current_timestamp = datetime.now(eastern_tz).isoformat()
+def process_email(bucket_name, object_key, etag=None):
+    """
+    Runs the full extraction and redaction pipeline for one raw email stored in S3.
+    When the ingestion ledger is configured, an email already ingested returns its existing case and a crashed attempt resumes from its last checkpoint.
+    """
+    current_timestamp = datetime.now(eastern_tz()).isoformat()
     attachment_status='Open'
     step=""
     case_id=0
     body_table = ""
     dominant_language = "en"
     base_path=""
+    ingestion = None
+    ingestion_record = {}
+    ingestion_stage = None
+    timer = stage_metrics.begin()
     try:
-        step = "Step 1: Generate unique case id"
-        case_id = generate_case_id()
-        step = "Step 2: Initial entry into DynamoDB"
-        insert_dynamodb(case_id,object_key,bucket_name,current_timestamp)
-        step = "Step 3: Extract email content from S3"
-        email_content = extract_email_from_s3(bucket_name, object_key, case_id)
-        step = "Step 4: Parse the email to extract plain text body, HTML body, and attachments"
-        email_body_plain, email_body_html, attachments, email_subject, from_email = parse_email(email_content, case_id)
-        email_body_plain = extract_text_from_html(email_body_html)
-        step = "Step 5: Save the extracted plain text body, HTML body, and attachments to S3 in the desired folder structure"
-        base_path = save_to_s3(bucket_name, case_id, email_body_plain, email_body_html, attachments)
-        
-        if len(attachments) == 0:
-            attachment_status='No attachment'
-            
-        if len(email_body_plain) > 0:
-            step = "Step 6: Redact email plain body"
-            redacted_plain_body = redact_pii(email_body_plain, email_body_html, 'plain')
-            body_table = redacted_plain_body[:100] + '...' if len(redacted_plain_body) > 100 else redacted_plain_body
-        if len(email_body_html) > 0:
-            step = "Step 7: Redact email html body"
-            redacted_html_body = redact_pii(email_body_plain, email_body_html, 'html')
-        if len(email_subject) > 0:
-            step = "Step 8: Redact email subject"
-            redacted_subject = redact_pii(email_subject, email_body_html, 'plain')
-            # Append case ID to the redacted email subject
-            updated_subject = f"[Case ID: {case_id}] - {redacted_subject}"
+        if ingestion_ledger is not None:
+            step = timer.start("Step 0: Claim the raw email ingestion")
+            if not etag:
+                etag = s3.head_object(Bucket=bucket_name, Key=object_key)['ETag']
+            key = ingestion_key(bucket_name, object_key, etag)
+            ingestion_record, claimed = ingestion_ledger.claim(key)
+            if not claimed:
+                if ingestion_record.get('IngestionStatus') == COMPLETED:
+                    existing_case_id = int(ingestion_record['CaseID'])
+                    print(f'Email {object_key} in bucket {bucket_name} was already ingested as case_id: {existing_case_id}')
+                    stage_metrics.end()
+                    return {
+                        'statusCode': 200,
+                        'body': f'Email already processed for case_id: {existing_case_id}'
+                    }
+                print(f'Email {object_key} in bucket {bucket_name} is being ingested by another attempt')
+                stage_metrics.end()
+                return {
+                    'statusCode': 409,
+                    'body': f'Email {object_key} is being processed by another attempt'
+                }
+            ingestion = key
+
+        if ingestion_record.get('CaseID'):
+            step = timer.start("Step 1: Resume case id of the crashed attempt")
+            case_id = str(int(ingestion_record['CaseID']))
+            timer.case_id = case_id
+            ingestion_stage = ingestion_record.get('Stage')
+            print(f"Resuming ingestion of {object_key} for case_id: {case_id} after stage {ingestion_stage}")
         else:
-            step = "Step 8: Redact email subject"
-            updated_subject = f"[Case ID: {case_id}]"
-        
-        step = "Step 9: Save redacted email body in redacted s3 bucket"
-        processed_path = save_to_s3(processed_bucket, case_id, redacted_plain_body, redacted_html_body, attachments,'redacted')
-        
-        step = "Step 10: Update dynamodb post processing"
-        update_dynamodb(case_id, updated_subject, body_table, from_email, 'en', processed_bucket, processed_path, base_path,attachment_status,'Processed',bucket_name )
+            step = timer.start("Step 1: Generate unique case id")
+            case_id = generate_case_id()
+            timer.case_id = case_id
+            if ingestion:
+                ingestion_ledger.checkpoint(ingestion, CASE_ALLOCATED, CaseID=int(case_id))
+        step = timer.start("Step 2: Initial entry into DynamoDB")
+        try:
+            insert_dynamodb(case_id,object_key,bucket_name,current_timestamp)
+        except ClientError as e:
+            # A resumed attempt finds the entry written before the crash
+            if not ingestion_record.get('CaseID') or e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        if ingestion_stage == REDACTED:
+            base_path = ingestion_record['BasePath']
+            processed_path = ingestion_record['ProcessedPath']
+            attachment_status = ingestion_record['AttachmentStatus']
+        else:
+            step = timer.start("Step 3: Extract email content from S3")
+            email_content = extract_email_from_s3(bucket_name, object_key, case_id)
+            step = timer.start("Step 4: Parse the email to extract plain text body, HTML body, and attachments")
+            email_body_plain, email_body_html, attachments, email_subject, from_email = parse_email(email_content, case_id)
+            # The html body is parsed once, the same tree serves the text extraction and the write-back of the redacted text
+            html_document = HtmlDocument(email_body_html)
+            email_body_plain = html_document.text
+            step = timer.start("Step 5: Save the extracted plain text body, HTML body, and attachments to S3 in the desired folder structure")
+            base_path = save_to_s3(bucket_name, case_id, email_body_plain, email_body_html, attachments)
+            
+            if len(attachments) == 0:
+                attachment_status='No attachment'
+                
+            step = timer.start("Step 6: Redact email plain body and subject in a single Guardrail request")
+            redacted_fields = redact_pii_fields({'subject': email_subject, 'body': email_body_plain})
+            if len(email_body_plain) > 0:
+                redacted_plain_body = redacted_fields['body']
+                body_table = body_preview(redacted_plain_body)
+            if len(email_body_html) > 0:
+                step = timer.start("Step 7: Redact email html body")
+                # The plain body is extracted from the html body, so its redacted text is written back into the html
+                redacted_html_body = html_document.apply_redacted_text(redacted_fields['body'])
+            if len(email_subject) > 0:
+                step = timer.start("Step 8: Redact email subject")
+                redacted_subject = redacted_fields['subject']
+                # Append case ID to the redacted email subject
+                updated_subject = f"[Case ID: {case_id}] - {redacted_subject}"
+            else:
+                step = timer.start("Step 8: Redact email subject")
+                updated_subject = f"[Case ID: {case_id}]"
+            
+            step = timer.start("Step 9: Save redacted email body in redacted s3 bucket")
+            processed_path = save_to_s3(processed_bucket, case_id, redacted_plain_body, redacted_html_body, attachments,'redacted')
+            
+            step = timer.start("Step 10: Update dynamodb post processing")
+            update_dynamodb(case_id, updated_subject, body_table, from_email, 'en', processed_bucket, processed_path, base_path,attachment_status,'Processed',bucket_name, attachment_manifest(attachments, base_path))
+            if ingestion:
+                step = timer.start("Step 11: Checkpoint the redacted email")
+                ingestion_ledger.checkpoint(ingestion, REDACTED, BasePath=base_path, ProcessedPath=processed_path, AttachmentStatus=attachment_status)
+                ingestion_stage = REDACTED
         
         if attachment_status == 'No attachment':
-            step = "Step 12: Send notification to CRM topic in case of no attachments"
+            step = timer.start("Step 12: Send notification to CRM topic in case of no attachments")
             push_message = "Email is ready for CRM processing"
             publish_success_notification(case_id, processed_bucket, processed_path, push_message, CRM_TOPIC_ARN)
         else:
-            step = "Step 12: Send a success SNS notification after saving everything for attachment redaction. Check attachment redaction lambda for update on attachment redaction"
+            step = timer.start("Step 12: Send a success SNS notification after saving everything for attachment redaction. Check attachment redaction lambda for update on attachment redaction")
             push_message = "Email body and attachments have been successfully saved to S3."
             publish_success_notification(case_id, bucket_name, base_path, push_message, SNS_SUCCESS_TOPIC_ARN)
+        if ingestion:
+            ingestion_ledger.complete(ingestion)
         
     except Exception as e:
-        if case_id != 0:
+        stage_metrics.end(failed=True)
+        # A redacted email that failed to be notified keeps its processed entry, the next delivery only resends the notification
+        if case_id != 0 and ingestion_stage != REDACTED:
             update_dynamodb(case_id,'NA','NA','NA','NA','NA','NA',object_key,'Open','Failed',bucket_name)
+        if ingestion:
+            ingestion_ledger.release(ingestion)
         if base_path == "":
             error_message = f"Unhandled error for case_id {case_id}: with raw file at {object_key} in bucket {bucket_name}. Error: {str(e)}"
         else:
@@ -383,8 +720,68 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': f'Failed to process email for case_id: {case_id} at {step}'
         }
+    stage_metrics.end()
     print(f'Email body and attachments saved for case_id: {case_id}! Also redaction of PII data completed for body and attachment if any redaction process initiated')
     return {
             'statusCode': 200,
             'body': f'Email body and attachments saved for case_id: {case_id}! Also redaction of PII data completed for body and attachment if any redaction process initiated'
-        }
\ No newline at end of file
+        }
+
+def s3_records(event_body):
+    """
+    Returns the (bucket, key, etag) triples of an S3 event notification, skipping the s3:TestEvent sent when a notification is configured.
+    """
+    return [
+        (record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']), record['s3']['object'].get('eTag'))
+        for record in event_body.get('Records', [])
+        if 's3' in record
+    ]
+
+def process_emails(emails):
+    """
+    Processes (bucket, key, etag) triples concurrently on a bounded thread pool and returns one result per email, in order.
+    """
+    def process(email):
+        try:
+            return process_email(*email)
+        except Exception as e:
+            print(f'Failed to process email {email[1]} in bucket {email[0]}: {str(e)}')
+            return {'statusCode': 500, 'body': f'Failed to process email {email[1]}'}
+    if len(emails) <= 1:
+        return [process(email) for email in emails]
+    with ThreadPoolExecutor(max_workers=min(email_max_workers, len(emails))) as executor:
+        return list(executor.map(process, emails))
+
+def lambda_handler(event, context):
+    """
+    Handles either S3 event notifications or SQS batches of S3 event notifications.
+    Every record of the event is processed, for SQS batches the failed messages are reported so only they are redelivered.
+    """
+    records = event.get('Records', [])
+    if not records or records[0].get('eventSource') != 'aws:sqs':
+        results = process_emails(s3_records(event))
+        failed = [result for result in results if result['statusCode'] != 200]
+        if failed:
+            return failed[0]
+        return results[0] if len(results) == 1 else {'statusCode': 200, 'body': f'{len(results)} emails processed'}
+
+    messages = []
+    for record in records:
+        try:
+            messages.append((record['messageId'], s3_records(json.loads(record['body']))))
+        except (ValueError, KeyError) as e:
+            print(f"Invalid SQS message {record.get('messageId')}: {str(e)}")
+            messages.append((record['messageId'], None))
+    emails = [email for _, message_emails in messages for email in message_emails or []]
+    results = iter(process_emails(emails))
+    batch_item_failures = []
+    for message_id, message_emails in messages:
+        if message_emails is None:
+            batch_item_failures.append({'itemIdentifier': message_id})
+            continue
+        # Every email of the message is processed before its outcome is known
+        statuses = [next(results)['statusCode'] for _ in message_emails]
+        if any(status != 200 for status in statuses):
+            batch_item_failures.append({'itemIdentifier': message_id})
+    print(f'Processed {len(emails)} emails from {len(records)} SQS messages, {len(batch_item_failures)} messages failed')
+    return {'batchItemFailures': batch_item_failures}
\ No newline at end of file
@@ -0,0 +1,183 @@
+import os
+import re
+
+# Guardrail anonymization replaces every detected entity with its type, e.g. {NAME} or {US_SOCIAL_SECURITY_NUMBER}
+PLACEHOLDER = re.compile(r'\{[A-Z][A-Z0-9_]*\}')
+# Separator used between text nodes when the text of a document is extracted
+NODE_SEPARATOR = ' '
+# Parser backends in order of preference, lxml is C-backed and several times faster than the pure-Python html.parser
+PARSER_BACKENDS = ['lxml', 'html.parser']
+# lxml wraps fragments in the html, head and body elements a document would have, those missing from the source are not serialized
+WRAPPER_TAGS = ['html', 'head', 'body']
+
+
+def html_parser():
+    """
+    Returns the BeautifulSoup parser backend to use, taken from the HTML_PARSER environment variable
+    or the first backend of PARSER_BACKENDS that is installed.
+    """
+    from bs4.builder import builder_registry
+    configured = os.environ.get('HTML_PARSER')
+    for backend in ([configured] if configured else []) + PARSER_BACKENDS:
+        if builder_registry.lookup(backend) is not None:
+            return backend
+    return 'html.parser'
+
+
+class HtmlDocument:
+    """
+    An HTML body parsed once, serving both the text extraction and the write-back of the redacted text from the same tree.
+    """
+
+    def __init__(self, html_content, parser=None):
+        # bs4 is imported on first use, keeping it out of the Lambda import time
+        from bs4 import BeautifulSoup
+        self.parser = parser or html_parser()
+        self.soup = BeautifulSoup(html_content, self.parser)
+        self.missing_wrappers = {
+            tag for tag in WRAPPER_TAGS if not re.search(rf'<{tag}[\s/>]', html_content, re.IGNORECASE)
+        } if self.parser == 'lxml' else set()
+        self.text, self.nodes, self.offsets = extract_text_nodes(self.soup)
+
+    def serialize(self):
+        """
+        Returns the HTML of the document, without the wrapper elements the parser added around a fragment.
+        """
+        if not self.missing_wrappers:
+            return str(self.soup)
+        return ''.join(unwrap(node, self.missing_wrappers) for node in self.soup.contents)
+
+    def apply_redacted_text(self, redacted_text):
+        """
+        Writes the redacted version of self.text back into the tree and returns the redacted HTML.
+        """
+        spans = align_redacted_text(self.text, redacted_text)
+        if spans is None:
+            print("Redacted text could not be aligned with the html text nodes, falling back to word based replacement")
+            apply_words_to_nodes(self.nodes, redacted_text)
+        else:
+            apply_spans_to_nodes(self.nodes, self.offsets, spans)
+        # The nodes were replaced in the tree, extract them again so the document stays consistent
+        self.text, self.nodes, self.offsets = extract_text_nodes(self.soup)
+        return self.serialize()
+
+
+def unwrap(node, tags):
+    """
+    Serializes a node, replacing the elements named in tags by their serialized children.
+    """
+    from bs4 import NavigableString
+    if isinstance(node, NavigableString):
+        # Escapes text and adds the markup of comments, doctypes and CDATA sections, as str(soup) does
+        return node.output_ready()
+    if node.name in tags:
+        return ''.join(unwrap(child, tags) for child in node.contents)
+    return str(node)
+
+
+def extract_text_nodes(soup):
+    """
+    Collects the visible text nodes of a parsed HTML document.
+    Returns the extracted text (nodes joined with NODE_SEPARATOR), the nodes and the offset of each node in that text.
+    Comments, doctypes and script/style contents are not part of the extracted text and are never rewritten.
+    """
+    from bs4 import CData, NavigableString
+    nodes = [node for node in soup.descendants if type(node) in (NavigableString, CData)]
+    offsets = []
+    position = 0
+    for node in nodes:
+        offsets.append(position)
+        position += len(node) + len(NODE_SEPARATOR)
+    return NODE_SEPARATOR.join(nodes), nodes, offsets
+
+
+def align_redacted_text(original_text, redacted_text):
+    """
+    Maps the Guardrail output back onto the text it was produced from.
+    Returns the redacted regions as sorted (start, end, replacement) spans in original text offsets,
+    or None when the output is not the original text with entities replaced by placeholders.
+    Each literal is matched at its first occurrence after the previous one, which leaves the most room for the rest of the output,
+    except the last literal which is anchored to the end of the text: a masked entity may contain the literal that follows it.
+    """
+    spans = []
+    position = 0
+    pending = None  # (start, replacement) of a placeholder waiting for the literal text that follows it
+    tokens = []
+    last = 0
+    for match in PLACEHOLDER.finditer(redacted_text):
+        tokens.append((redacted_text[last:match.start()], match.group()))
+        last = match.end()
+    tokens.append((redacted_text[last:], None))
+    for index, (literal, placeholder) in enumerate(tokens):
+        if literal:
+            if pending is not None:
+                if index == len(tokens) - 1:
+                    end = len(original_text) - len(literal)
+                    if end < position or not original_text.endswith(literal):
+                        return None
+                else:
+                    end = original_text.find(literal, position)
+                if end < 0:
+                    return None
+                spans.append((pending[0], end, pending[1]))
+                pending = None
+                position = end
+            elif not original_text.startswith(literal, position):
+                return None
+            position += len(literal)
+        if placeholder:
+            if pending is not None:
+                # Adjacent placeholders cannot be told apart in the original text, they are kept as one span
+                pending = (pending[0], pending[1] + placeholder)
+            else:
+                pending = (position, placeholder)
+    if pending is not None:
+        spans.append((pending[0], len(original_text), pending[1]))
+    elif position != len(original_text):
+        return None
+    return spans
+
+
+def apply_spans_to_nodes(nodes, offsets, spans):
+    """
+    Rewrites the text nodes with the redacted spans in a single pass over nodes and spans.
+    A span covering several nodes writes its replacement in the first node and removes the covered text from the others.
+    """
+    span_index = 0
+    last_written = -1
+    for node, start in zip(nodes, offsets):
+        end = start + len(node)
+        while span_index < len(spans) and spans[span_index][1] <= start:
+            span_index += 1
+        if span_index == len(spans) or spans[span_index][0] >= end:
+            continue
+        text = str(node)
+        pieces = []
+        cursor = start
+        k = span_index
+        while k < len(spans) and spans[k][0] < end:
+            span_start, span_end, replacement = spans[k]
+            if k > last_written:
+                replacement_start = max(span_start, start)
+                pieces.append(text[cursor - start:replacement_start - start])
+                pieces.append(replacement)
+                last_written = k
+            cursor = max(cursor, min(span_end, end))
+            if span_end > end:
+                break
+            k += 1
+        pieces.append(text[cursor - start:])
+        node.replace_with(''.join(pieces))
+
+
+def apply_words_to_nodes(nodes, redacted_text):
+    """
+    Fallback when the redacted text cannot be aligned: distributes the redacted words over the text nodes by word count.
+    """
+    words = redacted_text.split()
+    index = 0
+    for node in nodes:
+        count = len(node.split())
+        if count:
+            node.replace_with(' '.join(words[index:index + count]))
+            index += count
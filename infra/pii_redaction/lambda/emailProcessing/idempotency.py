@@ -0,0 +1,94 @@
+import time
+
+from botocore.exceptions import ClientError
+
+# Stages of an ingestion, recorded as checkpoints so a crashed attempt resumes where it stopped
+IN_PROGRESS = 'InProgress'
+COMPLETED = 'Completed'
+CASE_ALLOCATED = 'CaseAllocated'
+REDACTED = 'Redacted'
+
+
+def ingestion_key(bucket_name, object_key, etag):
+    """
+    Identifies one version of a raw email, S3 redeliveries of the same object version share the key.
+    """
+    etag = etag.strip('"')
+    return f"{bucket_name}/{object_key}#{etag}"
+
+
+class IngestionLedger:
+    """
+    Records which raw emails have been ingested, so a redelivered S3 event returns the existing case instead of processing the email again.
+    An attempt holds a lease on its record, a crashed attempt's lease expires and the next delivery resumes from the last checkpoint.
+    """
+
+    def __init__(self, table, lease_seconds=960, ttl_seconds=None):
+        self.table = table
+        self.lease_seconds = lease_seconds
+        self.ttl_seconds = ttl_seconds
+
+    def claim(self, key):
+        """
+        Takes the lease on an ingestion. Returns the ingestion record and whether the lease was obtained.
+        The lease is refused when the ingestion is completed or another attempt holds an unexpired lease.
+        """
+        now = int(time.time())
+        values = {
+            ':in_progress': IN_PROGRESS,
+            ':lease': now + self.lease_seconds,
+            ':now': now
+        }
+        update_expression = "SET IngestionStatus = :in_progress, LeaseExpiresAt = :lease"
+        if self.ttl_seconds:
+            update_expression += ", ExpirationTime = :expiration_time"
+            values[':expiration_time'] = now + self.ttl_seconds
+        try:
+            response = self.table.update_item(
+                Key={'IngestionKey': key},
+                UpdateExpression=update_expression,
+                ConditionExpression="attribute_not_exists(IngestionKey) OR (IngestionStatus = :in_progress AND LeaseExpiresAt < :now)",
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_NEW"
+            )
+            return response['Attributes'], True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        response = self.table.get_item(Key={'IngestionKey': key}, ConsistentRead=True)
+        return response.get('Item', {}), False
+
+    def checkpoint(self, key, stage, **attributes):
+        """
+        Records the stage reached by the ingestion together with the attributes needed to resume after it.
+        """
+        attributes['Stage'] = stage
+        names = {f'#{name}': name for name in attributes}
+        values = {f':{name}': value for name, value in attributes.items()}
+        self.table.update_item(
+            Key={'IngestionKey': key},
+            UpdateExpression="SET " + ", ".join(f'#{name} = :{name}' for name in attributes),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+    def complete(self, key):
+        self.table.update_item(
+            Key={'IngestionKey': key},
+            UpdateExpression="SET IngestionStatus = :completed REMOVE LeaseExpiresAt",
+            ExpressionAttributeValues={':completed': COMPLETED}
+        )
+
+    def release(self, key):
+        """
+        Gives up the lease after a failed attempt so the next delivery can resume immediately.
+        """
+        try:
+            self.table.update_item(
+                Key={'IngestionKey': key},
+                UpdateExpression="SET LeaseExpiresAt = :expired",
+                ConditionExpression="IngestionStatus = :in_progress",
+                ExpressionAttributeValues={':expired': 0, ':in_progress': IN_PROGRESS}
+            )
+        except ClientError as e:
+            print(f"Error releasing ingestion {key}: {e.response['Error']['Message']}")
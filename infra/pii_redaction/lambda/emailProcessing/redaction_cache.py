@@ -0,0 +1,148 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+from lazy_init import Lazy
+
+# DynamoDB items are limited to 400 KB, larger texts are only kept in the in-process tier
+MAX_SHARED_TEXT_BYTES = 350 * 1024
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+
+
+class RedactionCache:
+    """
+    Two tier cache of Guardrail redaction results.
+    Entries are keyed by a hash of the exact text together with the guardrail id and version, so a new guardrail version never serves stale results
+    and a hit returns redacted text that lines up character for character with the text looked up.
+    The first tier is an in-process LRU that lives as long as the Lambda container, the second tier is a DynamoDB table with TTL shared by all containers.
+    Keys of the shared tier are an HMAC with a secret key, a plain hash of a short paragraph could be reversed by hashing guesses of it.
+    hash_key is a function returning the key as bytes, called once on first use and never while the cache lock is held.
+    """
+
+    def __init__(self, guardrail_id, guardrail_version, table=None, hash_key=None, max_entries=1024, ttl_seconds=None):
+        if table is not None and hash_key is None:
+            raise ValueError("A hash key is required to share redaction results in a table")
+        self.guardrail_id = guardrail_id
+        self.guardrail_version = guardrail_version
+        self.table = table
+        self.secret = Lazy(hash_key) if hash_key is not None else None
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, text):
+        if self.secret is None:
+            digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        else:
+            digest = hmac.new(self.secret.get(), text.encode('utf-8'), hashlib.sha256).hexdigest()
+        return f"{self.guardrail_id}#{self.guardrail_version}#{digest}"
+
+    def _remember(self, key, redacted_text):
+        with self.lock:
+            self.entries[key] = redacted_text
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_many(self, texts):
+        """
+        Returns a dict of text -> redacted text for every text found in either tier.
+        """
+        found = {}
+        shared_lookups = {}
+        # Keys are hashed before taking the lock, the first one may fetch the hash key
+        keys = [(text, self.key(text)) for text in texts]
+        with self.lock:
+            for text, key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[text] = self.entries[key]
+                else:
+                    shared_lookups.setdefault(key, []).append(text)
+            local_hits = len(found)
+            self.local_hits += local_hits
+
+        if self.table is not None and shared_lookups:
+            keys = list(shared_lookups)
+            for i in range(0, len(keys), BATCH_GET_LIMIT):
+                try:
+                    for item in self._batch_get(keys[i:i + BATCH_GET_LIMIT]):
+                        self._remember(item['TextHash'], item['RedactedText'])
+                        for text in shared_lookups.pop(item['TextHash'], []):
+                            found[text] = item['RedactedText']
+                except ClientError as e:
+                    print(f"Error reading redaction cache table: {e.response['Error']['Message']}")
+
+        with self.lock:
+            self.misses += sum(len(pending) for pending in shared_lookups.values())
+            self.shared_hits += len(found) - local_hits
+        return found
+
+    def _batch_get(self, keys):
+        table_name = self.table.name
+        request = {table_name: {'Keys': [{'TextHash': key} for key in keys], 'ProjectionExpression': 'TextHash, RedactedText'}}
+        items = []
+        while request:
+            response = self.table.meta.client.batch_get_item(RequestItems=request)
+            items.extend(response['Responses'].get(table_name, []))
+            request = response.get('UnprocessedKeys')
+        return items
+
+    def put_many(self, redacted_texts):
+        """
+        Stores a dict of text -> redacted text in both tiers.
+        """
+        if not redacted_texts:
+            return
+        expiration_time = int(time.time()) + self.ttl_seconds if self.ttl_seconds else None
+        shared_items = {}
+        for text, redacted_text in redacted_texts.items():
+            key = self.key(text)
+            self._remember(key, redacted_text)
+            if len(redacted_text.encode('utf-8')) <= MAX_SHARED_TEXT_BYTES:
+                item = {'TextHash': key, 'RedactedText': redacted_text}
+                if expiration_time:
+                    item['ExpirationTime'] = expiration_time
+                shared_items[key] = item
+
+        if self.table is None or not shared_items:
+            return
+        try:
+            with self.table.batch_writer(overwrite_by_pkeys=['TextHash']) as batch:
+                for item in shared_items.values():
+                    batch.put_item(Item=item)
+        except ClientError as e:
+            print(f"Error writing redaction cache table: {e.response['Error']['Message']}")
+
+    def take_counts(self):
+        """
+        Returns the hits, misses and evictions counted since the previous call, as metric names and values.
+        """
+        with self.lock:
+            counts = {
+                'RedactionCacheLocalHits': self.local_hits,
+                'RedactionCacheSharedHits': self.shared_hits,
+                'RedactionCacheMisses': self.misses,
+                'RedactionCacheEvictions': self.evictions
+            }
+            self.local_hits = self.shared_hits = self.misses = self.evictions = 0
+        return counts
+
+    def stats(self):
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries)
+        }
@@ -0,0 +1,117 @@
+import binascii
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# S3 requires every part of a multipart upload but the last one to be at least 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+# Size of the slices of an encoded MIME payload decoded at a time
+DECODE_SLICE_CHARS = 1024 * 1024
+NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+def iter_base64(encoded):
+    """
+    Decodes a base64 string slice by slice, so only one decoded slice is held in memory at a time.
+    """
+    carry = ''
+    for position in range(0, len(encoded), DECODE_SLICE_CHARS):
+        cleaned = carry + NOT_BASE64.sub('', encoded[position:position + DECODE_SLICE_CHARS])
+        cut = len(cleaned) - len(cleaned) % 4
+        carry = cleaned[cut:]
+        if cut:
+            yield binascii.a2b_base64(cleaned[:cut])
+    if carry.rstrip('='):
+        yield binascii.a2b_base64(carry + '=' * (-len(carry) % 4))
+
+
+def iter_part_content(part):
+    """
+    Yields the decoded content of a MIME part in chunks. Base64 payloads, the encoding used for almost all attachments,
+    are decoded incrementally, other encodings are decoded in one piece.
+    """
+    if part.get('Content-Transfer-Encoding', '').strip().lower() == 'base64':
+        yield from iter_base64(part.get_payload())
+    else:
+        content = part.get_payload(decode=True)
+        if content:
+            yield content
+
+
+def upload_stream(s3, bucket_name, key, chunks, content_type=None, part_size=8 * 1024 * 1024, max_workers=4):
+    """
+    Uploads an iterable of byte chunks to S3.
+    Content smaller than part_size is written with a single put_object, larger content with a multipart upload
+    whose parts are uploaded by up to max_workers threads, so at most max_workers + 1 parts are held in memory.
+    Returns the number of bytes uploaded.
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    extra_args = {'ContentType': content_type} if content_type else {}
+    buffer = bytearray()
+    upload_id = None
+    executor = None
+    in_flight = set()
+    futures = []
+    size = 0
+
+    def submit_part(body):
+        part_number = len(futures) + 1
+        future = executor.submit(s3.upload_part, Bucket=bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)
+        futures.append(future)
+        in_flight.add(future)
+        if len(in_flight) >= max_workers:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for finished in done:
+                finished.result()
+            in_flight.difference_update(done)
+
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            buffer.extend(chunk)
+            while len(buffer) >= part_size:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key, **extra_args)['UploadId']
+                    executor = ThreadPoolExecutor(max_workers=max_workers)
+                submit_part(bytes(buffer[:part_size]))
+                del buffer[:part_size]
+        if upload_id is None:
+            s3.put_object(Bucket=bucket_name, Key=key, Body=bytes(buffer), **extra_args)
+            return size
+        if buffer:
+            submit_part(bytes(buffer))
+        parts = [{'PartNumber': number, 'ETag': future.result()['ETag']} for number, future in enumerate(futures, start=1)]
+        s3.complete_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+        return size
+    except Exception:
+        if upload_id is not None:
+            # Parts still uploading would be stored after the abort, they are cancelled or waited for first
+            executor.shutdown(wait=True, cancel_futures=True)
+            try:
+                s3.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+            except Exception as e:
+                # The upload error is the one raised, parts left behind are removed by the bucket lifecycle rule
+                print(f"Error aborting multipart upload of {key}: {e}")
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def upload_objects(uploads, max_workers=8):
+    """
+    Runs upload callables concurrently on a bounded thread pool.
+    Each upload is a (key, callable) pair, the callable returns the number of bytes written.
+    Returns one (key, bytes, seconds) timing per upload in the order given and raises the first failure once all uploads finished.
+    """
+    def timed(upload):
+        key, function = upload
+        started = time.perf_counter()
+        size = function()
+        return key, size, time.perf_counter() - started
+
+    if not uploads:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uploads))) as executor:
+        futures = [executor.submit(timed, upload) for upload in uploads]
+    return [future.result() for future in futures]
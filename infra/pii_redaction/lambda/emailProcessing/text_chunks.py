@@ -0,0 +1,61 @@
+import re
+
+# Preferred chunk boundaries, from strongest to weakest: paragraph break, sentence end, whitespace
+BOUNDARIES = [re.compile(r'\n\s*\n'), re.compile(r'[.!?]\s+'), re.compile(r'\s+')]
+
+
+def split_into_chunks(text, max_chars):
+    """
+    Splits text into consecutive (start, end) ranges of at most max_chars characters.
+    Each range ends at the last paragraph break found in its second half, else the last sentence end, else the last whitespace.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        limit = start + max_chars
+        end = limit
+        for boundary in BOUNDARIES:
+            matches = [match.end() for match in boundary.finditer(text, start + max_chars // 2, limit)]
+            if matches:
+                end = matches[-1]
+                break
+        chunks.append((start, end))
+        start = end
+    chunks.append((start, len(text)))
+    return chunks
+
+
+def with_overlap(text, start, end, overlap):
+    """
+    Widens a chunk by overlap characters on each side so entities crossing the chunk boundary are seen whole.
+    """
+    return max(0, start - overlap), min(len(text), end + overlap)
+
+
+def merge_spans(spans):
+    """
+    Merges sorted (start, end, replacement) spans coming from overlapping chunks.
+    A span overlapping the previous one extends it instead of being masked a second time.
+    """
+    merged = []
+    for start, end, replacement in spans:
+        if merged and start < merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end, merged[-1][2])
+        else:
+            merged.append((start, end, replacement))
+    return merged
+
+
+def apply_spans_to_text(text, spans):
+    """
+    Returns text with every (start, end, replacement) span replaced.
+    """
+    pieces = []
+    cursor = 0
+    for start, end, replacement in spans:
+        pieces.append(text[cursor:start])
+        pieces.append(replacement)
+        cursor = end
+    pieces.append(text[cursor:])
+    return ''.join(pieces)
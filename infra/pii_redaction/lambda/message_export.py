@@ -0,0 +1,169 @@
+import csv
+import io
+import time
+
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+# Statuses of an export job
+PENDING = 'Pending'
+RUNNING = 'Running'
+COMPLETED = 'Completed'
+FAILED = 'Failed'
+# BatchGetItem reads at most 100 keys per request
+BATCH_GET_KEYS = 100
+# Every part of a multipart upload but the last must be at least 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def batch_get_items(dynamodb, table_name: str, key_name: str, values: list, query: dict = None):
+    """
+    Yields the items whose key_name is one of values as lists of at most 100 items, each read with one BatchGetItem request,
+    in the order of values. Unprocessed keys are requested again with an exponential backoff, values without an item are skipped.
+    """
+    values = list(dict.fromkeys(values))
+    for start in range(0, len(values), BATCH_GET_KEYS):
+        chunk = values[start:start + BATCH_GET_KEYS]
+        request = {table_name: dict(query or {}, Keys=[{key_name: value} for value in chunk])}
+        found = {}
+        attempt = 0
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(table_name, []):
+                found[item[key_name]] = item
+            request = response.get('UnprocessedKeys')
+            if request:
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+                attempt += 1
+        yield [found[value] for value in chunk if value in found]
+
+
+class MultipartCsvUpload:
+    """
+    Streams CSV rows into an S3 multipart upload, a part is uploaded each time part_size bytes of rows are buffered,
+    so the size of an export is not bounded by the memory or the disk of the Lambda.
+    """
+
+    def __init__(self, s3, bucket_name: str, key: str, fieldnames: list, part_size: int = MIN_PART_SIZE):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.parts = []
+        self.rows = 0
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=fieldnames)
+        self.writer.writeheader()
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key, ContentType='text/csv')['UploadId']
+
+    def write(self, row: dict):
+        self.writer.writerow(row)
+        self.rows += 1
+        # A character is at least one byte, the part is never smaller than part_size
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        response = self.s3.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=len(self.parts) + 1,
+            Body=self.buffer.getvalue().encode('utf-8')
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': len(self.parts) + 1})
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def complete(self):
+        if self.buffer.tell() or not self.parts:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+
+
+class ExportJobStore:
+    """
+    Records the status of export jobs, created by the API when an export is requested and updated by the export function running it.
+    """
+
+    def __init__(self, table, ttl_seconds: int):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+
+    def create(self, job_id: str, case_count: int, export_key: str):
+        now = datetime.now(timezone.utc)
+        self.table.put_item(Item={
+            'JobID': job_id,
+            'JobStatus': PENDING,
+            'CaseCount': case_count,
+            'ExportKey': export_key,
+            'CreatedTime': now.isoformat(),
+            'ExpirationTime': int(now.timestamp()) + self.ttl_seconds
+        })
+
+    def get(self, job_id: str) -> dict:
+        return self.table.get_item(Key={'JobID': job_id}, ConsistentRead=True).get('Item')
+
+    def _transition(self, job_id: str, statuses: list, update: str, values: dict, names: dict = None) -> bool:
+        """
+        Applies an update to a job that is in one of statuses. Returns False when the job moved on already.
+        """
+        allowed = {f":from{index}": status for index, status in enumerate(statuses)}
+        try:
+            self.table.update_item(
+                Key={'JobID': job_id},
+                UpdateExpression=update,
+                ConditionExpression=f"JobStatus IN ({', '.join(allowed)})",
+                ExpressionAttributeValues={**values, **allowed},
+                **({'ExpressionAttributeNames': names} if names else {})
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def start(self, job_id: str) -> bool:
+        """
+        Moves a pending job to running. Returns False when the job already started, as for a retried invocation,
+        or when it expired before the export function ran.
+        """
+        return self._transition(job_id, [PENDING], "SET JobStatus = :running", {':running': RUNNING})
+
+    def finish(self, job_id: str, rows: int) -> bool:
+        return self._transition(
+            job_id,
+            [RUNNING],
+            "SET JobStatus = :completed, RowCount = :rows, CompletedTime = :now",
+            {':completed': COMPLETED, ':rows': rows, ':now': datetime.now(timezone.utc).isoformat()}
+        )
+
+    def fail(self, job_id: str, error: str, statuses: list = (RUNNING,)) -> bool:
+        return self._transition(
+            job_id,
+            list(statuses),
+            "SET JobStatus = :failed, #error = :error, CompletedTime = :now",
+            {':failed': FAILED, ':error': error, ':now': datetime.now(timezone.utc).isoformat()},
+            {'#error': 'Error'}
+        )
+
+    def expire(self, job: dict, timeout_seconds: int) -> dict:
+        """
+        Marks a job still pending or running timeout_seconds after its creation as failed, its export function has timed out
+        or never ran. Returns the job as stored afterwards.
+        """
+        if job['JobStatus'] not in (PENDING, RUNNING):
+            return job
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(job['CreatedTime'])
+        if age.total_seconds() < timeout_seconds:
+            return job
+        self.fail(job['JobID'], f"Export did not finish within {timeout_seconds // 60} minutes", [PENDING, RUNNING])
+        return self.get(job['JobID'])
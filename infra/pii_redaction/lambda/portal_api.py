@@ -1,11 +1,14 @@
 import base64
 import boto3
-import csv
+import heapq
+import itertools
 import json
 import os
 import jwt
+import re
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
@@ -22,7 +25,9 @@ from aws_lambda_powertools.event_handler.exceptions import (
     InternalServerError,
     NotFoundError,
 )
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
+from message_export import COMPLETED, FAILED, PENDING, ExportJobStore, MultipartCsvUpload, batch_get_items
 
 logger = Logger(
     log_record_order=["message", "operation", "service", "namespace"],
@@ -40,6 +45,46 @@ logs_client = boto3.client('logs', region_name=os.environ['AWS_REGION'])
 
 app = APIGatewayRestResolver(cors=CORSConfig(allow_origin="*"), debug=True if os.environ['ENVIRONMENT'] in ['local', 'development'] else False)
 
+# Number of messages in a page of the message listing when a page is requested without a limit, and the largest limit accepted
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+# Attributes the redacted body of a message is read from, see get_email_body
+BODY_SOURCE_FIELDS = ['ProcessedBucketName', 'ProcessedFilePath', 'EmailBody']
+FIELD_NAME = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+# Number of message bodies read from S3 concurrently when a listing includes them
+BODY_FETCH_WORKERS = int(os.environ.get('BODY_FETCH_WORKERS', '16'))
+# The inventory item of this case ID holds the case ID counter of the email processing Lambda, it is not a message
+CASE_ID_COUNTER_KEY = 0
+# Shards of each status in the EmailIndexStatusTime index, set like for the email processing Lambda that writes them
+STATUS_SHARDS = int(os.environ.get('STATUS_SHARDS', '8'))
+# Attributes listed messages are always read with, shards are merged on them and page tokens are made of them
+INDEX_KEY_FIELDS = ['CaseID', 'StatusShard', 'EmailReceiveTime']
+# Export jobs write their request and CSV file under this prefix of the export bucket, job records expire after EXPORT_RETENTION_DAYS
+EXPORT_PREFIX = 'exports'
+EXPORT_FIELDNAMES = ['case_id', 'from', 'subject', 'body', 'dominant_language', 'date_sent']
+EXPORT_SOURCE_FIELDS = ['CaseID', 'FromAddress', 'EmailSubject', 'DominantLanguage', 'EmailReceiveTime'] + BODY_SOURCE_FIELDS
+EXPORT_RETENTION_SECONDS = int(os.environ.get('EXPORT_RETENTION_DAYS', '7')) * 24 * 60 * 60
+# Lifetime in seconds of the download URL of an export
+EXPORT_URL_EXPIRATION = int(os.environ.get('EXPORT_URL_EXPIRATION', '3600'))
+# Export jobs not finished this many seconds after they were requested are failed, the export function times out after 15 minutes
+EXPORT_JOB_TIMEOUT = int(os.environ.get('EXPORT_JOB_TIMEOUT', '1020'))
+
+def export_jobs() -> ExportJobStore:
+    return ExportJobStore(dynamodb.Table(os.environ['EXPORT_JOBS_TABLE_NAME']), EXPORT_RETENTION_SECONDS)
+
+def get_message_item(table, case_id: str) -> dict:
+    """
+    Returns the inventory item of a message, raising NotFoundError for unknown case IDs and for the case ID counter.
+    """
+    try:
+        key = int(case_id)
+    except ValueError:
+        raise NotFoundError(f"Message with case ID {case_id} not found")
+    item = table.get_item(Key={'CaseID': key}).get('Item') if key != CASE_ID_COUNTER_KEY else None
+    if item is None:
+        raise NotFoundError(f"Message with case ID {case_id} not found")
+    return item
+
 def get_email_body(message: dict) -> str:
     try:
         email_body = s3_client.get_object(Bucket=message['ProcessedBucketName'], Key=message['ProcessedFilePath'] + '/body/email_body.txt')
@@ -49,6 +94,140 @@ def get_email_body(message: dict) -> str:
         logger.error(f"Error retrieving email body: {e}")
         return message['EmailBody']
 
+def encode_page_token(positions: dict) -> str:
+    """
+    Wraps the positions of the queries of a listing, made of their LastEvaluatedKey, into an opaque, URL safe token.
+    """
+    serialized = json.dumps(positions, default=lambda value: int(value) if value % 1 == 0 else float(value), separators=(',', ':'))
+    return base64.urlsafe_b64encode(serialized.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_token(token: str) -> dict:
+    """
+    Returns the query positions wrapped in a token made by encode_page_token.
+    """
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise BadRequestError("Invalid next_token")
+    if not isinstance(positions, dict):
+        raise BadRequestError("Invalid next_token")
+    return positions
+
+def parse_page_size(limit: str) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+        raise BadRequestError(f"limit must be a number between 1 and {MAX_PAGE_SIZE}")
+    return int(limit)
+
+def parse_fields(fields: str) -> list:
+    """
+    Returns the attribute names of a comma separated field selection, an empty list selects every attribute.
+    """
+    if not fields:
+        return []
+    names = list(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+    for name in names:
+        if not FIELD_NAME.match(name):
+            raise BadRequestError(f"Invalid field {name}")
+    return names
+
+def projection(fields: list) -> dict:
+    """
+    Returns the query parameters reading only the given attributes, names are aliased so reserved words can be selected.
+    """
+    names = {f"#f{index}": field for index, field in enumerate(fields)}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+
+def get_email_bodies(messages: list) -> list:
+    """
+    Returns the redacted bodies of messages, in order, read concurrently on a bounded thread pool.
+    """
+    if len(messages) <= 1:
+        return [get_email_body(message) for message in messages]
+    with ThreadPoolExecutor(max_workers=min(BODY_FETCH_WORKERS, len(messages))) as executor:
+        return list(executor.map(get_email_body, messages))
+
+def status_shards(body_status: str) -> list:
+    return [f"{body_status}#{shard}" for shard in range(STATUS_SHARDS)]
+
+def shard_positions(body_status: str, positions: dict) -> dict:
+    """
+    Checks the positions of a page token: each shard of the status maps to the key of the last message listed from it,
+    or to false once it was listed entirely.
+    """
+    shards = status_shards(body_status)
+    for shard, position in positions.items():
+        if shard not in shards or not (position is False or (isinstance(position, dict) and set(position) == set(INDEX_KEY_FIELDS))):
+            raise BadRequestError("Invalid next_token")
+    return positions
+
+def shard_items(table, query: dict, results: dict):
+    """
+    Yields the messages of one shard from an already queried first page, reading the following pages on demand.
+    """
+    while True:
+        yield from results['Items']
+        if 'LastEvaluatedKey' not in results:
+            return
+        query = dict(query, ExclusiveStartKey=results['LastEvaluatedKey'])
+        results = table.query(**query)
+
+def list_newest(table, body_status: str, query: dict, limit: int = None, positions: dict = None) -> tuple:
+    """
+    Lists the messages of a status newest first with a scatter-gather over its shards: the first page of every shard
+    is queried concurrently and the shards, each sorted on EmailReceiveTime, are merged with a k-way heap merge.
+    Shards missing from positions are listed from their newest message.
+    Returns up to limit messages, all of them without a limit, and the positions to list the next ones from, None when none is left.
+    """
+    positions = positions or {}
+    queries = {}
+    for shard in status_shards(body_status):
+        if positions.get(shard) is False:
+            continue
+        queries[shard] = dict(query, KeyConditionExpression=Key('StatusShard').eq(shard), ScanIndexForward=False)
+        if limit:
+            # One message more than the page tells whether another page follows
+            queries[shard]['Limit'] = limit + 1
+        if positions.get(shard):
+            queries[shard]['ExclusiveStartKey'] = positions[shard]
+    if not queries:
+        return [], None
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        first_pages = dict(zip(queries, executor.map(lambda shard_query: table.query(**shard_query), queries.values())))
+
+    ended = set()
+    def items_of(shard):
+        yield from shard_items(table, queries[shard], first_pages[shard])
+        ended.add(shard)
+    merged = heapq.merge(*(items_of(shard) for shard in queries), key=lambda item: item['EmailReceiveTime'], reverse=True)
+    items = list(itertools.islice(merged, limit + 1 if limit else None))
+    if not limit or len(items) <= limit:
+        return items, None
+    following = items.pop()
+    next_positions = dict(positions)
+    for item in items:
+        next_positions[item['StatusShard']] = {field: item[field] for field in INDEX_KEY_FIELDS}
+    for shard in ended:
+        # A shard whose every message was read is left out of the next pages, unless the message after the page is its last one
+        if shard != following['StatusShard']:
+            next_positions[shard] = False
+    return items, next_positions
+
+def redacted_attachments(message: dict) -> list:
+    """
+    Returns the redacted attachments of a message from the manifest recorded on its item by the processing Lambdas.
+    Messages processed before the manifest existed have their attachments folder listed instead.
+    """
+    if 'Attachments' in message:
+        return [attachment for attachment in message['Attachments'].values() if attachment['RedactionStatus'] == 'Redacted']
+    attachments = s3_client.list_objects_v2(Bucket=message['ProcessedBucketName'], Prefix=message['ProcessedFilePath'] + '/attachments/')
+    logger.debug(attachments)
+    return [file for file in attachments.get('Contents', []) if int(file['Size']) > 0]
+
 def record_user_activity(details: str):
     if app.current_event.headers.get('Authorization') and not app.current_event.headers.get('Authorization').startswith('Basic'):
         auth_token = app.current_event.headers.get('Authorization').split(' ')[1]
@@ -79,28 +258,54 @@ def handle_general_exception(ex: Exception):  # receives exception raised
 
 @app.get("/api/messages")
 def list_messages():
+    """
+    Lists the processed messages newest first, one page at a time, returned as {"items": [...], "next_token": ...}.
+    A page holds limit messages, DEFAULT_PAGE_SIZE by default, the next one is requested with next_token, null on the last page.
+    fields selects the attributes returned, e.g. fields=CaseID,EmailSubject,RedactedBody.
+    Without fields, RedactedBody holds the preview of the redacted body stored in EmailBody, the full body is only read
+    from S3 when RedactedBody is selected in fields or with include_body=true.
+    """
     table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
-    results = table.query(
-        IndexName='EmailIndexBodyStatus',
-        KeyConditionExpression=boto3.dynamodb.conditions.Key('BodyStatus').eq('Processed')
-    )
-    logger.debug(results['Items'])
+    event = app.current_event
+    fields = parse_fields(event.get_query_string_value('fields'))
+    with_body = 'RedactedBody' in fields or event.get_query_string_value('include_body', 'false').lower() == 'true'
+    query = {'IndexName': 'EmailIndexStatusTime'}
+    hidden = []
+    if fields:
+        selected = [field for field in fields if field != 'RedactedBody']
+        selected += [field for field in INDEX_KEY_FIELDS if field not in selected]
+        if with_body:
+            selected += [field for field in BODY_SOURCE_FIELDS if field not in selected]
+        hidden = [field for field in selected if field not in fields]
+        query.update(projection(selected))
 
-    for result in results['Items']:
-        result['RedactedBody'] = get_email_body(result)
+    next_token = event.get_query_string_value('next_token')
+    positions = shard_positions('Processed', decode_page_token(next_token)) if next_token else {}
+    items, next_positions = list_newest(table, 'Processed', query, parse_page_size(event.get_query_string_value('limit')), positions)
+    logger.debug(items)
+
+    if with_body:
+        for result, body in zip(items, get_email_bodies(items)):
+            result['RedactedBody'] = body
+    elif not fields:
+        for result in items:
+            result['RedactedBody'] = result.get('EmailBody', '')
+    for result in items:
+        for field in hidden:
+            result.pop(field, None)
 
     record_user_activity('viewed all messages')
 
-    return results['Items']
+    return {
+        'items': items,
+        'next_token': encode_page_token(next_positions) if next_positions else None
+    }
     
 @app.get("/api/messages/<case_id>")
 def get_message(case_id: int):
     table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
-    result = table.get_item(Key={'CaseID': int(case_id)})
+    result = {'Item': get_message_item(table, case_id)}
 
-    if 'Item' not in result:
-        raise NotFoundError(f"Message with case ID {case_id} not found")
-    
     result['Item']['RedactedBody'] = get_email_body(result['Item'])
     logger.debug(result)
     folders_tbl = dynamodb.Table(os.environ['FOLDERS_TABLE_NAME'])
@@ -109,10 +314,7 @@ def get_message(case_id: int):
     result['Item']['folder'] = folder['Item']
 
     try:
-        attachments = s3_client.list_objects_v2(Bucket=result['Item']['ProcessedBucketName'], Prefix='redacted')
-        logger.debug(attachments)
-
-        fileObjects = [file for file in attachments['Contents'] if int(file['Size']) > 0 and file['Key'].startswith(result['Item']['ProcessedFilePath'] + '/attachments')]
+        fileObjects = redacted_attachments(result['Item'])
 
         if fileObjects:
             result['Item']['files'] = []
@@ -134,10 +336,7 @@ def get_message(case_id: int):
 def forward_message(case_id: int):
     print("here in forwarding function")
     table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
-    result = table.get_item(Key={'CaseID': int(case_id)})
-
-    if 'Item' not in result:
-        raise NotFoundError(f"Message with case ID {case_id} not found")
+    result = {'Item': get_message_item(table, case_id)}
     logger.info("forwarding email logs")
     logger.debug(result)
     response = lambda_client.invoke(
@@ -155,45 +354,121 @@ def forward_message(case_id: int):
 
 @app.post("/api/messages/export")
 def export_messages():
-    table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
+    """
+    Starts an export job for the messages of the given case IDs and returns its ID.
+    The CSV file is written to S3 by the export function, its status and download URL are served by get_export_job.
+    """
     body = app.current_event.json_body
     logger.debug(body)
-    int_case_ids = [int(case_id) for case_id in body['case_id']]
-    results = table.query(
-        KeyConditionExpression=boto3.dynamodb.conditions.Key('CaseID').is_in(int_case_ids)
+    int_case_ids = [case_id for case_id in dict.fromkeys(int(case_id) for case_id in body.get('case_id', [])) if case_id != CASE_ID_COUNTER_KEY]
+    if not int_case_ids:
+        raise BadRequestError('No messages found')
+
+    job_id = str(uuid.uuid4())
+    # The case IDs are handed over in S3, an asynchronous invocation payload is limited to 256 KB
+    s3_client.put_object(
+        Bucket=os.environ['EXPORT_BUCKET_NAME'],
+        Key=f"{EXPORT_PREFIX}/{job_id}/request.json",
+        Body=json.dumps({'case_ids': int_case_ids}),
+        ContentType='application/json'
+    )
+    export_jobs().create(job_id, len(int_case_ids), f"{EXPORT_PREFIX}/{job_id}/messages.csv")
+    lambda_client.invoke(
+        FunctionName=os.environ['EXPORT_FUNCTION_NAME'],
+        InvocationType='Event',
+        Payload=json.dumps({'job_id': job_id})
+    )
+
+    record_user_activity(f"started export {job_id} of {len(int_case_ids)} messages")
+
+    return Response(
+        status_code=HTTPStatus.ACCEPTED,
+        content_type=content_types.APPLICATION_JSON,
+        body=json.dumps({'job_id': job_id, 'status': PENDING}),
     )
-    logger.debug(results)
-
-    if results['Items']:
-        with open('/tmp/messages.csv', 'w+', newline='') as csvfile:
-            fieldnames = ['case_id', 'from', 'subject', 'body', 'dominant_language', 'date_sent']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for item in results['Items']:
-                writer.writerow({
-                    'case_id': item['CaseID'],
-                    'from': item['FromAddress'],
-                    'subject': item['EmailSubject'],
-                    'body': get_email_body(item),
-                    'dominant_language': item['DominantLanguage'],
-                    'date_sent': datetime.fromisoformat(item['EmailReceiveTime']).strftime("%Y-%m-%d %H:%M:%S")
-                })
 
-        with open('/tmp/messages.csv', 'rb') as f:
-            content = f.read()
-            body = base64.b64encode(content).decode('utf-8')
-        
-        record_user_activity(f"exported messages")
+@app.get("/api/messages/export/<job_id>")
+def get_export_job(job_id: str):
+    jobs = export_jobs()
+    job = jobs.get(job_id)
 
-        return {
-            "statusCode": 200,
-            "headers": {
-                'Content-Type': 'text/csv',
+    if job is None:
+        raise NotFoundError(f"Export job {job_id} not found")
+    job = jobs.expire(job, EXPORT_JOB_TIMEOUT)
+
+    result = {
+        'job_id': job_id,
+        'status': job['JobStatus'],
+        'case_count': job['CaseCount'],
+        'row_count': job.get('RowCount')
+    }
+    if job['JobStatus'] == COMPLETED:
+        result['url'] = s3_client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': os.environ['EXPORT_BUCKET_NAME'],
+                'Key': job['ExportKey'],
+                'ResponseContentDisposition': 'attachment; filename="messages.csv"'
             },
-            "body": body,
-            "isBase64Encoded": True
-        }
-    raise BadRequestError('No messages found')
+            ExpiresIn=EXPORT_URL_EXPIRATION
+        )
+    elif job['JobStatus'] == FAILED:
+        result['error'] = job.get('Error')
+
+    record_user_activity(f"viewed export {job_id}")
+    return result
+
+def export_rows(case_ids: list, upload: MultipartCsvUpload):
+    """
+    Writes the CSV rows of the messages of case_ids, read with BatchGetItem in chunks of 100 messages
+    whose bodies are fetched concurrently.
+    """
+    query = projection(EXPORT_SOURCE_FIELDS)
+    for items in batch_get_items(dynamodb, os.environ['MESSAGES_TABLE_NAME'], 'CaseID', case_ids, query):
+        for item, body in zip(items, get_email_bodies(items)):
+            upload.write({
+                'case_id': item['CaseID'],
+                'from': item['FromAddress'],
+                'subject': item['EmailSubject'],
+                'body': body,
+                'dominant_language': item['DominantLanguage'],
+                'date_sent': datetime.fromisoformat(item['EmailReceiveTime']).strftime("%Y-%m-%d %H:%M:%S")
+            })
+
+def export_handler(event: dict, context: LambdaContext) -> dict:
+    """
+    Runs an export job started by export_messages, invoked asynchronously: the CSV rows are streamed into a multipart upload.
+    """
+    logger.debug('Received event: ' + json.dumps(event))
+    job_id = event['job_id']
+    jobs = export_jobs()
+    if not jobs.start(job_id):
+        logger.info(f"Export job {job_id} already started")
+        return {'job_id': job_id}
+    job = jobs.get(job_id)
+    bucket_name = os.environ['EXPORT_BUCKET_NAME']
+    try:
+        request = s3_client.get_object(Bucket=bucket_name, Key=f"{EXPORT_PREFIX}/{job_id}/request.json")
+        case_ids = json.loads(request['Body'].read())['case_ids']
+        upload = MultipartCsvUpload(s3_client, bucket_name, job['ExportKey'], EXPORT_FIELDNAMES)
+        try:
+            export_rows(case_ids, upload)
+            upload.complete()
+        except Exception:
+            # A failed abort must not hide the error of the export, the incomplete upload expires with the bucket lifecycle
+            try:
+                upload.abort()
+            except Exception as e:
+                logger.warning(f"Aborting the upload of export job {job_id} failed: {e}")
+            raise
+        if jobs.finish(job_id, upload.rows):
+            logger.info(f"Export job {job_id} wrote {upload.rows} messages")
+        else:
+            logger.warning(f"Export job {job_id} wrote {upload.rows} messages after it expired")
+    except Exception as e:
+        logger.exception(f"Export job {job_id} failed: {e}")
+        jobs.fail(job_id, str(e))
+    return {'job_id': job_id}
 
 # @logger.inject_lambda_context(log_event=True)
 # @event_source(data_class=APIGatewayProxyEvent)
@@ -0,0 +1,63 @@
+import threading
+
+try:
+    # Provided by the Lambda Python runtime when SnapStart is enabled
+    from snapshot_restore_py import register_before_snapshot, register_after_restore
+except ImportError:
+    def register_before_snapshot(function):
+        return function
+
+    def register_after_restore(function):
+        return function
+
+# boto3 sessions are not thread safe, clients and resources are created one at a time
+init_lock = threading.RLock()
+
+
+class Lazy:
+    """
+    Proxy creating the wrapped object on first use, so module import stays cheap and objects a code path never touches are never created.
+    Attribute access is forwarded to the wrapped object.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+
+    def get(self):
+        if self._value is None:
+            with init_lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def client(service_name):
+    """
+    Returns a lazily created boto3 client.
+    """
+    def create():
+        import boto3
+        return boto3.client(service_name)
+    return Lazy(create)
+
+
+def resource(service_name):
+    """
+    Returns a lazily created boto3 resource.
+    """
+    def create():
+        import boto3
+        return boto3.resource(service_name)
+    return Lazy(create)
+
+
+def warm_up(*lazies):
+    """
+    Creates the given lazy objects, used before a SnapStart snapshot so restored environments start with ready clients.
+    """
+    for lazy in lazies:
+        lazy.get()
@@ -0,0 +1,201 @@
+import json
+import math
+import threading
+import time
+
+# Metrics recorded for every stage, with their CloudWatch units
+STAGE_METRICS = [
+    {'Name': 'Duration', 'Unit': 'Milliseconds'},
+    {'Name': 'Bytes', 'Unit': 'Bytes'},
+    {'Name': 'GuardrailInputChars', 'Unit': 'Count'},
+    {'Name': 'GuardrailOutputChars', 'Unit': 'Count'}
+]
+COUNTERS = ['Bytes', 'GuardrailInputChars', 'GuardrailOutputChars']
+
+
+def print_sink(record):
+    """
+    Writes the record to the Lambda log, where CloudWatch extracts the metrics of Embedded Metric Format records.
+    """
+    print(json.dumps(record, default=str))
+
+
+class LocalSink:
+    """
+    Keeps the records in memory, so tests and local runs can compute latency percentiles per stage.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def durations(self, stage):
+        return sorted(record['Duration'] for record in self.records if record.get('Stage') == stage)
+
+    def percentile(self, stage, percent):
+        """
+        Returns the nearest-rank percentile of the durations of a stage, or None when the stage was never recorded.
+        """
+        durations = self.durations(stage)
+        if not durations:
+            return None
+        return durations[max(0, math.ceil(percent / 100 * len(durations)) - 1)]
+
+    def summary(self):
+        stages = sorted({record['Stage'] for record in self.records if 'Stage' in record})
+        return {
+            stage: {
+                'count': len(self.durations(stage)),
+                'p50': self.percentile(stage, 50),
+                'p99': self.percentile(stage, 99)
+            }
+            for stage in stages
+        }
+
+
+class StageTimer:
+    """
+    Times the consecutive stages of the processing of one case.
+    Starting a stage finishes the previous one, every finished stage is emitted as one record.
+    """
+
+    def __init__(self, metrics, case_id):
+        self.metrics = metrics
+        self.case_id = case_id
+        self.stage = None
+        # Threads running work of the current stage for its thread count into it, see StageMetrics.propagate
+        self.lock = threading.Lock()
+
+    def start(self, step):
+        """
+        Finishes the current stage and starts the given step. The stage dimension is the part of the step before ':', e.g. "Step 3".
+        Returns the step so it can be assigned to the step being reported on failure.
+        """
+        self.finish()
+        self.stage = {'step': step, 'started': time.perf_counter(), 'counters': dict.fromkeys(COUNTERS, 0)}
+        return step
+
+    def count(self, **values):
+        with self.lock:
+            if self.stage is not None:
+                for name, value in values.items():
+                    self.stage['counters'][name] += value
+
+    def finish(self, failed=False):
+        if self.stage is None:
+            return
+        stage, self.stage = self.stage, None
+        duration = (time.perf_counter() - stage['started']) * 1000
+        self.metrics.emit(self.case_id, stage['step'], duration, stage['counters'], failed)
+
+
+class StageMetrics:
+    """
+    Per stage latency instrumentation emitting CloudWatch Embedded Metric Format records.
+    Each thread has its own current timer, so helpers deep in the pipeline can add byte and character counts to the stage running on their thread.
+    """
+
+    def __init__(self, namespace, service, sink=print_sink):
+        self.namespace = namespace
+        self.service = service
+        self.sink = sink
+        self.local = threading.local()
+
+    def begin(self, case_id=0):
+        """
+        Starts timing a case on the current thread and returns its timer.
+        """
+        self.local.timer = StageTimer(self, case_id)
+        return self.local.timer
+
+    def end(self, failed=False):
+        timer = getattr(self.local, 'timer', None)
+        if timer is not None:
+            timer.finish(failed)
+            self.local.timer = None
+
+    def start(self, step):
+        """
+        Starts the given step on the timer of the current thread, if any, and returns the step.
+        """
+        timer = getattr(self.local, 'timer', None)
+        if timer is not None:
+            timer.start(step)
+        return step
+
+    def count(self, **values):
+        """
+        Adds counts (Bytes, GuardrailInputChars, GuardrailOutputChars) to the stage running on the current thread, if any.
+        """
+        timer = getattr(self.local, 'timer', None)
+        if timer is not None:
+            timer.count(**values)
+
+    def propagate(self, function):
+        """
+        Wraps function so that, run on another thread such as a thread pool worker, it counts into the stage running on the current thread.
+        """
+        timer = getattr(self.local, 'timer', None)
+
+        def run(*args, **kwargs):
+            previous = getattr(self.local, 'timer', None)
+            self.local.timer = timer
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.timer = previous
+        return run
+
+    def emit_metric(self, name, value=1, unit='Count'):
+        """
+        Emits a single metric outside of any stage, e.g. a count of configuration errors.
+        """
+        self.emit_metrics({name: value}, unit)
+
+    def emit_metrics(self, values, unit='Count'):
+        """
+        Emits several metrics of the same unit outside of any stage in one record, e.g. the cache hits and misses of a case.
+        """
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name in values]
+                }]
+            },
+            'Service': self.service,
+            **values
+        }
+        try:
+            self.sink(record)
+        except Exception as e:
+            print(f"Error emitting metrics {', '.join(values)}: {str(e)}")
+
+    def emit(self, case_id, step, duration, counters, failed=False):
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service', 'Stage']],
+                    'Metrics': STAGE_METRICS
+                }]
+            },
+            'Service': self.service,
+            'Stage': step.split(':')[0],
+            'Step': step,
+            'CaseID': str(case_id),
+            'Failed': failed,
+            'Duration': round(duration, 3),
+            **counters
+        }
+        try:
+            self.sink(record)
+        except Exception as e:
+            print(f"Error emitting stage metrics for case_id {case_id}: {str(e)}")
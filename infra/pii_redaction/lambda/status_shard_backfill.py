@@ -0,0 +1,82 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Parallel scan segments of the inventory table, each scanned by its own thread
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '4'))
+
+
+def status_shard(body_status: str, case_id: int, shards: int) -> str:
+    """
+    Returns the StatusShard of an inventory item, derived from its case ID as the email processing Lambda does.
+    """
+    return f"{body_status}#{int(case_id) % shards}"
+
+
+def backfill_segment(table, shards: int, segment: int, segments: int) -> int:
+    """
+    Sets the StatusShard of the items of one scan segment that have a BodyStatus but no StatusShard, returns the number updated.
+    """
+    updated = 0
+    kwargs = {
+        'Segment': segment,
+        'TotalSegments': segments,
+        'FilterExpression': "attribute_exists(BodyStatus) AND attribute_not_exists(StatusShard)",
+        'ProjectionExpression': "CaseID, BodyStatus"
+    }
+    while True:
+        response = table.scan(**kwargs)
+        for item in response['Items']:
+            try:
+                # A message whose status changed since it was scanned already got its StatusShard with that change
+                table.update_item(
+                    Key={'CaseID': item['CaseID']},
+                    UpdateExpression="SET StatusShard = :shard",
+                    ConditionExpression="attribute_not_exists(StatusShard) AND BodyStatus = :status",
+                    ExpressionAttributeValues={
+                        ':shard': status_shard(item['BodyStatus'], item['CaseID'], shards),
+                        ':status': item['BodyStatus']
+                    }
+                )
+                updated += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def backfill(table, shards: int, segments: int = SCAN_SEGMENTS) -> int:
+    """
+    Sets the StatusShard of the inventory items written before the EmailIndexStatusTime index existed,
+    so the messages are listed again. Returns the number of items updated.
+    """
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return sum(executor.map(lambda segment: backfill_segment(table, shards, segment, segments), range(segments)))
+
+
+def handler(event, context):
+    """
+    Custom resource handler running the backfill when the portal stack is deployed.
+    """
+    if event['RequestType'] == 'Delete':
+        return {'PhysicalResourceId': event.get('PhysicalResourceId', 'StatusShardBackfill')}
+    table = boto3.resource('dynamodb').Table(os.environ['MESSAGES_TABLE_NAME'])
+    updated = backfill(table, int(os.environ['STATUS_SHARDS']))
+    print(f"Backfilled the StatusShard of {updated} messages")
+    return {'PhysicalResourceId': 'StatusShardBackfill', 'Data': {'Updated': updated}}
+
+
+if __name__ == '__main__':
+    # Tables too large to be backfilled within the Lambda timeout are backfilled from a workstation:
+    # python status_shard_backfill.py --table <EmailInventoryTableName> --shards 8
+    parser = argparse.ArgumentParser(description="Backfill the StatusShard of the email inventory items")
+    parser.add_argument('--table', required=True)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--segments', type=int, default=SCAN_SEGMENTS)
+    args = parser.parse_args()
+    print(f"Backfilled the StatusShard of {backfill(boto3.resource('dynamodb').Table(args.table), args.shards, args.segments)} messages")
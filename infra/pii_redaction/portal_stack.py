@@ -6,6 +6,7 @@ from typing import cast
 from aws_cdk import (
     Aws,
     CfnOutput,
+    CustomResource,
     Duration,
     Fn,
     RemovalPolicy,
@@ -41,6 +42,7 @@ class PortalStack(Stack):
         # Import values from other stacks
         email_table_name = Fn.import_value("EmailInventoryTableName")
         email_table_arn = Fn.import_value("EmailInventoryTableArn")
+        email_table_status_shards = Fn.import_value("EmailInventoryStatusShards")
         raw_bucket = Fn.import_value("RawBucket")
         redacted_bucket_name = Fn.import_value("RedactedBucket")
         security_group_id = Fn.import_value("SecurityGroupID")
@@ -85,6 +87,17 @@ class PortalStack(Stack):
                     point_in_time_recovery_enabled=True)
         )
 
+        # Create new DynamoDB table for the status of message export jobs, expired along with their export files
+        export_jobs_tbl = dynamodb.TableV2(self, 'ExportJobsTable',
+            table_name=stackPrefix(resource_prefix, "ExportJobsTable"),
+            table_class=dynamodb.TableClass.STANDARD,
+            partition_key=dynamodb.Attribute(name='JobID', type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute='ExpirationTime',
+            removal_policy=RemovalPolicy.DESTROY,
+            point_in_time_recovery_specification=dynamodb.PointInTimeRecoverySpecification(
+                    point_in_time_recovery_enabled=True)
+        )
+
         # Initialize folders table with default folder
         cr.AwsCustomResource(self, "InitFoldersTable",
             on_create=cr.AwsSdkCall(
@@ -130,6 +143,69 @@ class PortalStack(Stack):
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_12]
         )
 
+        portal_environment = {
+            'MESSAGES_TABLE_NAME': email_table_name,
+            'STATUS_SHARDS': email_table_status_shards,
+            'FOLDERS_TABLE_NAME': folders_tbl.table_name,
+            'EXPORT_JOBS_TABLE_NAME': export_jobs_tbl.table_name,
+            'EXPORT_BUCKET_NAME': redacted_bucket_name,
+            'ENVIRONMENT': environment
+        }
+
+        # Lambda function that runs the message exports requested from the portal, outside the API Gateway timeout
+        portal_export_handler = lambda_.Function(self, 'PortalExportHandler',
+            function_name=stackPrefix(resource_prefix, "PortalExportHandler"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            code=lambda_.Code.from_asset(os.path.join(os.path.dirname(__file__), 'lambda')),
+            handler='portal_api.export_handler',
+            environment=portal_environment,
+            layers=[powertools_layer, packages_layer],
+            memory_size=1024,
+            timeout=Duration.minutes(15),
+            retry_attempts=0,
+            logging_format=lambda_.LoggingFormat.TEXT,
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+            security_groups=[security_group],
+            log_group=logs.LogGroup(self, 'PortalExportHandlerLogGroup',
+                log_group_name=stackPrefix(resource_prefix, "PortalExportHandlerLogGroup"),
+                removal_policy=RemovalPolicy.DESTROY
+            ),
+            tracing=lambda_.Tracing.ACTIVE
+        )
+
+        # Lambda function setting the StatusShard of messages written before the EmailIndexStatusTime index existed,
+        # run on every deployment before the portal API lists messages from that index
+        status_shard_backfill = lambda_.Function(self, 'StatusShardBackfill',
+            function_name=stackPrefix(resource_prefix, "StatusShardBackfill"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            code=lambda_.Code.from_asset(os.path.join(os.path.dirname(__file__), 'lambda')),
+            handler='status_shard_backfill.handler',
+            environment={
+                'MESSAGES_TABLE_NAME': email_table_name,
+                'STATUS_SHARDS': email_table_status_shards
+            },
+            memory_size=512,
+            timeout=Duration.minutes(15),
+            logging_format=lambda_.LoggingFormat.TEXT,
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+            security_groups=[security_group],
+            log_group=logs.LogGroup(self, 'StatusShardBackfillLogGroup',
+                log_group_name=stackPrefix(resource_prefix, "StatusShardBackfillLogGroup"),
+                removal_policy=RemovalPolicy.DESTROY
+            )
+        )
+        messages_tbl.grant_read_write_data(status_shard_backfill)
+        status_shard_backfill_provider = cr.Provider(self, 'StatusShardBackfillProvider',
+            on_event_handler=status_shard_backfill,
+            log_retention=logs.RetentionDays.ONE_WEEK
+        )
+        status_shard_backfill_resource = CustomResource(self, 'StatusShardBackfillResource',
+            service_token=status_shard_backfill_provider.service_token,
+            properties={'StatusShards': email_table_status_shards}
+        )
+
         # Lambda function that handles all API requests initiated from the portal
         portal_lambda_handler = lambda_.Function(self, 'PortalLambdaHandler',
             function_name=stackPrefix(resource_prefix, "PortalLambdaHandler"),
@@ -137,9 +213,8 @@ class PortalStack(Stack):
             code=lambda_.Code.from_asset(os.path.join(os.path.dirname(__file__), 'lambda')),
             handler='portal_api.handler',
             environment={
-                'MESSAGES_TABLE_NAME': email_table_name,
-                'FOLDERS_TABLE_NAME': folders_tbl.table_name,
-                'ENVIRONMENT': environment
+                **portal_environment,
+                'EXPORT_FUNCTION_NAME': portal_export_handler.function_name
             },
             layers=[powertools_layer, packages_layer],
             memory_size=512,
@@ -154,6 +229,8 @@ class PortalStack(Stack):
             ),
             tracing=lambda_.Tracing.ACTIVE
         )
+        # Messages without a StatusShard would be missing from the listings until the backfill ran
+        portal_lambda_handler.node.add_dependency(status_shard_backfill_resource)
 
         # Create a email forwarding Lambda function
         if auto_reply_from_email != "":
@@ -277,6 +354,17 @@ class PortalStack(Stack):
         messages_tbl.grant_read_write_data(portal_api_handler_role)
         folders_tbl.grant_read_write_data(portal_api_handler_role)
 
+        # The API records export jobs, stores their requests and starts the export function, which writes the export files
+        export_jobs_tbl.grant_read_write_data(portal_api_handler_role)
+        redacted_bucket.grant_put(portal_api_handler_role, 'exports/*')
+        portal_export_handler.grant_invoke(portal_api_handler_role)
+
+        portal_export_handler_role = portal_export_handler.role
+        messages_tbl.grant_read_data(portal_export_handler_role)
+        export_jobs_tbl.grant_read_write_data(portal_export_handler_role)
+        redacted_bucket.grant_read(portal_export_handler_role)
+        redacted_bucket.grant_put(portal_export_handler_role, 'exports/*')
+
         api_gw_s3_role = iam.Role(self, 'ApiGwS3Role',
             role_name=stackPrefix(resource_prefix, "ApiGwS3Role"),
             assumed_by=iam.ServicePrincipal('apigateway.amazonaws.com'),
@@ -441,23 +529,24 @@ class PortalStack(Stack):
         )
         messages = apiResources.add_resource('messages')
         messages.add_method('GET',  operation_name='getMessages')
-        messages.add_resource('export', default_method_options=apigateway.MethodOptions(
+        export = messages.add_resource('export', default_method_options=apigateway.MethodOptions(
             request_parameters={
                 'method.request.header.Accept': True,
                 'method.request.header.Content-Type': True,
             },
-        )).add_method('POST', operation_name='exportMessages', method_responses=[apigateway.MethodResponse(
-            status_code='200',
+        ))
+        export.add_method('POST', operation_name='exportMessages', method_responses=[apigateway.MethodResponse(
+            status_code='202',
             response_models={
                 'application/json': apigateway.Model.EMPTY_MODEL,
-                'text/csv': apigateway.Model.EMPTY_MODEL,
-                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': apigateway.Model.EMPTY_MODEL,
-            },
-            response_parameters={
-                'method.response.header.Content-Disposition': True,
-                'method.response.header.Content-Type': True,
             }
         )])
+        export.add_resource('{job_id}', default_method_options=apigateway.MethodOptions(
+                request_parameters={
+                    'method.request.path.job_id': True
+                }
+            )
+        ).add_method('GET', operation_name='getExportJob')
 
         singleMessage = messages.add_resource('{identifier}', default_method_options=apigateway.MethodOptions(
                 request_parameters={
@@ -9,6 +9,7 @@ from aws_cdk import (
     aws_dynamodb as dynamodb,
     aws_iam as iam,
     aws_ec2 as ec2,
+    aws_secretsmanager as secretsmanager,
 )
 import aws_cdk as cdk
 from cdk_nag import NagSuppressions
@@ -114,6 +115,11 @@ class S3Stack(Stack):
                 s3.LifecycleRule(
                     enabled=True,
                     expiration=Duration.days(retention)
+                ),
+                # Attachments are saved with multipart uploads too, parts left by a failed upload are removed after a day
+                s3.LifecycleRule(
+                    enabled=True,
+                    abort_incomplete_multipart_upload_after=Duration.days(1)
                 )
             ],
             enforce_ssl=True,
@@ -131,6 +137,11 @@ class S3Stack(Stack):
                 s3.LifecycleRule(
                     enabled=True,
                     expiration=Duration.days(retention)
+                ),
+                # Parts of multipart uploads that were neither completed nor aborted are removed after a day
+                s3.LifecycleRule(
+                    enabled=True,
+                    abort_incomplete_multipart_upload_after=Duration.days(1)
                 )
             ],
             enforce_ssl=True,
@@ -155,10 +166,17 @@ class S3Stack(Stack):
                     point_in_time_recovery_enabled=True)
         )
 
+        # Each status is spread over status_shards partitions of the index, so processed emails do not all land in one hot partition,
+        # and sorted by receive time so the newest messages are listed by merging the shards
+        status_shards = 8
         email_dynamodb_table.add_global_secondary_index(
-            index_name="EmailIndexBodyStatus",
+            index_name="EmailIndexStatusTime",
             partition_key=dynamodb.Attribute(
-                name="BodyStatus",
+                name="StatusShard",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="EmailReceiveTime",
                 type=dynamodb.AttributeType.STRING
             ),
             projection_type=dynamodb.ProjectionType.ALL
@@ -173,6 +191,57 @@ class S3Stack(Stack):
             projection_type=dynamodb.ProjectionType.ALL
         )
 
+        # Create a DynamoDB table caching Guardrail redaction results, shared by all email processing Lambda containers
+        redaction_cache_table = dynamodb.Table(
+            self, 
+            stackPrefix(resource_prefix,"RedactionCacheTable"),
+            partition_key=dynamodb.Attribute(
+                name="TextHash",
+                type=dynamodb.AttributeType.STRING
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+            time_to_live_attribute="ExpirationTime",  # Cached entries expire with the retention period
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Secret key of the HMAC hashing the texts cached in the redaction cache table
+        redaction_cache_key = secretsmanager.Secret(
+            self,
+            stackPrefix(resource_prefix,"RedactionCacheKey"),
+            description="Key of the HMAC hashing the texts cached in the redaction cache table",
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                password_length=64,
+                exclude_punctuation=True
+            ),
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
+        # Create a DynamoDB table recording the raw emails already ingested, keyed by bucket, object key and ETag
+        ingestion_table = dynamodb.Table(
+            self, 
+            stackPrefix(resource_prefix,"IngestionTable"),
+            partition_key=dynamodb.Attribute(
+                name="IngestionKey",
+                type=dynamodb.AttributeType.STRING
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+            time_to_live_attribute="ExpirationTime",  # Ingestion records expire with the retention period
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Create a DynamoDB table tracking the BDA jobs of attachments until their completion event is handled
+        attachment_jobs_table = dynamodb.Table(
+            self, 
+            stackPrefix(resource_prefix,"AttachmentJobsTable"),
+            partition_key=dynamodb.Attribute(
+                name="JobID",
+                type=dynamodb.AttributeType.STRING
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+            time_to_live_attribute="ExpirationTime",  # Job records expire with the retention period
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
         # Create an IAM role for the Lambda function
         lambda_role = iam.Role(
             self, 
@@ -187,7 +256,7 @@ class S3Stack(Stack):
         # Add inline policies for S3 PutObject, ListBucket, and Comprehend DetectPiiEntities/RedactPiiEntities
         lambda_role.add_to_policy(
             iam.PolicyStatement(
-                actions=["s3:GetObject","s3:PutObject", "s3:ListBucket","s3:PutBucketNotification"],
+                actions=["s3:GetObject","s3:PutObject", "s3:AbortMultipartUpload", "s3:ListBucket","s3:PutBucketNotification"],
                 resources=[
                     f"arn:aws:s3:::{raw_bucket.bucket_name}",
                     f"arn:aws:s3:::{raw_bucket.bucket_name}/*",
@@ -228,6 +297,34 @@ class S3Stack(Stack):
                 effect=iam.Effect.ALLOW
             )
         )
+        lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["dynamodb:BatchGetItem","dynamodb:BatchWriteItem"],
+                resources=[redaction_cache_table.table_arn],
+                effect=iam.Effect.ALLOW
+            )
+        )
+        lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["secretsmanager:GetSecretValue"],
+                resources=[redaction_cache_key.secret_arn],
+                effect=iam.Effect.ALLOW
+            )
+        )
+        lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["dynamodb:UpdateItem","dynamodb:GetItem"],
+                resources=[ingestion_table.table_arn],
+                effect=iam.Effect.ALLOW
+            )
+        )
+        lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["dynamodb:PutItem","dynamodb:UpdateItem","dynamodb:GetItem","dynamodb:Scan"],
+                resources=[attachment_jobs_table.table_arn],
+                effect=iam.Effect.ALLOW
+            )
+        )
 
         # Create an IAM role for the SES
         ses_role = iam.Role(
@@ -591,6 +688,11 @@ class S3Stack(Stack):
         self.redacted_bucket_name_output = CfnOutput(self, "RedactedBucketNameOutput", value=redacted_bucket.bucket_name, export_name="RedactedBucket")
         self.inventory_table_name_output = CfnOutput(self, "EmailInventoryTableNameOutput", value=email_dynamodb_table.table_name, export_name="EmailInventoryTableName")
         self.inventory_table_arn_output = CfnOutput(self, "EmailInventoryTableARNOutput", value=email_dynamodb_table.table_arn, export_name="EmailInventoryTableArn")
+        self.inventory_status_shards_output = CfnOutput(self, "EmailInventoryStatusShardsOutput", value=str(status_shards), export_name="EmailInventoryStatusShards")
+        self.redaction_cache_table_name_output = CfnOutput(self, "RedactionCacheTableNameOutput", value=redaction_cache_table.table_name, export_name="RedactionCacheTableName")
+        self.redaction_cache_key_secret_arn_output = CfnOutput(self, "RedactionCacheKeySecretArnOutput", value=redaction_cache_key.secret_arn, export_name="RedactionCacheKeySecretArn")
+        self.ingestion_table_name_output = CfnOutput(self, "IngestionTableNameOutput", value=ingestion_table.table_name, export_name="IngestionTableName")
+        self.attachment_jobs_table_name_output = CfnOutput(self, "AttachmentJobsTableNameOutput", value=attachment_jobs_table.table_name, export_name="AttachmentJobsTableName")
         self.lambda_role_output = CfnOutput(self, "LambdaRoleOutput", value=lambda_role.role_arn, export_name="LambdaRole")
         self.ses_role_output = CfnOutput(self, "SESRoleOutput", value=ses_role.role_arn, export_name="SESRole")
         self.vpc_id_output = CfnOutput(self, "VPCIDOutput", value=vpc_id, export_name="VPCID")
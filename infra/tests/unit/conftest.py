@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+from email.message import EmailMessage
+
+import boto3
+import pytest
+from moto import mock_aws
+
+LAMBDA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'pii_redaction', 'lambda'))
+
+# The Lambda handlers import their sibling modules by name, as they do from the root of their deployment package,
+# and the modules of the shared layer as they do from /opt/python
+for path in ('shared/python', 'attachmentProcessing', 'emailProcessing', ''):
+    sys.path.insert(0, os.path.join(LAMBDA_DIR, path))
+
+# Settings read by the Lambda modules at import time, the AWS services they use are mocked with moto in each test
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'REDACTED_BUCKET_NAME': 'redacted-bucket',
+    'INVENTORY_TABLE_NAME': 'inventory',
+    'SUCCESS_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:success',
+    'FAILURE_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:failure',
+    'CRM_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:crm',
+    'RETENTION': '90',
+    'GUARDRAIL_ID': 'guardrail',
+    'GUARDRAIL_VERSION': '1',
+    'PROJECT_NAME': 'project',
+    'ATTACHMENT_JOBS_TABLE_NAME': 'attachment-jobs',
+    'MESSAGES_TABLE_NAME': 'inventory',
+    'FOLDERS_TABLE_NAME': 'folders',
+    'ENVIRONMENT': 'test',
+})
+
+RAW_BUCKET = 'raw-bucket'
+
+
+class FakeGuardrail:
+    """
+    Bedrock runtime client anonymizing the name John, recording the characters it was sent.
+    """
+
+    def __init__(self):
+        self.input_chars = 0
+        self.output_chars = 0
+
+    def apply_guardrail(self, content, **kwargs):
+        texts = [block['text']['text'] for block in content]
+        self.input_chars += sum(len(text) for text in texts)
+        if not any('John' in text for text in texts):
+            self.output_chars += sum(len(text) for text in texts)
+            return {'action': 'NONE', 'outputs': []}
+        outputs = [{'text': text.replace('John', '{NAME}')} for text in texts]
+        self.output_chars += sum(len(output['text']) for output in outputs)
+        return {'action': 'GUARDRAIL_INTERVENED', 'outputs': outputs}
+
+
+@pytest.fixture
+def aws():
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def inventory_table(aws):
+    """
+    The email inventory table with the indexes of the S3 stack.
+    """
+    return boto3.resource('dynamodb').create_table(
+        TableName=os.environ['INVENTORY_TABLE_NAME'],
+        KeySchema=[{'AttributeName': 'CaseID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'CaseID', 'AttributeType': 'N'},
+            {'AttributeName': 'StatusShard', 'AttributeType': 'S'},
+            {'AttributeName': 'EmailReceiveTime', 'AttributeType': 'S'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'EmailIndexStatusTime',
+                'KeySchema': [
+                    {'AttributeName': 'StatusShard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'EmailReceiveTime', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+@pytest.fixture
+def portal_request(aws):
+    """
+    Returns a function sending a REST API Gateway event to the portal API handler and returning the status code and decoded body.
+    """
+    import portal_api
+
+    def request(path, method='GET', query=None, body=None):
+        event = {
+            'resource': path,
+            'path': path,
+            'httpMethod': method,
+            'headers': {},
+            'multiValueHeaders': {},
+            'queryStringParameters': query,
+            'multiValueQueryStringParameters': {name: [value] for name, value in query.items()} if query else None,
+            'pathParameters': None,
+            'requestContext': {'requestId': 'request', 'stage': 'portal', 'resourcePath': path, 'httpMethod': method, 'path': path},
+            'body': json.dumps(body) if body is not None else None,
+            'isBase64Encoded': False
+        }
+        response = portal_api.handler(event, None)
+        return response['statusCode'], json.loads(response['body']) if response.get('body') else None
+
+    return request
+
+
+@pytest.fixture
+def ingestion(inventory_table, monkeypatch):
+    """
+    The email processing Lambda module with its buckets and topics, a fake Guardrail, an in-memory metrics sink
+    (as ingestion.sink) and a fresh case ID lease. The ingestion ledger is disabled.
+    """
+    import emailExtractRedact
+    from redaction_cache import RedactionCache
+    from stage_metrics import LocalSink, StageMetrics
+    s3 = boto3.client('s3')
+    for bucket in (RAW_BUCKET, os.environ['REDACTED_BUCKET_NAME']):
+        s3.create_bucket(Bucket=bucket)
+    sns = boto3.client('sns')
+    for name in ('success', 'failure', 'crm'):
+        sns.create_topic(Name=name)
+    sink = LocalSink()
+    monkeypatch.setattr(emailExtractRedact, 'stage_metrics', StageMetrics('PiiRedaction', 'EmailProcessing', sink))
+    monkeypatch.setattr(emailExtractRedact, 'redaction_cache', RedactionCache('guardrail', '1'))
+    monkeypatch.setattr(emailExtractRedact, 'bedrock_runtime', FakeGuardrail())
+    monkeypatch.setattr(emailExtractRedact, 'ingestion_ledger', None)
+    monkeypatch.setattr(emailExtractRedact, 'case_id_lease', {'next': 1, 'last': 0})
+    monkeypatch.setattr(emailExtractRedact, 'sink', sink, raising=False)
+    return emailExtractRedact
+
+
+@pytest.fixture
+def raw_email(ingestion):
+    """
+    Returns a function uploading an email with the given body to the raw bucket and returning its bucket and key.
+    """
+    def upload(key, body):
+        message = EmailMessage()
+        message['From'] = 'sender@example.com'
+        message['To'] = 'inbox@example.com'
+        message['Subject'] = 'Claim from John'
+        message.set_content(body)
+        message.add_alternative(f'<p>{body}</p>', subtype='html')
+        boto3.client('s3').put_object(Bucket=RAW_BUCKET, Key=key, Body=message.as_bytes())
+        return RAW_BUCKET, key
+
+    return upload
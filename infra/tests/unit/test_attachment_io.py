@@ -0,0 +1,20 @@
+import io
+import os
+import tempfile
+
+import fitz
+
+from attachment_io import save_pdf
+
+
+def test_pdf_is_saved_into_a_buffer_through_a_removed_temp_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    pdf_document = fitz.open()
+    for page_num in range(3):
+        pdf_document.new_page().insert_text((36, 36), f"Page {page_num} of the claim filed by John Smith")
+    buffer = io.BytesIO()
+    save_pdf(pdf_document, buffer)
+
+    saved = fitz.open(stream=buffer.getvalue(), filetype='pdf')
+    assert [page.get_text().strip() for page in saved] == [f"Page {page_num} of the claim filed by John Smith" for page_num in range(3)]
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,157 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import boto3
+import pytest
+
+from bda_jobs import IN_PROGRESS, REDACTED
+from bda_poller import poll_jobs
+from stage_metrics import LocalSink, StageMetrics
+
+INVOCATION_ARN = 'arn:aws:bedrock:us-east-1:123456789012:data-automation-invocation/job-1'
+
+
+@pytest.fixture
+def attachments(inventory_table, monkeypatch):
+    """
+    The attachment processing module with its job table and one submitted job of case 7, redaction and finalization recorded instead of run.
+    """
+    import attachmentProcessing
+    boto3.resource('dynamodb').create_table(
+        TableName=os.environ['ATTACHMENT_JOBS_TABLE_NAME'],
+        KeySchema=[{'AttributeName': 'JobID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'JobID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    inventory_table.put_item(Item={'CaseID': 7, 'Attachments': {'claim.pdf': {'RedactionStatus': 'Pending'}}})
+    attachmentProcessing.job_store.save_job(
+        INVOCATION_ARN,
+        7,
+        BucketName='raw-bucket',
+        AttachmentKey='domain_emails/2026-10-17/7/attachments/claim.pdf',
+        OutputKey='redacted/2026-10-17/7/attachments/claim.pdf',
+        FileType='pdf',
+        Size=100
+    )
+    attachmentProcessing.job_store.add_pending(7, 1)
+    recorded = SimpleNamespace(module=attachmentProcessing, job_store=attachmentProcessing.job_store, redactions=[], finalized=[])
+    monkeypatch.setattr(attachmentProcessing, 'stage_metrics', StageMetrics('PiiRedaction', 'AttachmentProcessing', LocalSink()))
+    monkeypatch.setattr(attachmentProcessing, 'redact_attachment', lambda job: recorded.redactions.append(job['JobID']) or 10)
+    monkeypatch.setattr(attachmentProcessing, 'finalize_case', lambda case_id, failed_jobs: recorded.finalized.append((case_id, failed_jobs)))
+    return recorded
+
+
+def test_poller_and_event_redact_a_job_once(attachments, monkeypatch):
+    redacting = threading.Event()
+    release = threading.Event()
+
+    def slow_redaction(job):
+        redacting.set()
+        release.wait(5)
+        attachments.redactions.append(job['JobID'])
+        return 10
+
+    monkeypatch.setattr(attachments.module, 'redact_attachment', slow_redaction)
+    poller = threading.Thread(target=attachments.module.handle_bda_completion, args=({'detail': {'job_id': 'job-1'}}, 'Success'))
+    poller.start()
+    assert redacting.wait(5)
+
+    # The EventBridge event of the same job arrives while the poller redacts its attachment
+    assert attachments.module.handle_bda_completion({'detail': {'job_id': 'job-1'}}, 'Success') is False
+    release.set()
+    poller.join()
+    assert attachments.module.handle_bda_completion({'detail': {'job_id': 'job-1'}}, 'Success') is True
+
+    assert attachments.redactions == ['job-1']
+    assert attachments.finalized == [('7', 0)]
+    assert attachments.job_store.get_job('job-1')['JobStatus'] == REDACTED
+
+
+def test_claim_of_a_timed_out_invocation_is_taken_over(attachments, monkeypatch):
+    assert attachments.job_store.claim_job('job-1')
+    assert not attachments.job_store.claim_job('job-1')
+    assert attachments.module.handle_bda_completion({'detail': {'job_id': 'job-1'}}, 'Success') is False
+
+    monkeypatch.setattr(attachments.job_store, 'claim_timeout', -1)
+    assert attachments.module.handle_bda_completion({'detail': {'job_id': 'job-1'}}, 'Success') is True
+
+    assert attachments.redactions == ['job-1']
+    assert attachments.finalized == [('7', 0)]
+
+
+def test_completed_job_cannot_be_claimed(attachments):
+    assert attachments.module.handle_bda_completion({'detail': {'job_id': 'job-1'}}, 'Success') is True
+
+    assert not attachments.job_store.claim_job('job-1')
+    assert attachments.job_store.get_job('job-1')['JobStatus'] not in ('Submitted', IN_PROGRESS)
+
+
+def test_event_of_a_job_not_stored_yet_is_retried(attachments):
+    published = datetime.now(timezone.utc)
+    event = {'time': published.strftime('%Y-%m-%dT%H:%M:%SZ'), 'detail': {'job_id': 'job-2'}}
+    assert attachments.module.handle_bda_completion(event, 'Success') is False
+
+    event['time'] = (published - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    assert attachments.module.handle_bda_completion(event, 'Success') is True
+    assert attachments.redactions == []
+
+
+def test_failed_case_is_not_finalized_again_by_its_jobs(attachments):
+    assert attachments.job_store.fail_case(7)
+    assert not attachments.job_store.fail_case(7)
+
+    assert attachments.module.handle_bda_completion({'detail': {'job_id': 'job-1'}}, 'Success') is True
+    assert attachments.redactions == ['job-1']
+    assert attachments.finalized == []
+
+
+def test_sweeper_resumes_pending_jobs_and_cases(attachments, monkeypatch):
+    monkeypatch.setattr(attachments.module, 'bda_client', SimpleNamespace(get_data_automation_status=lambda invocationArn: {'status': 'Success'}))
+    attachments.module.sweep_handler({}, None)
+    assert attachments.redactions == []
+
+    monkeypatch.setattr(attachments.module, 'bda_sweep_after', -1)
+    attachments.job_store.add_pending(8, 0)
+    attachments.module.sweep_handler({}, None)
+
+    assert attachments.redactions == ['job-1']
+    assert sorted(attachments.finalized) == [('7', 0), ('8', 0)]
+
+
+def test_unsupported_attachment_settles_its_manifest_entries(attachments, inventory_table, monkeypatch):
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='raw-bucket')
+    for file_name in ('a.pdf', 'b.docx', 'c.png'):
+        s3.put_object(Bucket='raw-bucket', Key=f'domain_emails/2026-10-17/9/attachments/{file_name}', Body=b'attachment')
+    inventory_table.put_item(Item={'CaseID': 9, 'Attachments': {
+        file_name: {'RedactionStatus': 'Pending'} for file_name in ('a.pdf', 'b.docx', 'c.png')
+    }})
+    monkeypatch.setattr(attachments.module, 'submit_bda_job', lambda bucket_name, key, profile_arn: INVOCATION_ARN.replace('job-1', 'job-9'))
+
+    submitted = attachments.module.process_success_message(
+        {'case_id': '9', 'bucket_name': 'raw-bucket', 'base_path': 'domain_emails/2026-10-17/9'}, 'profile'
+    )
+
+    assert submitted == [INVOCATION_ARN.replace('job-1', 'job-9')]
+    manifest = inventory_table.get_item(Key={'CaseID': 9})['Item']['Attachments']
+    assert {name: entry['RedactionStatus'] for name, entry in manifest.items()} == {
+        'a.pdf': 'Pending', 'b.docx': 'Unsupported', 'c.png': 'Skipped'
+    }
+
+
+def test_poller_retries_failed_status_requests():
+    responses = iter([RuntimeError('Rate exceeded'), 'InProgress', 'Success'])
+
+    def get_status(arn):
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    completed = []
+    statuses = poll_jobs(get_status, ['job-1'], lambda arn, status: completed.append((arn, status)), initial_delay=0.01, max_delay=0.01)
+
+    assert statuses == {'job-1': 'Success'}
+    assert completed == [('job-1', 'Success')]
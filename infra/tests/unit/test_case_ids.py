@@ -0,0 +1,36 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AtomicUpdates:
+    """
+    Table applying one update at a time. DynamoDB applies each update of an item atomically, moto reads and writes the item without a lock.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.lock = threading.Lock()
+
+    def update_item(self, **kwargs):
+        with self.lock:
+            return self.table.update_item(**kwargs)
+
+
+def test_case_ids_are_unique_under_parallel_allocation(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion, 'case_id_block_size', 7)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        case_ids = list(executor.map(lambda _: ingestion.generate_case_id(), range(500)))
+
+    assert len(set(case_ids)) == 500
+    assert min(int(case_id) for case_id in case_ids) > ingestion.CASE_ID_START
+
+
+def test_leased_blocks_do_not_overlap_across_containers(ingestion, inventory_table, monkeypatch):
+    monkeypatch.setattr(ingestion, 'table', AtomicUpdates(inventory_table))
+    # Each lease stands for a block taken by another Lambda container, sharing only the counter item
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        blocks = list(executor.map(ingestion.lease_case_id_block, [1, 5, 10, 50] * 25))
+
+    leased = [value for first, last in blocks for value in range(first, last + 1)]
+    assert len(leased) == len(set(leased)) == sum([1, 5, 10, 50] * 25)
@@ -0,0 +1,86 @@
+import pytest
+
+from redaction_cache import RedactionCache
+from stage_metrics import LocalSink, StageMetrics
+
+ENTITIES = {'John': '{NAME}', '555-0100': '{PHONE}'}
+
+
+class StubGuardrail:
+    """
+    Bedrock runtime client anonymizing the names and phone numbers of ENTITIES, recording the text blocks of every request.
+    With merge_outputs it returns a single output for a multi block request, as the Guardrail may do.
+    """
+
+    def __init__(self, merge_outputs=False):
+        self.requests = []
+        self.merge_outputs = merge_outputs
+
+    def apply_guardrail(self, content, **kwargs):
+        texts = [block['text']['text'] for block in content]
+        self.requests.append(texts)
+        redacted = []
+        for text in texts:
+            for entity, placeholder in ENTITIES.items():
+                text = text.replace(entity, placeholder)
+            redacted.append(text)
+        if redacted == texts:
+            return {'action': 'NONE', 'outputs': []}
+        if self.merge_outputs and len(redacted) > 1:
+            return {'action': 'GUARDRAIL_INTERVENED', 'outputs': [{'text': ''.join(redacted)}]}
+        return {'action': 'GUARDRAIL_INTERVENED', 'outputs': [{'text': text} for text in redacted]}
+
+
+@pytest.fixture
+def guardrail(aws, monkeypatch):
+    import emailExtractRedact
+    monkeypatch.setattr(emailExtractRedact, 'stage_metrics', StageMetrics('PiiRedaction', 'EmailProcessing', LocalSink()))
+    monkeypatch.setattr(emailExtractRedact, 'redaction_cache', RedactionCache('guardrail', '1'))
+    monkeypatch.setattr(emailExtractRedact, 'bedrock_runtime', StubGuardrail())
+    return emailExtractRedact
+
+
+def test_subject_and_body_are_redacted_in_one_request(guardrail):
+    fields = {'subject': 'Claim from John', 'text': 'Hello,\n\nplease call me on 555-0100.\n\nRegards'}
+
+    redacted = guardrail.redact_pii_fields(fields)
+
+    assert redacted == {'subject': 'Claim from {NAME}', 'text': 'Hello,\n\nplease call me on {PHONE}.\n\nRegards'}
+    assert guardrail.bedrock_runtime.requests == [['Claim from John', fields['text']]]
+
+
+@pytest.mark.parametrize('subject', ['', '  '])
+def test_empty_subject_is_not_sent(guardrail, subject):
+    redacted = guardrail.redact_pii_fields({'subject': subject, 'text': 'Call John on 555-0100'})
+
+    assert redacted == {'subject': subject, 'text': 'Call {NAME} on {PHONE}'}
+    assert guardrail.bedrock_runtime.requests == [['Call John on 555-0100']]
+
+
+def test_empty_body_keeps_the_subject_output(guardrail):
+    redacted = guardrail.redact_pii_fields({'subject': 'Claim from John', 'text': ''})
+
+    assert redacted == {'subject': 'Claim from {NAME}', 'text': ''}
+    assert guardrail.bedrock_runtime.requests == [['Claim from John']]
+
+
+def test_outputs_are_mapped_back_when_the_body_is_chunked(guardrail, monkeypatch):
+    monkeypatch.setattr(guardrail, 'guardrail_chunk_chars', 200)
+    monkeypatch.setattr(guardrail, 'guardrail_chunk_overlap', 20)
+    body = ' '.join(f'Line {index} from John on 555-0100.' for index in range(40))
+
+    redacted = guardrail.redact_pii_fields({'subject': 'Claim from John', 'text': body})
+
+    assert redacted == {'subject': 'Claim from {NAME}', 'text': body.replace('John', '{NAME}').replace('555-0100', '{PHONE}')}
+    blocks = [text for request in guardrail.bedrock_runtime.requests for text in request]
+    assert 'Claim from John' in blocks and len(guardrail.bedrock_runtime.requests) > 1
+    assert all(sum(len(text) for text in request) <= 200 for request in guardrail.bedrock_runtime.requests)
+
+
+def test_merged_outputs_are_redacted_per_block(guardrail, monkeypatch):
+    monkeypatch.setattr(guardrail, 'bedrock_runtime', StubGuardrail(merge_outputs=True))
+
+    redacted = guardrail.redact_pii_fields({'subject': 'Claim from John', 'text': 'Call me on 555-0100'})
+
+    assert redacted == {'subject': 'Claim from {NAME}', 'text': 'Call me on {PHONE}'}
+    assert guardrail.bedrock_runtime.requests == [['Claim from John', 'Call me on 555-0100'], ['Claim from John'], ['Call me on 555-0100']]
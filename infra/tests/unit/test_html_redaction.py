@@ -0,0 +1,126 @@
+import random
+import time
+
+import pytest
+
+import html_redaction
+from html_redaction import HtmlDocument, align_redacted_text
+from text_chunks import apply_spans_to_text
+
+PARSERS = ['lxml', 'html.parser']
+
+DOCUMENTS = [
+    '<p>Call <b>John Smith</b> now</p>',
+    '<style>p { color: red; }</style><p>John Smith</p>',
+    '<meta charset="utf-8"><div>John Smith</div>\n<div>Seattle</div>',
+    '<!-- signature --><p>John Smith &amp; partners</p>',
+    '<!DOCTYPE html><p>John Smith</p>',
+    '<body><p>John Smith</p></body>',
+    '<!DOCTYPE html><html><head><title>Invoice</title></head><body><p>John Smith</p></body></html>',
+    'John Smith',
+]
+
+
+def redact(document):
+    return document.apply_redacted_text(document.text.replace('John Smith', '{NAME}'))
+
+
+@pytest.mark.parametrize('html', DOCUMENTS)
+def test_lxml_serializes_like_html_parser(html):
+    redacted = {parser: redact(HtmlDocument(html, parser)) for parser in PARSERS}
+
+    assert redacted['lxml'] == redacted['html.parser']
+    assert '{NAME}' in redacted['lxml'] and 'John' not in redacted['lxml']
+
+
+@pytest.mark.parametrize('html', DOCUMENTS[:4])
+def test_fragments_are_not_wrapped(html):
+    redacted = redact(HtmlDocument(html, 'lxml'))
+
+    assert '<html>' not in redacted and '<body>' not in redacted and '<head>' not in redacted
+
+
+@pytest.fixture
+def no_word_fallback(monkeypatch):
+    def fail(nodes, redacted_text):
+        raise AssertionError(f"Fell back to word replacement for {redacted_text!r}")
+    monkeypatch.setattr(html_redaction, 'apply_words_to_nodes', fail)
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_entity_in_nested_tags(parser, no_word_fallback):
+    document = HtmlDocument('<div><p>Dear <b><i>John Smith</i></b>,</p><p>Claim <span><b>42</b></span></p></div>', parser)
+
+    assert redact(document) == '<div><p>Dear <b><i>{NAME}</i></b>,</p><p>Claim <span><b>42</b></span></p></div>'
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_entity_spanning_text_nodes(parser, no_word_fallback):
+    document = HtmlDocument('<p>Call John <b>Smith</b> today</p>', parser)
+
+    assert document.apply_redacted_text(document.text.replace('John  Smith', '{NAME}')) == '<p>Call {NAME}<b></b> today</p>'
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_entity_containing_the_following_literal(parser, no_word_fallback):
+    # The masked address contains " today", the literal that follows its placeholder
+    document = HtmlDocument('<p>Visit 12 today Street today</p>', parser)
+
+    assert document.apply_redacted_text(document.text.replace('12 today Street', '{ADDRESS}')) == '<p>Visit {ADDRESS} today</p>'
+
+
+def test_alignment_of_generated_outputs():
+    random_words = random.Random(7)
+    words = ['a', 'at', 'the', 'to', 'Bob', 'Ann', ',', '.', 'home']
+    for _ in range(5000):
+        tokens = [random_words.choice(words) for _ in range(random_words.randint(1, 12))]
+        text = ' '.join(tokens)
+        starts = [sum(len(token) + 1 for token in tokens[:index]) for index in range(len(tokens))]
+        spans = []
+        index = 0
+        while index < len(tokens):
+            if random_words.random() < 0.25:
+                last = min(len(tokens), index + random_words.randint(1, 3)) - 1
+                spans.append((starts[index], starts[last] + len(tokens[last]), '{NAME}'))
+                index = last + 2
+            else:
+                index += 1
+        redacted = apply_spans_to_text(text, spans)
+
+        aligned = align_redacted_text(text, redacted)
+
+        assert aligned is not None, (text, redacted)
+        assert apply_spans_to_text(text, aligned) == redacted
+
+
+def test_output_that_is_not_the_original_text_is_not_aligned():
+    assert align_redacted_text('Call John today', 'Call {NAME} tomorrow') is None
+    assert align_redacted_text('Call John today', 'Phone {NAME} today') is None
+    assert align_redacted_text('Call John', 'Call John today') is None
+
+
+def newsletter(rows):
+    cells = ''.join(
+        f'<tr><td class="name"><a href="mailto:user{row}@example.com">User {row}</a></td>'
+        f'<td><span style="color:#333">Account {row:06d}, 1{row:03d} Main Street</span></td></tr>'
+        for row in range(rows)
+    )
+    return f'<html><head><style>td {{ padding: 2px; }}</style></head><body><table>{cells}</table></body></html>'
+
+
+def parse_and_write_back(html, parser):
+    started = time.perf_counter()
+    document = HtmlDocument(html, parser)
+    document.apply_redacted_text(document.text.replace('Main Street', '{ADDRESS}'))
+    return time.perf_counter() - started
+
+
+def test_benchmark_parser_backends():
+    """
+    Parse and write-back time of a 3000 row newsletter body with each backend, best of three runs.
+    """
+    html = newsletter(3000)
+    timings = {parser: min(parse_and_write_back(html, parser) for _ in range(3)) for parser in PARSERS}
+    print(f"\nHTML parse and write-back of {len(html)} chars: " + ', '.join(f"{parser} {seconds:.3f}s" for parser, seconds in timings.items()))
+
+    assert timings['lxml'] < timings['html.parser']
@@ -0,0 +1,134 @@
+import boto3
+import pytest
+
+from idempotency import CASE_ALLOCATED, COMPLETED, IN_PROGRESS, REDACTED, IngestionLedger, ingestion_key
+
+
+@pytest.fixture
+def ledger(aws):
+    table = boto3.resource('dynamodb').create_table(
+        TableName='ingestion',
+        KeySchema=[{'AttributeName': 'IngestionKey', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'IngestionKey', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return IngestionLedger(table, lease_seconds=60)
+
+
+@pytest.fixture
+def ledger_ingestion(ingestion, ledger, monkeypatch):
+    monkeypatch.setattr(ingestion, 'ingestion_ledger', ledger)
+    return ingestion
+
+
+def unexpected_case_id():
+    raise AssertionError("A resumed ingestion allocated a new case ID")
+
+
+def cases(ingestion):
+    return {int(item['CaseID']): item for item in ingestion.table.get().scan()['Items'] if 'BodyStatus' in item}
+
+
+def test_claim_is_refused_while_leased(ledger):
+    record, claimed = ledger.claim('raw-bucket/email#etag')
+    assert claimed and record['IngestionStatus'] == IN_PROGRESS
+
+    record, claimed = ledger.claim('raw-bucket/email#etag')
+    assert not claimed and record['IngestionStatus'] == IN_PROGRESS
+
+
+def test_released_claim_resumes_from_its_checkpoint(ledger):
+    ledger.claim('key')
+    ledger.checkpoint('key', CASE_ALLOCATED, CaseID=1000001)
+    ledger.release('key')
+
+    record, claimed = ledger.claim('key')
+
+    assert claimed
+    assert record['Stage'] == CASE_ALLOCATED and record['CaseID'] == 1000001
+
+
+def test_expired_lease_can_be_claimed(ledger):
+    ledger.claim('key')
+    ledger.table.update_item(Key={'IngestionKey': 'key'}, UpdateExpression="SET LeaseExpiresAt = :expired", ExpressionAttributeValues={':expired': 1})
+
+    assert ledger.claim('key')[1]
+
+
+def test_completed_ingestion_is_never_claimed_again(ledger):
+    ledger.claim('key')
+    ledger.complete('key')
+    ledger.release('key')
+
+    record, claimed = ledger.claim('key')
+
+    assert not claimed and record['IngestionStatus'] == COMPLETED
+
+
+def test_ingestion_key_ignores_etag_quotes():
+    assert ingestion_key('raw-bucket', 'email', '"abc"') == ingestion_key('raw-bucket', 'email', 'abc') == 'raw-bucket/email#abc'
+
+
+def test_duplicate_after_completion_is_skipped(ledger_ingestion, raw_email):
+    email = raw_email('email', 'Please call John about the claim.')
+    assert ledger_ingestion.process_email(*email)['statusCode'] == 200
+    [case_id] = cases(ledger_ingestion)
+
+    response = ledger_ingestion.process_email(*email)
+
+    assert response == {'statusCode': 200, 'body': f'Email already processed for case_id: {case_id}'}
+    assert list(cases(ledger_ingestion)) == [case_id]
+
+
+def test_duplicate_in_progress_is_rejected(ledger_ingestion, ledger, raw_email):
+    email = raw_email('email', 'Please call John about the claim.')
+    etag = boto3.client('s3').head_object(Bucket=email[0], Key=email[1])['ETag']
+    # Another attempt holds the lease
+    ledger.claim(ingestion_key(*email, etag))
+
+    assert ledger_ingestion.process_email(*email, etag)['statusCode'] == 409
+    assert cases(ledger_ingestion) == {}
+
+
+def test_retry_after_a_failed_redaction_keeps_the_case_id(ledger_ingestion, raw_email, monkeypatch):
+    email = raw_email('email', 'Please call John about the claim.')
+
+    def throttled(content, **kwargs):
+        raise RuntimeError('Throttled')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ledger_ingestion.bedrock_runtime, 'apply_guardrail', throttled)
+        assert ledger_ingestion.process_email(*email)['statusCode'] == 500
+    [case_id] = cases(ledger_ingestion)
+    assert cases(ledger_ingestion)[case_id]['BodyStatus'] == 'Failed'
+
+    monkeypatch.setattr(ledger_ingestion, 'generate_case_id', unexpected_case_id)
+    assert ledger_ingestion.process_email(*email)['statusCode'] == 200
+
+    assert list(cases(ledger_ingestion)) == [case_id]
+    assert cases(ledger_ingestion)[case_id]['BodyStatus'] == 'Processed'
+
+
+def test_retry_after_a_failed_notification_resumes_after_the_redaction(ledger_ingestion, ledger, raw_email, monkeypatch):
+    email = raw_email('email', 'Please call John about the claim.')
+
+    def unavailable(*args):
+        raise RuntimeError('SNS unavailable')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ledger_ingestion, 'publish_success_notification', unavailable)
+        assert ledger_ingestion.process_email(*email)['statusCode'] == 500
+    [case_id] = cases(ledger_ingestion)
+    [record] = ledger.table.scan()['Items']
+    assert record['Stage'] == REDACTED and record['CaseID'] == case_id
+    assert cases(ledger_ingestion)[case_id]['BodyStatus'] == 'Processed'
+
+    def unexpected_redaction(fields):
+        raise AssertionError("A resumed ingestion redacted the email again")
+
+    monkeypatch.setattr(ledger_ingestion, 'generate_case_id', unexpected_case_id)
+    monkeypatch.setattr(ledger_ingestion, 'redact_pii_fields', unexpected_redaction)
+    assert ledger_ingestion.process_email(*email)['statusCode'] == 200
+
+    assert list(cases(ledger_ingestion)) == [case_id]
+    assert ledger.table.scan()['Items'][0]['IngestionStatus'] == COMPLETED
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'pii_redaction', 'lambda')
+
+# Import time allowed for a handler module in a fresh interpreter, clients and heavy libraries are created on first use
+IMPORT_BUDGET_MS = 300
+# Libraries only imported on the code path that needs them
+LAZY_MODULES = ['boto3', 'bs4', 'lxml', 'fitz', 'pymupdf', 'PIL', 'pytz']
+
+MEASURE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+print((time.perf_counter() - started) * 1000)
+print(','.join(name for name in {lazy_modules!r} if name in sys.modules))
+"""
+
+
+def measure_import(directory, module):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(LAMBDA_DIR, directory), os.path.join(LAMBDA_DIR, 'shared', 'python')]))
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE.format(module=module, lazy_modules=LAZY_MODULES)],
+        env=env, capture_output=True, text=True, check=True
+    )
+    milliseconds, imported = result.stdout.split('\n')[-3:-1]
+    return float(milliseconds), [name for name in imported.split(',') if name]
+
+
+@pytest.mark.parametrize('directory, module', [
+    ('emailProcessing', 'emailExtractRedact'),
+    ('attachmentProcessing', 'attachmentProcessing'),
+])
+def test_handler_import_stays_within_budget(directory, module):
+    # Best of three runs, the first one also pays for reading the files from disk
+    runs = [measure_import(directory, module) for _ in range(3)]
+    milliseconds = min(run[0] for run in runs)
+    print(f"\n{module} imports in {milliseconds:.0f} ms")
+
+    assert runs[-1][1] == []
+    assert milliseconds < IMPORT_BUDGET_MS
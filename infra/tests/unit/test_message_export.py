@@ -0,0 +1,77 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+
+from message_export import FAILED, RUNNING, ExportJobStore
+
+EXPORT_BUCKET = 'export-bucket'
+
+
+@pytest.fixture
+def export_jobs(inventory_table, portal_request, monkeypatch):
+    monkeypatch.setenv('EXPORT_JOBS_TABLE_NAME', 'export-jobs')
+    monkeypatch.setenv('EXPORT_BUCKET_NAME', EXPORT_BUCKET)
+    boto3.client('s3').create_bucket(Bucket=EXPORT_BUCKET)
+    table = boto3.resource('dynamodb').create_table(
+        TableName='export-jobs',
+        KeySchema=[{'AttributeName': 'JobID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'JobID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return ExportJobStore(table, 3600)
+
+
+def created(jobs, job_id, minutes_ago):
+    jobs.create(job_id, 1, f'exports/{job_id}/messages.csv')
+    jobs.table.update_item(
+        Key={'JobID': job_id},
+        UpdateExpression="SET CreatedTime = :created",
+        ExpressionAttributeValues={':created': (datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)).isoformat()}
+    )
+
+
+def test_job_running_past_the_timeout_is_failed(export_jobs, portal_request):
+    created(export_jobs, 'stuck', 30)
+    created(export_jobs, 'recent', 1)
+    for job_id in ('stuck', 'recent'):
+        assert export_jobs.start(job_id)
+
+    status, job = portal_request('/api/messages/export/stuck')
+    assert status == 200
+    assert job['status'] == FAILED and 'did not finish' in job['error']
+    assert portal_request('/api/messages/export/recent')[1]['status'] == RUNNING
+
+    # The export function finishing late does not turn the failed job into a completed one
+    assert not export_jobs.finish('stuck', 10)
+    assert export_jobs.get('stuck')['JobStatus'] == FAILED
+
+
+def test_expired_pending_job_is_not_started(export_jobs, portal_request):
+    import portal_api
+    created(export_jobs, 'queued', 30)
+
+    assert portal_request('/api/messages/export/queued')[1]['status'] == FAILED
+    assert portal_api.export_handler({'job_id': 'queued'}, None) == {'job_id': 'queued'}
+    assert export_jobs.get('queued')['JobStatus'] == FAILED
+
+
+def test_failed_abort_keeps_the_export_error(export_jobs, monkeypatch):
+    import portal_api
+
+    def failing_export(case_ids, upload):
+        raise ValueError('Throughput exceeded')
+
+    def failing_abort(upload):
+        raise RuntimeError('Access denied')
+
+    created(export_jobs, 'job', 0)
+    boto3.client('s3').put_object(Bucket=EXPORT_BUCKET, Key='exports/job/request.json', Body=json.dumps({'case_ids': [1]}))
+    monkeypatch.setattr(portal_api, 'export_rows', failing_export)
+    monkeypatch.setattr(portal_api.MultipartCsvUpload, 'abort', failing_abort)
+    portal_api.export_handler({'job_id': 'job'}, None)
+
+    job = export_jobs.get('job')
+    assert job['JobStatus'] == FAILED
+    assert job['Error'] == 'Throughput exceeded'
@@ -0,0 +1,75 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import pytest
+
+from pdf_pages import can_fork, find_word_rects, page_word_rects
+from phrase_matcher import PhraseMatcher
+
+PHRASES = ['John Smith', 'Kucsma', '555-0100']
+
+
+def make_pdf(pages):
+    pdf_document = fitz.open()
+    for page_num in range(pages):
+        page = pdf_document.new_page()
+        lines = [
+            f"Page {page_num}: the claim of policy {page_num:06d} was filed by John Smith on behalf of Maria Kucsma,"
+            if line % 5 == 0 else
+            f"who can be reached at 555-0100 or at {line} Main Street, Seattle, for the remainder of the claim {line}."
+            for line in range(45)
+        ]
+        page.insert_text((36, 36), '\n'.join(lines), fontsize=8)
+    return pdf_document.tobytes()
+
+
+def test_processes_find_the_rectangles_of_a_serial_search():
+    source = make_pdf(12)
+    pdf_document = fitz.open(stream=source, filetype='pdf')
+
+    expected = page_word_rects(pdf_document, PhraseMatcher(PHRASES), 0, pdf_document.page_count)
+    assert find_word_rects(source, PHRASES, pdf_document.page_count, 3) == expected
+    assert all(expected)
+
+
+def test_pages_are_searched_serially_from_a_thread(monkeypatch):
+    import attachmentProcessing
+
+    def forked_search(*args):
+        raise AssertionError("forked from a multi-threaded process")
+
+    monkeypatch.setattr(attachmentProcessing, 'find_word_rects', forked_search)
+    monkeypatch.setattr(attachmentProcessing, 'pdf_redaction_workers', 4)
+    monkeypatch.setattr(attachmentProcessing, 'pdf_parallel_min_pages', 1)
+    source = make_pdf(4)
+    pdf_document = fitz.open(stream=source, filetype='pdf')
+    entities = [{'text': phrase} for phrase in PHRASES]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        executor.submit(attachmentProcessing.redact_pdf_words, pdf_document, entities, source).result()
+        with pytest.raises(RuntimeError):
+            executor.submit(find_word_rects, source, PHRASES, 4, 2).result()
+
+    assert can_fork()
+
+
+@pytest.mark.parametrize('pages', [32, 128, 256])
+def test_benchmark_speedup_by_page_count(pages):
+    """
+    Word search time of the serial loop and of one process per vCPU (at least two), best of three runs.
+    """
+    workers = max(2, os.cpu_count() or 1)
+    source = make_pdf(pages)
+    pdf_document = fitz.open(stream=source, filetype='pdf')
+
+    def timed(search):
+        started = time.perf_counter()
+        rects = search()
+        return time.perf_counter() - started, rects
+
+    serial_seconds, expected = min(timed(lambda: page_word_rects(pdf_document, PhraseMatcher(PHRASES), 0, pages)) for _ in range(3))
+    parallel_seconds, rects = min(timed(lambda: find_word_rects(source, PHRASES, pages, workers)) for _ in range(3))
+    print(f"\n{pages} pages, {os.cpu_count()} vCPUs: serial {serial_seconds:.3f}s, {workers} processes {parallel_seconds:.3f}s, speedup {serial_seconds / parallel_seconds:.2f}x")
+
+    assert rects == expected
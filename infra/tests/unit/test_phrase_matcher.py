@@ -0,0 +1,91 @@
+import random
+import time
+
+import pytest
+
+from phrase_matcher import PhraseMatcher, normalize_token
+
+FIRST_NAMES = ['John', 'Maria', 'Wei', 'Fatima', 'Olga', 'Kwame']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Kucsma', 'Smith-Jones', 'Okafor']
+FILLER = ['the', 'claim', 'of', 'policy', 'was', 'filed', 'by', 'on', 'behalf', 'and', 'Street', 'Seattle', '555-0100']
+
+
+def brute_force_indices(phrases, words):
+    """
+    Reference matcher comparing the tokens of every phrase with the words at every position.
+    """
+    tokens = [normalize_token(word) for word in words]
+    indices = set()
+    for phrase in phrases:
+        phrase_tokens = [token for token in (normalize_token(part) for part in phrase.split()) if token]
+        if not phrase_tokens:
+            continue
+        for start in range(len(tokens) - len(phrase_tokens) + 1):
+            if tokens[start:start + len(phrase_tokens)] == phrase_tokens:
+                indices.update(range(start, start + len(phrase_tokens)))
+    return sorted(indices)
+
+
+def decorate(word, rng):
+    """
+    Changes the case of a word and adds punctuation around it, as it appears in extracted text.
+    """
+    word = rng.choice([word, word.upper(), word.lower()])
+    return rng.choice(['', '(', '"']) + word + rng.choice(['', ',', '.', ')', ':'])
+
+
+def entities(rng, count):
+    phrases = set()
+    while len(phrases) < count:
+        # Entities share tokens and prefixes with each other, e.g. "John", "John Smith" and "Smith Garcia"
+        phrases.add(' '.join(rng.sample(FIRST_NAMES + LAST_NAMES, rng.randint(1, 3))))
+    return sorted(phrases)
+
+
+def document(rng, phrases, pages, words_per_page=450):
+    words = []
+    while len(words) < pages * words_per_page:
+        if rng.random() < 0.05:
+            words.extend(decorate(word, rng) for word in rng.choice(phrases).split())
+        else:
+            words.append(decorate(rng.choice(FILLER + FIRST_NAMES + LAST_NAMES), rng))
+    return words[:pages * words_per_page]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_brute_force_reference(seed):
+    rng = random.Random(seed)
+    phrases = entities(rng, rng.randint(1, 12))
+    words = document(rng, phrases, 2, words_per_page=200)
+
+    assert PhraseMatcher(phrases).matched_indices(words) == brute_force_indices(phrases, words)
+
+
+def test_entity_is_matched_only_as_a_whole():
+    words = ['John', 'called.', 'JOHN', 'SMITH,', 'lives', 'at', '(Smith', 'Street)']
+    matcher = PhraseMatcher(['John Smith', 'Smith Street', ' ', '--'])
+
+    assert matcher.find(words) == [(2, 4), (6, 8)]
+    assert matcher.matched_indices(words) == [2, 3, 6, 7]
+    assert not PhraseMatcher(['', '...'])
+
+
+def test_benchmark_matching_150_pages():
+    """
+    Matching time of 60 entities against the 67,500 words of a 150 page document, best of three runs.
+    """
+    rng = random.Random(0)
+    phrases = entities(rng, 60)
+    words = document(rng, phrases, 150)
+
+    def timed(match):
+        started = time.perf_counter()
+        indices = match()
+        return time.perf_counter() - started, indices
+
+    matcher_seconds, matched = min(timed(lambda: PhraseMatcher(phrases).matched_indices(words)) for _ in range(3))
+    reference_seconds, expected = min(timed(lambda: brute_force_indices(phrases, words)) for _ in range(3))
+    print(f"\nMatching {len(phrases)} entities against {len(words)} words: PhraseMatcher {matcher_seconds:.3f}s, brute force {reference_seconds:.3f}s")
+
+    assert matched == expected
+    assert matcher_seconds < reference_seconds
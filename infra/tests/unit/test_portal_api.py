@@ -0,0 +1,47 @@
+def test_case_id_counter_is_not_a_message(inventory_table, portal_request):
+    inventory_table.put_item(Item={'CaseID': 0, 'NextCaseID': 10})
+
+    assert portal_request('/api/messages/0')[0] == 404
+    assert portal_request('/api/messages/not-a-number')[0] == 404
+
+
+def put_message(table, case_id, **attributes):
+    table.put_item(Item={
+        'CaseID': case_id,
+        'BodyStatus': 'Processed',
+        'StatusShard': f'Processed#{case_id % 8}',
+        'EmailReceiveTime': f'2026-10-17T10:00:{case_id:02d}+00:00',
+        'EmailSubject': f'Claim {case_id}',
+        **attributes
+    })
+
+
+def test_listing_returns_the_body_preview_as_redacted_body(inventory_table, portal_request):
+    for case_id in (1, 2):
+        put_message(inventory_table, case_id, EmailBody=f'Claim of {{NAME}} number {case_id}')
+
+    status, page = portal_request('/api/messages')
+    items = page['items']
+
+    assert status == 200
+    assert [item['RedactedBody'] for item in items] == ['Claim of {NAME} number 2', 'Claim of {NAME} number 1']
+    assert 'RedactedBody' not in portal_request('/api/messages', query={'fields': 'CaseID,EmailSubject'})[1]['items'][0]
+
+
+def test_listing_is_paged_by_default(inventory_table, portal_request, monkeypatch):
+    import portal_api
+    monkeypatch.setattr(portal_api, 'DEFAULT_PAGE_SIZE', 4)
+    for case_id in range(1, 11):
+        put_message(inventory_table, case_id)
+
+    listed = []
+    query = None
+    while True:
+        status, page = portal_request('/api/messages', query=query)
+        assert status == 200 and len(page['items']) <= 4
+        listed += [int(item['CaseID']) for item in page['items']]
+        if page['next_token'] is None:
+            break
+        query = {'next_token': page['next_token']}
+
+    assert listed == list(range(10, 0, -1))
@@ -0,0 +1,92 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from redaction_cache import RedactionCache
+
+
+def create_cache_table():
+    dynamodb = boto3.resource('dynamodb')
+    return dynamodb.create_table(
+        TableName='redaction-cache',
+        KeySchema=[{'AttributeName': 'TextHash', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'TextHash', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def test_hit_returns_text_aligned_with_the_lookup():
+    cache = RedactionCache('guardrail', '1')
+    cache.put_many({'Call  John   now': 'Call  {NAME}   now'})
+
+    assert cache.get_many(['Call John now']) == {}
+    assert cache.get_many(['Call  John   now']) == {'Call  John   now': 'Call  {NAME}   now'}
+
+
+def test_redacted_html_is_aligned_after_a_cache_hit_on_other_whitespace(monkeypatch):
+    import emailExtractRedact
+
+    monkeypatch.setattr(emailExtractRedact, 'redaction_cache', RedactionCache('guardrail', '1'))
+    monkeypatch.setattr(emailExtractRedact, 'apply_guardrail_blocks', lambda texts: [text.replace('John', '{NAME}') for text in texts])
+    emailExtractRedact.redact_pii_fields({'text': 'Call  John   now'})
+
+    html = '<p>Call <b>John</b> now</p>'
+    redacted = emailExtractRedact.redact_pii(emailExtractRedact.extract_text_from_html(html), html, 'html')
+
+    assert redacted.count('{NAME}') == 1
+    assert 'John' not in redacted
+    assert '<b>{NAME}</b>' in redacted
+
+
+@mock_aws
+def test_shared_keys_are_keyed_hashes():
+    table = create_cache_table()
+    cache = RedactionCache('guardrail', '1', table=table, hash_key=lambda: b'secret')
+    cache.put_many({'John Smith': '{NAME}'})
+
+    keys = [item['TextHash'] for item in table.scan()['Items']]
+    other_key = RedactionCache('guardrail', '1', table=table, hash_key=lambda: b'other').key('John Smith')
+    unkeyed = RedactionCache('guardrail', '1').key('John Smith')
+    assert keys == [cache.key('John Smith')]
+    assert keys[0] not in (other_key, unkeyed)
+
+    fresh = RedactionCache('guardrail', '1', table=table, hash_key=lambda: b'secret')
+    assert fresh.get_many(['John Smith']) == {'John Smith': '{NAME}'}
+    assert fresh.stats()['shared_hits'] == 1
+
+
+def test_shared_tier_requires_a_hash_key():
+    with pytest.raises(ValueError):
+        RedactionCache('guardrail', '1', table=object())
+
+
+@mock_aws
+def test_hash_key_is_fetched_once_outside_the_lock():
+    fetched = []
+
+    def hash_key():
+        assert not cache.lock.locked()
+        fetched.append(True)
+        return b'secret'
+
+    cache = RedactionCache('guardrail', '1', table=create_cache_table(), hash_key=hash_key)
+    cache.get_many(['John Smith', 'Jane Doe'])
+    cache.put_many({'John Smith': '{NAME}'})
+    cache.get_many(['John Smith'])
+
+    assert fetched == [True]
+
+
+def test_counts_are_taken_as_deltas():
+    cache = RedactionCache('guardrail', '1', max_entries=1)
+    cache.get_many(['John Smith'])
+    cache.put_many({'John Smith': '{NAME}', 'Jane Doe': '{NAME}'})
+    cache.get_many(['Jane Doe'])
+
+    assert cache.take_counts() == {
+        'RedactionCacheLocalHits': 1,
+        'RedactionCacheSharedHits': 0,
+        'RedactionCacheMisses': 1,
+        'RedactionCacheEvictions': 1
+    }
+    assert set(cache.take_counts().values()) == {0}
@@ -0,0 +1,111 @@
+import time
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from s3_upload import MIN_PART_SIZE, upload_objects, upload_stream
+
+BUCKET = 'redacted-bucket'
+
+
+class FailingPart:
+    """
+    S3 client whose upload of the given part fails, and whose multipart abort can be denied.
+    """
+
+    def __init__(self, s3, failing_part, deny_abort=False):
+        self.s3 = s3
+        self.failing_part = failing_part
+        self.deny_abort = deny_abort
+
+    def upload_part(self, **kwargs):
+        if kwargs['PartNumber'] == self.failing_part:
+            raise ConnectionError('part upload failed')
+        return self.s3.upload_part(**kwargs)
+
+    def abort_multipart_upload(self, **kwargs):
+        if self.deny_abort:
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'AbortMultipartUpload')
+        return self.s3.abort_multipart_upload(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+
+@pytest.fixture
+def s3(aws):
+    client = boto3.client('s3')
+    client.create_bucket(Bucket=BUCKET)
+    return client
+
+
+def chunks(parts):
+    for part in range(parts):
+        yield bytes([part]) * MIN_PART_SIZE
+
+
+def test_failed_upload_is_aborted(s3):
+    with pytest.raises(ConnectionError):
+        upload_stream(FailingPart(s3, failing_part=3), BUCKET, 'attachment.bin', chunks(6), part_size=MIN_PART_SIZE, max_workers=2)
+
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []) == []
+
+
+def test_denied_abort_does_not_hide_the_upload_error(s3):
+    with pytest.raises(ConnectionError):
+        upload_stream(FailingPart(s3, failing_part=2, deny_abort=True), BUCKET, 'attachment.bin', chunks(4), part_size=MIN_PART_SIZE, max_workers=2)
+
+
+class Latency:
+    """
+    S3 client adding a fixed round trip time to every request, moto answers in-process without any network latency.
+    """
+
+    def __init__(self, s3, seconds):
+        self.s3 = s3
+        self.seconds = seconds
+
+    def __getattr__(self, name):
+        method = getattr(self.s3, name)
+
+        def call(**kwargs):
+            time.sleep(self.seconds)
+            return method(**kwargs)
+        return call
+
+
+def test_multipart_parts_are_assembled_in_order(s3):
+    content = b''.join(chunks(7)) + b'tail'
+
+    size = upload_stream(s3, BUCKET, 'attachment.bin', iter([content[i:i + 1000003] for i in range(0, len(content), 1000003)]), part_size=MIN_PART_SIZE, max_workers=4)
+
+    assert size == len(content)
+    assert s3.get_object(Bucket=BUCKET, Key='attachment.bin')['Body'].read() == content
+
+
+def test_benchmark_email_save(s3):
+    """
+    Time to save the bodies and 20 attachments of an email with serial puts and with the upload stage, at 20 ms per S3 request.
+    """
+    client = Latency(s3, 0.02)
+    objects = [(f'case/attachments/file{index}.pdf', bytes([index]) * 64 * 1024) for index in range(20)]
+    objects += [('case/body/email_body.txt', b'body' * 1000), ('case/body/email_body.html', b'<p>body</p>' * 1000)]
+    objects.append(('case/attachments/scan.tiff', b'x' * (3 * MIN_PART_SIZE + 1)))
+
+    started = time.perf_counter()
+    for key, body in objects:
+        client.put_object(Bucket=BUCKET, Key=key, Body=body)
+    serial = time.perf_counter() - started
+
+    started = time.perf_counter()
+    timings = upload_objects([
+        (key, lambda key=key, body=body: upload_stream(client, BUCKET, key, [body], part_size=MIN_PART_SIZE, max_workers=4))
+        for key, body in objects
+    ], max_workers=8)
+    concurrent = time.perf_counter() - started
+    print(f"\nSaving {len(objects)} objects: serial puts {serial:.2f}s, upload stage {concurrent:.2f}s, "
+          f"slowest object {max(seconds for _, _, seconds in timings):.2f}s")
+
+    assert [key for key, _, _ in timings] == [key for key, _ in objects]
+    assert concurrent < serial
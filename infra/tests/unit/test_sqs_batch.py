@@ -0,0 +1,55 @@
+import json
+
+
+def sqs_message(message_id, *emails):
+    body = {'Records': [
+        {'eventSource': 'aws:s3', 's3': {'bucket': {'name': bucket}, 'object': {'key': key}}}
+        for bucket, key in emails
+    ]}
+    return {'messageId': message_id, 'eventSource': 'aws:sqs', 'body': json.dumps(body)}
+
+
+def processed_bodies(ingestion):
+    return sorted(item['EmailBody'].strip() for item in ingestion.table.get().scan()['Items'] if item.get('BodyStatus') == 'Processed')
+
+
+def test_failing_email_reports_only_its_message(ingestion, raw_email):
+    first = raw_email('first', 'Please call John about the claim.')
+    second = raw_email('second', 'John sent the invoice.')
+    missing = (first[0], 'missing')
+
+    response = ingestion.lambda_handler({'Records': [
+        sqs_message('message-1', first),
+        sqs_message('message-2', missing),
+        sqs_message('message-3', second)
+    ]}, None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-2'}]}
+    assert processed_bodies(ingestion) == ['Please call {NAME} about the claim.', '{NAME} sent the invoice.']
+
+
+def test_message_fails_when_any_of_its_emails_fails(ingestion, raw_email):
+    first = raw_email('first', 'Please call John about the claim.')
+
+    response = ingestion.lambda_handler({'Records': [
+        sqs_message('message-1', first, (first[0], 'missing')),
+        sqs_message('message-2')
+    ]}, None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert processed_bodies(ingestion) == ['Please call {NAME} about the claim.']
+
+
+def test_unparsable_message_does_not_fail_the_batch(ingestion, raw_email):
+    first = raw_email('first', 'Please call John about the claim.')
+    second = raw_email('second', 'John sent the invoice.')
+
+    response = ingestion.lambda_handler({'Records': [
+        sqs_message('message-1', first),
+        {'messageId': 'message-2', 'eventSource': 'aws:sqs', 'body': 'not json'},
+        {'messageId': 'message-3', 'eventSource': 'aws:sqs', 'body': json.dumps({'Records': [{'s3': {}}]})},
+        sqs_message('message-4', second)
+    ]}, None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-2'}, {'itemIdentifier': 'message-3'}]}
+    assert processed_bodies(ingestion) == ['Please call {NAME} about the claim.', '{NAME} sent the invoice.']
@@ -0,0 +1,50 @@
+def redaction_records(sink):
+    return [record for record in sink.records if record.get('Stage') == 'Step 6']
+
+
+def test_guardrail_chars_are_counted_for_short_emails(ingestion, raw_email):
+    email = raw_email('short', 'Please call John about the claim.')
+
+    assert ingestion.process_email(*email)['statusCode'] == 200
+
+    [record] = redaction_records(ingestion.sink)
+    assert record['GuardrailInputChars'] == ingestion.bedrock_runtime.input_chars > 0
+    assert record['GuardrailOutputChars'] == ingestion.bedrock_runtime.output_chars > 0
+
+
+def test_guardrail_chars_are_counted_for_chunked_emails(ingestion, raw_email, monkeypatch):
+    monkeypatch.setattr(ingestion, 'guardrail_chunk_chars', 400)
+    monkeypatch.setattr(ingestion, 'guardrail_chunk_overlap', 40)
+    email = raw_email('long', ' '.join(f'Sentence {index} mentions John.' for index in range(200)))
+
+    assert ingestion.process_email(*email)['statusCode'] == 200
+
+    [record] = redaction_records(ingestion.sink)
+    assert record['GuardrailInputChars'] == ingestion.bedrock_runtime.input_chars > 5000
+    assert record['GuardrailOutputChars'] == ingestion.bedrock_runtime.output_chars > 5000
+
+
+def test_local_sink_reports_stage_percentiles(ingestion, raw_email):
+    for index in range(20):
+        email = raw_email(f'email{index}', f'Message {index} for John, reference {index * 7919}.')
+        assert ingestion.process_email(*email)['statusCode'] == 200
+
+    summary = ingestion.sink.summary()
+    for stage in ('Step 1', 'Step 3', 'Step 4', 'Step 5', 'Step 6', 'Step 9', 'Step 10', 'Step 12'):
+        assert summary[stage]['count'] == 20
+        assert 0 <= summary[stage]['p50'] <= summary[stage]['p99']
+    print('\n' + '\n'.join(f"{stage}: p50 {stats['p50']:.2f} ms, p99 {stats['p99']:.2f} ms" for stage, stats in summary.items()))
+
+
+def test_redaction_cache_counts_are_emitted_as_metrics(ingestion, raw_email):
+    for key in ('first', 'second'):
+        email = raw_email(key, 'Please call John about the claim.')
+        assert ingestion.process_email(*email)['statusCode'] == 200
+
+    records = [record for record in ingestion.sink.records if 'RedactionCacheMisses' in record]
+    assert [metric['Name'] for metric in records[0]['_aws']['CloudWatchMetrics'][0]['Metrics']] == [
+        'RedactionCacheLocalHits', 'RedactionCacheSharedHits', 'RedactionCacheMisses', 'RedactionCacheEvictions'
+    ]
+    assert records[0]['RedactionCacheMisses'] > 0 and records[0]['RedactionCacheLocalHits'] == 0
+    # The second email repeats the first one, its paragraphs are all served from the cache
+    assert records[-1]['RedactionCacheLocalHits'] > 0 and records[-1]['RedactionCacheMisses'] == 0
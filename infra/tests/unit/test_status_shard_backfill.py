@@ -0,0 +1,34 @@
+from status_shard_backfill import backfill, handler
+
+
+def test_messages_written_before_the_index_are_listed_after_the_backfill(inventory_table, portal_request, monkeypatch):
+    for case_id in range(1, 31):
+        item = {
+            'CaseID': case_id,
+            'BodyStatus': 'Processed' if case_id % 3 else 'Failed',
+            'EmailReceiveTime': f'2026-10-17T10:00:{case_id:02d}+00:00',
+            'EmailBody': f'Message {case_id}'
+        }
+        if case_id > 20:
+            item['StatusShard'] = f"{item['BodyStatus']}#{case_id % 8}"
+        inventory_table.put_item(Item=item)
+    inventory_table.put_item(Item={'CaseID': 0, 'NextCaseID': 31})
+    assert len(portal_request('/api/messages')[1]['items']) == 6
+
+    assert backfill(inventory_table, 8, segments=3) == 20
+    assert backfill(inventory_table, 8, segments=3) == 0
+
+    items = portal_request('/api/messages')[1]['items']
+    assert [int(item['CaseID']) for item in items] == [case_id for case_id in range(30, 0, -1) if case_id % 3]
+    assert inventory_table.get_item(Key={'CaseID': 3})['Item']['StatusShard'] == 'Failed#3'
+    assert 'StatusShard' not in inventory_table.get_item(Key={'CaseID': 0})['Item']
+
+
+def test_custom_resource_backfills_on_create_and_update_only(inventory_table, monkeypatch):
+    monkeypatch.setenv('STATUS_SHARDS', '8')
+    inventory_table.put_item(Item={'CaseID': 1, 'BodyStatus': 'Processed', 'EmailReceiveTime': '2026-10-17T10:00:00+00:00'})
+
+    assert handler({'RequestType': 'Delete', 'PhysicalResourceId': 'StatusShardBackfill'}, None) == {'PhysicalResourceId': 'StatusShardBackfill'}
+    assert 'StatusShard' not in inventory_table.get_item(Key={'CaseID': 1})['Item']
+    assert handler({'RequestType': 'Create'}, None)['Data'] == {'Updated': 1}
+    assert inventory_table.get_item(Key={'CaseID': 1})['Item']['StatusShard'] == 'Processed#1'
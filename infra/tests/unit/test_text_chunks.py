@@ -0,0 +1,92 @@
+import pytest
+
+from text_chunks import apply_spans_to_text, merge_spans, split_into_chunks, with_overlap
+
+
+def assert_covers(text, chunks, max_chars):
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(text)
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+    assert all(0 < end - start <= max_chars for start, end in chunks)
+
+
+@pytest.mark.parametrize('length', [99, 100])
+def test_text_up_to_the_limit_is_one_chunk(length):
+    assert split_into_chunks('a' * length, 100) == [(0, length)]
+
+
+def test_text_over_the_limit_is_cut_at_the_limit_without_boundaries():
+    text = 'a' * 250
+
+    chunks = split_into_chunks(text, 100)
+
+    assert chunks == [(0, 100), (100, 200), (200, 250)]
+
+
+def test_chunks_end_at_the_strongest_boundary_of_their_second_half():
+    first = 'Claim filed. ' * 3 + 'Second sentence of the first paragraph'
+    text = first + '\n\n' + 'Another paragraph. ' * 10
+
+    chunks = split_into_chunks(text, 80)
+
+    assert_covers(text, chunks, 80)
+    assert text[:chunks[0][1]] == first + '\n\n'
+    assert all(text[end - 2:end] == '. ' for _, end in chunks[1:-1])
+
+
+def test_chunks_never_exceed_the_limit():
+    text = ' '.join(f'word{index}' + ('.' if index % 9 == 0 else '') + ('\n\n' if index % 31 == 0 else '') for index in range(2000))
+
+    for max_chars in (50, 97, 400, 20000):
+        assert_covers(text, split_into_chunks(text, max_chars), max_chars)
+
+
+def test_overlap_is_clamped_to_the_text():
+    assert with_overlap('a' * 100, 0, 40, 10) == (0, 50)
+    assert with_overlap('a' * 100, 60, 100, 10) == (50, 100)
+
+
+def test_overlapping_spans_are_masked_once():
+    text = 'Call John Smith today'
+    spans = merge_spans([(5, 15, '{NAME}'), (5, 15, '{NAME}'), (10, 15, '{NAME}'), (5, 9, '{NAME}')])
+
+    assert spans == [(5, 15, '{NAME}')]
+    assert apply_spans_to_text(text, spans) == 'Call {NAME} today'
+
+
+def test_span_extending_the_previous_one_is_merged_into_it():
+    text = 'Call John Smith Jr today'
+
+    assert apply_spans_to_text(text, merge_spans([(5, 15, '{NAME}'), (10, 18, '{NAME}')])) == 'Call {NAME} today'
+
+
+def test_adjacent_spans_are_each_masked_once():
+    text = 'Ref 5550100John'
+    spans = merge_spans([(4, 11, '{PHONE}'), (11, 15, '{NAME}')])
+
+    assert spans == [(4, 11, '{PHONE}'), (11, 15, '{NAME}')]
+    assert apply_spans_to_text(text, spans) == 'Ref {PHONE}{NAME}'
+
+
+def test_entity_straddling_two_chunks_is_masked_once_through_the_overlap(monkeypatch):
+    import emailExtractRedact
+    monkeypatch.setattr(emailExtractRedact, 'guardrail_chunk_chars', 120)
+    monkeypatch.setattr(emailExtractRedact, 'guardrail_chunk_overlap', 20)
+    requests = []
+
+    def guardrail(texts):
+        requests.append(texts)
+        # An entity is only detected when the chunk holds it whole
+        return [text.replace('John Smith', '{NAME}') for text in texts]
+
+    monkeypatch.setattr(emailExtractRedact, 'apply_guardrail_blocks', guardrail)
+    text = ' '.join(['policy holder'] * 3 + ['John Smith'] + ['reported the claim'] * 2) * 12
+    core_chars = max(120 - 2 * 20, 120 // 2)
+    entities = [index for index in range(len(text)) if text.startswith('John Smith', index)]
+    boundaries = [end for _, end in split_into_chunks(text, core_chars)[:-1]]
+    assert any(start < boundary < start + len('John Smith') for start in entities for boundary in boundaries)
+
+    [redacted] = emailExtractRedact.redact_blocks([text])
+
+    assert redacted == text.replace('John Smith', '{NAME}')
+    assert all(len(block) <= 120 for request in requests for block in request)